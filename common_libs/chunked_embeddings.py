@@ -0,0 +1,68 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+from langchain_core.embeddings import Embeddings
+from tokenization import TextTokenizer
+import math
+
+class ChunkedEmbeddings(Embeddings):
+    """Embeds texts longer than the model's input window instead of letting them be truncated.
+
+    Each over-long text is split locally into overlapping token windows, the windows of all the texts
+    are embedded in a single batched call, and the vectors of a text's windows are pooled
+    (element-wise mean or max, then L2-normalized) into one vector.
+    Texts that fit in one window are embedded as they are."""
+
+    # room for the special tokens the model adds around each input (e.g. [CLS] and [SEP])
+    _SPECIAL_TOKENS = 2
+
+    def __init__(self, embeddings, tokenizer: TextTokenizer, max_tokens=512, overlap_tokens=64, pooling="mean"):
+        if pooling not in ("mean", "max"):
+            raise ValueError(f"Unsupported pooling: {pooling}")
+
+        self._embeddings = embeddings
+        self._tokenizer = tokenizer
+        self._window_tokens = max(1, max_tokens - self._SPECIAL_TOKENS)
+        self._overlap_tokens = min(overlap_tokens, self._window_tokens // 2)
+        self.pooling = pooling
+
+    def __getattr__(self, name):
+        # e.g. model_id of the wrapped model
+        return getattr(self._embeddings, name)
+
+    def split(self, text: str) -> list[str]:
+        return self._tokenizer.split(text, self._window_tokens, self._overlap_tokens)
+
+    def embed_documents_chunks(self, texts: list[str]) -> list[list[list[float]]]:
+        """Return the vectors of the windows of each text, without pooling them"""
+        windows_by_text = [self.split(text) for text in texts]
+        all_windows = [window for windows in windows_by_text for window in windows]
+        all_vectors = self._embeddings.embed_documents(all_windows) if all_windows else []
+
+        vectors_by_text, position = [], 0
+        for windows in windows_by_text:
+            vectors_by_text.append(all_vectors[position:position + len(windows)])
+            position += len(windows)
+        return vectors_by_text
+
+    def _pool(self, vectors: list[list[float]]) -> list[float]:
+        if len(vectors) == 1:
+            return vectors[0]
+
+        if self.pooling == "max":
+            pooled = [max(values) for values in zip(*vectors)]
+        else:
+            pooled = [sum(values) / len(vectors) for values in zip(*vectors)]
+
+        norm = math.sqrt(sum(value * value for value in pooled))
+        return [value / norm for value in pooled] if norm > 0 else pooled
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._pool(vectors) for vectors in self.embed_documents_chunks(texts)]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,141 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# A response cache for the LLMs with greedy decoding. With greedy decoding, a generation is a pure function
+# of the model, its parameters and the prompt, so a repeated prompt (a greeting, a demo replay,
+# a regression run) can be answered from the cache instead of calling watsonx again.
+# It plugs into LangChain as the `cache` of an LLM, see WatsonxClient.request_llm.
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.outputs import Generation
+from threading import Lock
+from typing import Any
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+class LLMResponseCache(BaseCache):
+    """A SQLite-backed LLM response cache.
+
+    Entries are keyed by sha256(llm_string, prompt). LangChain's llm_string describes the model id, the model
+    parameters and the stop sequences, so any change of them is a different entry.
+    Entries expire after ttl_seconds (None for never), and the least recently used ones are evicted
+    when the store grows over max_disk_bytes. Set db_path to None to keep the cache in memory only"""
+
+    def __init__(self, db_path=None, ttl_seconds: float | None = 7 * 24 * 3600, max_disk_bytes=256 * 1024 * 1024):
+        self._lock = Lock()
+        self._ttl_seconds = ttl_seconds
+        self._max_disk_bytes = max_disk_bytes
+
+        self._hits = 0
+        self._misses = 0
+        self._expirations = 0
+        self._evictions = 0
+
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+
+        # the connection is shared by the threads of the agents, guarded by self._lock
+        self._db = sqlite3.connect(db_path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS llm_responses (
+                                key_sha256 TEXT PRIMARY KEY,
+                                generations TEXT NOT NULL,
+                                created_at REAL NOT NULL,
+                                last_access REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_last_access ON llm_responses(last_access)")
+        self._db.commit()
+        self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(generations)), 0) FROM llm_responses").fetchone()[0]
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> RETURN_VAL_TYPE | None:
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            row = self._db.execute("SELECT generations, created_at FROM llm_responses WHERE key_sha256=?", (key,)).fetchone()
+            now = time.time()
+            if row and self._ttl_seconds is not None and now - row[1] > self._ttl_seconds:
+                self._db.execute("DELETE FROM llm_responses WHERE key_sha256=?", (key,))
+                self._disk_bytes -= len(row[0])
+                self._db.commit()
+                self._expirations += 1
+                row = None
+
+            if not row:
+                self._misses += 1
+                return None
+
+            self._db.execute("UPDATE llm_responses SET last_access=? WHERE key_sha256=?", (now, key))
+            self._db.commit()
+            self._hits += 1
+
+        return [Generation(text=generation["text"], generation_info=generation.get("generation_info"))
+                for generation in json.loads(row[0])]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        try:
+            generations = json.dumps([{"text": generation.text, "generation_info": generation.generation_info}
+                                      for generation in return_val])
+        except (TypeError, ValueError):
+            return # e.g. non-serializable generation info, not worth failing the call for
+
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            previous = self._db.execute("SELECT LENGTH(generations) FROM llm_responses WHERE key_sha256=?", (key,)).fetchone()
+            now = time.time()
+            self._db.execute("INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?)", (key, generations, now, now))
+            self._disk_bytes += len(generations) - (previous[0] if previous else 0)
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        """Drop the least recently used entries until the store is back under 90% of its size limit.
+        The caller must hold the lock"""
+        if self._disk_bytes <= self._max_disk_bytes:
+            return
+
+        target_bytes = int(self._max_disk_bytes * 0.9)
+        while self._disk_bytes > target_bytes:
+            rows = self._db.execute("SELECT rowid, LENGTH(generations) FROM llm_responses ORDER BY last_access LIMIT 500").fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+
+            evicted_rows = []
+            for rowid, size in rows:
+                evicted_rows.append((rowid,))
+                self._disk_bytes -= size
+                if self._disk_bytes <= target_bytes:
+                    break
+            self._db.executemany("DELETE FROM llm_responses WHERE rowid=?", evicted_rows)
+            self._evictions += len(evicted_rows)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM llm_responses")
+            self._db.commit()
+            self._disk_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "entries": self._db.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0],
+                "disk_bytes": self._disk_bytes,
+                "expirations": self._expirations,
+                "evictions": self._evictions
+            }
@@ -0,0 +1,99 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# Offline stand-ins for the watsonx embedding models, selected with the environment variable EMBEDDING_BACKEND:
+# - "watsonx" (default): the real models on watsonx
+# - "hashing": a deterministic feature-hashing embedder, with the same dimensions as ibm/slate-30m-english-rtrvr.
+#   The vectors carry no real semantics (only shared words make texts similar), but they are cheap, stable
+#   across runs and need no network, which is what load tests and benchmarks need.
+# - "local": a sentence-transformers model loaded from the path given by LOCAL_EMBEDDING_MODEL_PATH
+# LOCAL_EMBEDDING_LATENCY_MS adds a fixed delay to each call of a local backend to emulate the upstream latency.
+
+from langchain_core.embeddings import Embeddings
+import hashlib
+import math
+import os
+import re
+import time
+
+SLATE_30M_DIMENSIONS = 384
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+def get_embedding_backend() -> str:
+    return os.getenv("EMBEDDING_BACKEND", "watsonx").lower()
+
+def _get_latency_seconds() -> float:
+    return float(os.getenv("LOCAL_EMBEDDING_LATENCY_MS", "0")) / 1000
+
+class HashingEmbeddings(Embeddings):
+    """Embeds a text by hashing its words and word bigrams into a fixed number of signed buckets,
+    followed by L2 normalization. The same text always gets the same vector."""
+
+    def __init__(self, model_id="local/hashing", dimensions=SLATE_30M_DIMENSIONS, latency_seconds=0.0):
+        self.model_id = model_id
+        self.dimensions = dimensions
+        self._latency_seconds = latency_seconds
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.dimensions
+        words = _TOKEN_PATTERN.findall(text.lower())
+        features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+        for feature in features:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            # the lowest bit decides the sign, so that collisions tend to cancel out rather than add up
+            vector[(digest >> 1) % self.dimensions] += 1.0 if digest & 1 else -1.0
+
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm > 0:
+            vector = [value / norm for value in vector]
+        return vector
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self._latency_seconds:
+            time.sleep(self._latency_seconds)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """A sentence-transformers model loaded from a local directory (no download at run time)"""
+
+    def __init__(self, model_path: str, model_id=None, latency_seconds=0.0):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("The 'local' embedding backend requires sentence-transformers: pip install sentence-transformers")
+
+        self.model_id = model_id or f"local/{os.path.basename(os.path.normpath(model_path))}"
+        self._model = SentenceTransformer(model_path, local_files_only=True)
+        self.dimensions = self._model.get_sentence_embedding_dimension()
+        self._latency_seconds = latency_seconds
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self._latency_seconds:
+            time.sleep(self._latency_seconds)
+        return self._model.encode(texts, normalize_embeddings=True).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+def request_local_embedding_model(backend: str | None = None) -> Embeddings:
+    """Return the local embedding model of the given backend (by default the one set by EMBEDDING_BACKEND)"""
+    backend = backend or get_embedding_backend()
+
+    if backend == "hashing":
+        return HashingEmbeddings(latency_seconds=_get_latency_seconds())
+    elif backend == "local":
+        model_path = os.getenv("LOCAL_EMBEDDING_MODEL_PATH")
+        if not model_path:
+            raise ValueError("LOCAL_EMBEDDING_MODEL_PATH must be set when EMBEDDING_BACKEND=local")
+        return SentenceTransformerEmbeddings(model_path, latency_seconds=_get_latency_seconds())
+    else:
+        raise ValueError(f"Unknown embedding backend: {backend}")
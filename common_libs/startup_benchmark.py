@@ -0,0 +1,127 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# A startup benchmark of the entry points of the examples, based on `python -X importtime`.
+#
+# Each entry point module is imported in a fresh interpreter (from its own directory, as when it is run),
+# a few times, and the median import time is compared with the budget of the entry point.
+# The slowest imports of each entry point are listed, to show what to defer next.
+# The script exits with code 1 when an entry point is over its budget, so it can gate a CI job.
+#
+#   $ cd common_libs
+#   $ python startup_benchmark.py
+#   $ python startup_benchmark.py --budget rag_agent=0.5 --runs 5 --output startup.json
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (directory, module, budget in seconds). Importing an entry point must not load the watsonx SDK,
+# LangChain or the Weaviate client: they are loaded when the first model or agent is requested
+ENTRY_POINTS = [
+    ("wx-rag-with-granite3", "rag_agent", 0.5),
+    ("wx-rag-with-granite3", "rag_sl", 1.5), # streamlit itself is imported at startup
+    ("wx-tech-support-agent", "tech_support_agent", 0.5),
+    ("wx-tech-support-agent", "tech_support_sl", 1.5), # streamlit itself is imported at startup
+    ("wx-q-learning-robotic-agent", "grid_world_app", 2.0), # pygame, gymnasium and numpy are needed to start
+    ("wx-weaviate-embedding-api", "weavite_text2vec_watsonx_api", 2.0), # the model is connected on a background thread
+    ("wx-weaviate-embedding-api", "weavite_text2vec_watsonx_asgi", 2.0),
+]
+
+# import time: self [us] | cumulative | imported package
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def parse_import_times(stderr: str) -> list[tuple[str, int, int, int]]:
+    """Return (module, self us, cumulative us, depth) for each line of the -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+def measure(directory: str, module: str, timeout: float) -> tuple[float, list]:
+    """Import the module in a fresh interpreter. Return the total import time in seconds, and the import entries"""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=os.path.join(REPO_ROOT, directory), capture_output=True, text=True,
+                               timeout=timeout, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"})
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "unknown error"
+        raise RuntimeError(f"importing {module} failed: {error}")
+
+    entries = parse_import_times(completed.stderr)
+    # the top-level imports (depth 0) add up to the whole startup, including the interpreter's own modules
+    total_us = sum(cumulative_us for _, _, cumulative_us, depth in entries if depth == 0)
+    return total_us / 1e6, entries
+
+def slowest_imports(entries: list, top: int) -> list[tuple[str, float]]:
+    """The packages with the largest cumulative import time, in seconds (top-level packages only)"""
+    by_package = {}
+    for module, _, cumulative_us, _ in entries:
+        package = module.split(".")[0]
+        by_package[package] = max(by_package.get(package, 0), cumulative_us)
+    return [(package, cumulative_us / 1e6)
+            for package, cumulative_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budgets of the entry points of the examples")
+    parser.add_argument("--runs", type=int, default=3, help="the number of imports per entry point (the median is kept)")
+    parser.add_argument("--budget", action="append", default=[], metavar="MODULE=SECONDS",
+                        help="override the budget of an entry point, e.g. rag_agent=0.3 (can be repeated)")
+    parser.add_argument("--only", help="a comma-separated list of the entry point modules to measure")
+    parser.add_argument("--top", type=int, default=5, help="the number of slowest imports to list per entry point")
+    parser.add_argument("--timeout", type=float, default=120.0, help="the timeout of an import, in seconds")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    budgets = {}
+    for item in args.budget:
+        module, _, seconds = item.partition("=")
+        budgets[module] = float(seconds)
+    only = set(args.only.split(",")) if args.only else None
+
+    results, over_budget = [], False
+    for directory, module, budget in ENTRY_POINTS:
+        if only and module not in only:
+            continue
+        budget = budgets.get(module, budget)
+
+        try:
+            runs = [measure(directory, module, args.timeout) for _ in range(args.runs)]
+        except (RuntimeError, subprocess.TimeoutExpired) as error:
+            print(f"{module:<32} ERROR: {error}")
+            results.append({"directory": directory, "module": module, "budget_seconds": budget, "error": f"{error}"})
+            over_budget = True
+            continue
+
+        median_seconds = statistics.median(seconds for seconds, _ in runs)
+        slowest = slowest_imports(runs[-1][1], args.top)
+        passed = median_seconds <= budget
+        over_budget = over_budget or not passed
+
+        print(f"{module:<32} {median_seconds:6.3f}s / {budget:.3f}s  {'ok' if passed else 'OVER BUDGET'}")
+        print("\033[90m    " + ", ".join(f"{package} {seconds:.3f}s" for package, seconds in slowest) + "\033[0m")
+        results.append({"directory": directory, "module": module, "budget_seconds": budget,
+                        "median_seconds": median_seconds, "runs_seconds": [seconds for seconds, _ in runs],
+                        "passed": passed, "slowest_imports": slowest})
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    sys.exit(1 if over_budget else 0)
+
+if __name__ == "__main__":
+    main()
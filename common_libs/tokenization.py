@@ -0,0 +1,92 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# Local tokenizers to count tokens and to cut texts on token boundaries without calling watsonx.
+# A Hugging Face tokenizer is used when one is given (a tokenizer.json file, or a model name on the Hub),
+# otherwise an approximation which splits words into sub-word pieces the way WordPiece/BPE
+# tokenizers roughly do, erring on the side of more tokens.
+
+import os
+import re
+import threading
+
+_APPROXIMATE_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_APPROXIMATE_PIECE_LENGTH = 4 # English BPE/WordPiece tokens average about 4 characters
+
+class TextTokenizer:
+    def __init__(self, hf_tokenizer=None, name="approximate"):
+        self._hf_tokenizer = hf_tokenizer
+        self.name = name
+
+    def token_spans(self, text: str) -> list[tuple[int, int]]:
+        """Return the (start, end) character offsets of each token of the text (special tokens excluded)"""
+        if self._hf_tokenizer:
+            encoding = self._hf_tokenizer.encode(text, add_special_tokens=False)
+            return [(start, end) for start, end in encoding.offsets]
+
+        spans = []
+        for match in _APPROXIMATE_TOKEN_PATTERN.finditer(text):
+            start, end = match.span()
+            for piece_start in range(start, end, _APPROXIMATE_PIECE_LENGTH):
+                spans.append((piece_start, min(piece_start + _APPROXIMATE_PIECE_LENGTH, end)))
+        return spans
+
+    def count_tokens(self, text: str) -> int:
+        if self._hf_tokenizer:
+            return len(self._hf_tokenizer.encode(text, add_special_tokens=False).ids)
+        return len(self.token_spans(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Return the longest prefix of the text that has at most max_tokens tokens"""
+        spans = self.token_spans(text)
+        if len(spans) <= max_tokens:
+            return text
+        return text[:spans[max_tokens - 1][1]] if max_tokens > 0 else ""
+
+    def split(self, text: str, max_tokens: int, overlap_tokens: int = 0) -> list[str]:
+        """Split a text into windows of at most max_tokens tokens, each window overlapping the previous one
+        by overlap_tokens tokens. The windows are slices of the original text, cut on token boundaries"""
+        spans = self.token_spans(text)
+        if len(spans) <= max_tokens:
+            return [text]
+
+        stride = max(1, max_tokens - overlap_tokens)
+        windows = []
+        for first in range(0, len(spans), stride):
+            last = min(first + max_tokens, len(spans)) - 1
+            windows.append(text[spans[first][0]:spans[last][1]])
+            if last == len(spans) - 1:
+                break
+        return windows
+
+_tokenizers: dict[str, TextTokenizer] = {}
+_tokenizers_lock = threading.Lock()
+
+def load_tokenizer(name_or_path: str | None = None) -> TextTokenizer:
+    """Return a (shared) tokenizer: a Hugging Face tokenizer from a tokenizer.json file, a directory containing one,
+    or a model name on the Hub. The approximate tokenizer is returned when no name is given,
+    or when the tokenizer cannot be loaded"""
+    if not name_or_path:
+        return TextTokenizer()
+
+    with _tokenizers_lock:
+        if name_or_path not in _tokenizers:
+            try:
+                from tokenizers import Tokenizer
+
+                if os.path.isdir(name_or_path):
+                    hf_tokenizer = Tokenizer.from_file(os.path.join(name_or_path, "tokenizer.json"))
+                elif os.path.isfile(name_or_path):
+                    hf_tokenizer = Tokenizer.from_file(name_or_path)
+                else:
+                    hf_tokenizer = Tokenizer.from_pretrained(name_or_path)
+                _tokenizers[name_or_path] = TextTokenizer(hf_tokenizer, name=name_or_path)
+            except Exception as error:
+                print(f"\033[90m(Could not load the tokenizer {name_or_path}: {error}. Token counts are approximated)\033[0m")
+                _tokenizers[name_or_path] = TextTokenizer()
+
+        return _tokenizers[name_or_path]
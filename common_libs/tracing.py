@@ -0,0 +1,203 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# Lightweight tracing of the agent turns, to see where the time of a turn goes: retrieval, prompt formatting,
+# each LLM call (time waiting for the upstream governor, time to first token, total time, token counts),
+# each ReAct iteration and each tool call.
+#
+# The spans follow the OpenTelemetry data model, and are exported as OTLP/JSON span objects (traceId, spanId,
+# parentSpanId, startTimeUnixNano, attributes, events, ...), one per line, to the file given by WATSONX_TRACE_FILE.
+# Tracing is disabled (and costs next to nothing) when no exporter is configured.
+# The LLM calls made through WatsonxClient are traced by a LangChain callback handler, see tracing_callbacks.py.
+#
+# To summarize a trace file as a tree of spans with their durations:
+#   $ python tracing.py traces.jsonl
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+import json
+import os
+import secrets
+import sys
+import time
+
+_exporters = []
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    elif isinstance(value, int):
+        return {"intValue": str(value)} # int64 values are strings in OTLP/JSON
+    elif isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_attributes(attributes: dict) -> list[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+class Span:
+    def __init__(self, name: str, parent: "Span | None" = None, attributes: dict | None = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = None
+        self.error = None
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_event(self, name: str, **attributes):
+        self.events.append((name, time.time_ns(), attributes))
+
+    def set_error(self, error):
+        self.error = f"{error}"
+
+    def elapsed_ms(self) -> float:
+        return ((self.end_time_ns or time.time_ns()) - self.start_time_ns) / 1e6
+
+    def end(self):
+        if self.end_time_ns is None:
+            self.end_time_ns = time.time_ns()
+            for exporter in _exporters:
+                exporter.export(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": "SPAN_KIND_INTERNAL",
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [{"name": name, "timeUnixNano": str(timestamp_ns), "attributes": _otlp_attributes(attributes)}
+                       for name, timestamp_ns, attributes in self.events],
+            "status": {"code": "STATUS_CODE_ERROR", "message": self.error} if self.error else {"code": "STATUS_CODE_OK"}
+        }
+        if self.parent:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+class JsonlSpanExporter:
+    """Appends each finished span to a file, as one OTLP/JSON span object per line"""
+    def __init__(self, filepath: str):
+        file_dir = os.path.dirname(filepath)
+        if file_dir:
+            os.makedirs(file_dir, exist_ok=True)
+        self._file = open(filepath, "a", encoding="utf-8")
+        self._lock = Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_otlp())
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+def add_exporter(exporter):
+    """Register an exporter, i.e. an object with an export(span) method. Tracing is enabled once there's one"""
+    _exporters.append(exporter)
+
+def is_enabled() -> bool:
+    return bool(_exporters)
+
+if os.getenv("WATSONX_TRACE_FILE"):
+    add_exporter(JsonlSpanExporter(os.getenv("WATSONX_TRACE_FILE")))
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+def set_current_span(span: Span | None):
+    """Make a span the parent of the spans started next in this context (e.g. from a callback handler)"""
+    _current_span.set(span)
+
+def begin_span(name: str, **attributes) -> Span | None:
+    """Start a span, a child of the current span, without making it current (see use_span).
+    The caller ends it. Return None when tracing is disabled"""
+    if not _exporters:
+        return None
+    return Span(name, parent=_current_span.get(), attributes=attributes)
+
+@contextmanager
+def use_span(span: Span | None):
+    """Make a span the current span for the block, without ending it, e.g. across the chunks of a stream"""
+    if span is None:
+        yield None
+        return
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as error:
+        span.set_error(error)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            pass # e.g. a generator closed from another context, which keeps its own current span
+
+@contextmanager
+def start_span(name: str, **attributes):
+    """Run the block in a new span, a child of the current span. Yield the span, or None when tracing is disabled"""
+    span = begin_span(name, **attributes)
+    try:
+        with use_span(span):
+            yield span
+    finally:
+        if span:
+            span.end()
+
+def set_attributes(**attributes):
+    """Set attributes of the current span, if any"""
+    span = _current_span.get()
+    if span:
+        span.set_attributes(**attributes)
+
+def add_event(name: str, **attributes):
+    """Add an event to the current span, if any"""
+    span = _current_span.get()
+    if span:
+        span.add_event(name, **attributes)
+
+def print_trace_summary(filepath: str):
+    """Print the spans of a trace file as trees, with their durations and attributes"""
+    spans = []
+    with open(filepath, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                spans.append(json.loads(line))
+
+    children = {}
+    for span in spans:
+        children.setdefault(span.get("parentSpanId"), []).append(span)
+
+    def print_span(span, depth):
+        duration_ms = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+        attributes = ", ".join(f"{attribute['key']}={next(iter(attribute['value'].values()))}"
+                               for attribute in span["attributes"])
+        status = " ERROR" if span["status"]["code"] == "STATUS_CODE_ERROR" else ""
+        print(f"{'  ' * depth}{span['name']}: {duration_ms:.1f} ms{status}" + (f"  \033[90m({attributes})\033[0m" if attributes else ""))
+        for child in sorted(children.get(span["spanId"], []), key=lambda child: int(child["startTimeUnixNano"])):
+            print_span(child, depth + 1)
+
+    span_ids = {span["spanId"] for span in spans}
+    roots = [span for span in spans if span.get("parentSpanId") not in span_ids]
+    for root in sorted(roots, key=lambda root: int(root["startTimeUnixNano"])):
+        print_span(root, 0)
+        print()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python tracing.py <trace file>")
+        sys.exit(1)
+    print_trace_summary(sys.argv[1])
@@ -0,0 +1,111 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+from langchain_core.callbacks import BaseCallbackHandler
+from threading import Lock
+from typing import Any
+from uuid import UUID
+import time
+import tracing
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Turns the LangChain runs into tracing spans (see tracing.py):
+    - a span per LLM call, with the model id, the time to first token (when streaming) and the token counts
+    - a span per tool call
+    - an event per ReAct action (iteration) and at the final answer of an agent
+    The LLMs requested through WatsonxClient carry a handler, and the agents pass one more to their executor
+    for the tools and the actions. The spans are shared by all the handlers, so a run is only traced once"""
+
+    # called in the context of the caller (also from async code), so that the span of an LLM call
+    # is the current span while it runs, and the upstream governor can add its queueing time to it
+    run_inline = True
+
+    _spans: dict[UUID, tracing.Span] = {}
+    _spans_lock = Lock()
+
+    def _start_span(self, run_id: UUID, parent_run_id: UUID | None, name: str, **attributes):
+        if not tracing.is_enabled():
+            return
+
+        with self._spans_lock:
+            if run_id in self._spans:
+                return
+            parent = self._spans.get(parent_run_id) or tracing.current_span()
+            span = tracing.Span(name, parent=parent, attributes=attributes)
+            span.first_token_at = None
+            span.streamed_tokens = 0
+            self._spans[run_id] = span
+        tracing.set_current_span(span)
+
+    def _end_span(self, run_id: UUID, error: BaseException | None = None, **attributes):
+        with self._spans_lock:
+            span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+
+        span.set_attributes(**attributes)
+        if error is not None:
+            span.set_error(error)
+        span.end()
+        if tracing.current_span() is span:
+            tracing.set_current_span(span.parent)
+
+    def on_llm_start(self, serialized: dict[str, Any], prompts: list[str], *, run_id: UUID,
+                     parent_run_id: UUID | None = None, **kwargs: Any):
+        invocation_params = kwargs.get("invocation_params") or {}
+        self._start_span(run_id, parent_run_id, "llm",
+                         **{"llm.model_id": invocation_params.get("model_id") or (serialized or {}).get("name"),
+                            "llm.prompt_chars": sum(len(prompt) for prompt in prompts)})
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        span = self._spans.get(run_id)
+        if span is None:
+            return
+
+        if span.first_token_at is None:
+            span.first_token_at = time.time_ns()
+            span.set_attributes(**{"llm.time_to_first_token_ms": (span.first_token_at - span.start_time_ns) / 1e6})
+            span.add_event("first_token")
+        span.streamed_tokens += 1
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        if not token_usage and response.generations and response.generations[0]:
+            # streamed generations carry their counts in the generation info, if any
+            token_usage = response.generations[0][0].generation_info or {}
+
+        span = self._spans.get(run_id)
+        output_chars = sum(len(generation.text) for generations in response.generations for generation in generations)
+        self._end_span(run_id,
+                       **{"llm.input_token_count": token_usage.get("input_token_count"),
+                          "llm.generated_token_count": token_usage.get("generated_token_count")
+                                                       or (span.streamed_tokens if span and span.streamed_tokens else None),
+                          "llm.output_chars": output_chars})
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._end_span(run_id, error=error)
+
+    def on_tool_start(self, serialized: dict[str, Any], input_str: str, *, run_id: UUID,
+                      parent_run_id: UUID | None = None, **kwargs: Any):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._start_span(run_id, parent_run_id, f"tool {name}", **{"tool.name": name, "tool.input_chars": len(input_str or "")})
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        self._end_span(run_id, **{"tool.output_chars": len(f"{output}")})
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._end_span(run_id, error=error)
+
+    def on_agent_action(self, action, *, run_id: UUID, **kwargs: Any):
+        span = tracing.current_span()
+        if span is not None:
+            span.react_iterations = getattr(span, "react_iterations", 0) + 1
+            span.add_event("react.action", iteration=span.react_iterations, tool=action.tool)
+            span.set_attributes(**{"react.iterations": span.react_iterations})
+
+    def on_agent_finish(self, finish, *, run_id: UUID, **kwargs: Any):
+        tracing.add_event("react.finish")
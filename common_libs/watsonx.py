@@ -5,13 +5,370 @@
 # Author: Nguyen, Hung (Howie) Sy
 #
 
-from ibm_watsonx_ai.foundation_models.embeddings import Embeddings
-from ibm_watsonx_ai.metanames import GenTextParamsMetaNames as GenParams, EmbedTextParamsMetaNames
-from ibm_watsonx_ai import Credentials
-from langchain_ibm import WatsonxLLM
+# The watsonx SDK and LangChain take seconds to import, so they are only imported on the first request
+# for a model (see WatsonxClient.initialize), and importing this module stays cheap for the entry points
+
+from contextlib import contextmanager, asynccontextmanager
+import asyncio
+import functools
 import os
+import random
+import re
+import threading
+import time
+import tracing
+
+class UpstreamThrottledError(Exception):
+    """Raised when watsonx keeps throttling a call after all the retries"""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class UpstreamGovernor:
+    """Keeps the calls to watsonx close to the quota without error storms. It is shared by all the callers of a process:
+    - a token bucket limits the rate of calls (requests per second), when a rate is given
+    - the number of concurrent calls is limited, and the limit is adjusted with AIMD: it grows by about one
+      for every `limit` successful calls, and it is halved when watsonx throttles a call
+    - throttled calls (429, or 503) are retried with a jittered exponential backoff. A Retry-After given
+      by watsonx is honored, and it pauses all the callers, not only the throttled one
+    The async callers (acall, aadmitted) share the same limits, and wait without blocking the event loop"""
+
+    _RETRYABLE_STATUS_CODES = (429, 503)
+    _ASYNC_SLOT_POLL_SECONDS = 0.02
+    # the line of the watsonx SDK errors (ApiRequestFailure) which gives the status code of the response
+    _SDK_STATUS_CODE_PATTERN = re.compile(r"^Status code: (\d{3}), body:", re.MULTILINE)
+
+    def __init__(self, requests_per_second=None, initial_concurrency=4, min_concurrency=1, max_concurrency=16,
+                 max_retries=5, base_backoff_seconds=0.5, max_backoff_seconds=30.0):
+        self._rate = requests_per_second
+        self._burst = max(1.0, requests_per_second or 1.0)
+        self._tokens = self._burst
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._bucket_lock = threading.Lock()
+
+        self._limit = float(initial_concurrency)
+        self._min_concurrency = min_concurrency
+        self._max_concurrency = max_concurrency
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+        self._max_retries = max_retries
+        self._base_backoff = base_backoff_seconds
+        self._max_backoff = max_backoff_seconds
+
+        self._throttled_calls = 0
+        self._retries = 0
+
+    def _reserve_token(self) -> float:
+        """Take a token if there's one. Return 0 if it was taken, otherwise the seconds to wait before trying again"""
+        with self._bucket_lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            elif not self._rate:
+                return 0
+
+            self._tokens = min(self._burst, self._tokens + (now - self._last_refill) * self._rate)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self._rate
+
+    def _acquire_token(self):
+        while (wait := self._reserve_token()) > 0:
+            time.sleep(wait)
+
+    async def _aacquire_token(self):
+        while (wait := self._reserve_token()) > 0:
+            await asyncio.sleep(wait)
+
+    def _acquire_slot(self):
+        with self._condition:
+            while self._in_flight >= max(1, int(self._limit)):
+                self._condition.wait()
+            self._in_flight += 1
+
+    async def _aacquire_slot(self):
+        # the condition can't be awaited, so the async callers poll it
+        while True:
+            with self._condition:
+                if self._in_flight < max(1, int(self._limit)):
+                    self._in_flight += 1
+                    return
+            await asyncio.sleep(self._ASYNC_SLOT_POLL_SECONDS)
+
+    def _release_slot(self, throttled: bool = False, succeeded: bool = True):
+        """Release a slot and adjust the concurrency limit (AIMD): it grows after a successful call, it is halved
+        after a throttled one, and it is left as is after another failure (e.g. a bad request or a cancelled call)"""
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self._limit = max(self._min_concurrency, self._limit / 2)
+            elif succeeded:
+                self._limit = min(self._max_concurrency, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    def _pause(self, seconds: float):
+        with self._bucket_lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @staticmethod
+    def _throttling_info(error: Exception) -> tuple[int | None, float | None]:
+        """Return the HTTP status code and the Retry-After (in seconds) of a failed call, if they can be found"""
+        while error is not None:
+            response = getattr(error, "response", None)
+            status_code = getattr(response, "status_code", None)
+            if status_code is not None:
+                retry_after = None
+                try:
+                    retry_after = float(response.headers.get("Retry-After"))
+                except (AttributeError, TypeError, ValueError):
+                    pass
+                return status_code, retry_after
+
+            # the watsonx SDK doesn't always keep the response, but the status code is part of its messages
+            match = UpstreamGovernor._SDK_STATUS_CODE_PATTERN.search(str(error))
+            if match:
+                return int(match.group(1)), None
+            error = error.__cause__ or error.__context__
+        return None, None
+
+    def _is_throttling(self, error: Exception) -> bool:
+        return self._throttling_info(error)[0] in self._RETRYABLE_STATUS_CODES
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        return random.uniform(0, min(self._max_backoff, self._base_backoff * 2 ** attempt)) # full jitter
+
+    def _after_failure(self, error: Exception, attempt: int) -> float:
+        """Return the seconds to wait before retrying a failed call (whose slot was released), or raise if it must not be retried"""
+        status_code, retry_after = self._throttling_info(error)
+        if status_code not in self._RETRYABLE_STATUS_CODES:
+            raise error
+
+        with self._condition:
+            self._throttled_calls += 1
+        if attempt >= self._max_retries:
+            raise UpstreamThrottledError(f"watsonx is throttling the calls: {error}", retry_after) from error
+
+        wait = retry_after + random.uniform(0, 0.5) if retry_after else self._backoff_seconds(attempt)
+        tracing.add_event("watsonx.throttled", status_code=status_code, attempt=attempt, retry_in_ms=wait * 1000)
+        if retry_after:
+            self._pause(wait)
+        with self._condition:
+            self._retries += 1
+        return wait
+
+    def call(self, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) within the rate and concurrency limits, retrying it when it is throttled"""
+        for attempt in range(self._max_retries + 1):
+            queued_at = time.perf_counter()
+            self._acquire_token()
+            self._acquire_slot()
+            tracing.add_event("watsonx.admitted", queue_ms=(time.perf_counter() - queued_at) * 1000, attempt=attempt)
+            throttled = succeeded = False
+            try:
+                result = fn(*args, **kwargs)
+                succeeded = True
+            except Exception as error:
+                throttled = self._is_throttling(error)
+                failure = error
+            finally:
+                # also when the call is interrupted (e.g. by a KeyboardInterrupt), so that the slot isn't lost
+                self._release_slot(throttled=throttled, succeeded=succeeded)
+            if succeeded:
+                return result
+            time.sleep(self._after_failure(failure, attempt))
+
+    async def acall(self, fn, *args, **kwargs):
+        """Like call, for a coroutine function fn"""
+        for attempt in range(self._max_retries + 1):
+            queued_at = time.perf_counter()
+            await self._aacquire_token()
+            await self._aacquire_slot()
+            tracing.add_event("watsonx.admitted", queue_ms=(time.perf_counter() - queued_at) * 1000, attempt=attempt)
+            throttled = succeeded = False
+            try:
+                result = await fn(*args, **kwargs)
+                succeeded = True
+            except Exception as error:
+                throttled = self._is_throttling(error)
+                failure = error
+            finally:
+                # also when the call is cancelled (e.g. a timed out aquery), so that the slot isn't lost
+                self._release_slot(throttled=throttled, succeeded=succeeded)
+            if succeeded:
+                return result
+            await asyncio.sleep(self._after_failure(failure, attempt))
+
+    @contextmanager
+    def admitted(self):
+        """Hold a slot within the rate and concurrency limits, without retries (e.g. for the duration of a stream)"""
+        queued_at = time.perf_counter()
+        self._acquire_token()
+        self._acquire_slot()
+        tracing.add_event("watsonx.admitted", queue_ms=(time.perf_counter() - queued_at) * 1000, attempt=0)
+        throttled = succeeded = False
+        try:
+            yield
+            succeeded = True
+        except Exception as error:
+            throttled = self._is_throttling(error)
+            raise
+        finally:
+            self._release_slot(throttled=throttled, succeeded=succeeded)
+
+    @asynccontextmanager
+    async def aadmitted(self):
+        """Like admitted, for async callers"""
+        queued_at = time.perf_counter()
+        await self._aacquire_token()
+        await self._aacquire_slot()
+        tracing.add_event("watsonx.admitted", queue_ms=(time.perf_counter() - queued_at) * 1000, attempt=0)
+        throttled = succeeded = False
+        try:
+            yield
+            succeeded = True
+        except Exception as error:
+            throttled = self._is_throttling(error)
+            raise
+        finally:
+            self._release_slot(throttled=throttled, succeeded=succeeded)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"concurrency_limit": int(self._limit), "in_flight": self._in_flight,
+                    "throttled_calls": self._throttled_calls, "retries": self._retries}
+
+class GovernedEmbeddings:
+    """Wraps an embedding model so that its calls go through the shared UpstreamGovernor"""
+    def __init__(self, embedding_model):
+        self._embedding_model = embedding_model
+
+    def __getattr__(self, name):
+        return getattr(self._embedding_model, name)
+
+    def embed_query(self, text: str) -> list[float]:
+        return WatsonxClient.get_upstream_governor().call(self._embedding_model.embed_query, text)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return WatsonxClient.get_upstream_governor().call(self._embedding_model.embed_documents, texts)
+
+    # The embedding client of the watsonx SDK has no async methods (LangChain's embedding models do),
+    # in which case the call runs on a worker thread
+    async def aembed_query(self, text: str) -> list[float]:
+        if hasattr(self._embedding_model, "aembed_query"):
+            return await WatsonxClient.get_upstream_governor().acall(self._embedding_model.aembed_query, text)
+        return await asyncio.to_thread(self.embed_query, text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if hasattr(self._embedding_model, "aembed_documents"):
+            return await WatsonxClient.get_upstream_governor().acall(self._embedding_model.aembed_documents, texts)
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+def is_standin() -> bool:
+    """Whether WATSONX_URL is a local stand-in (see watsonx_standin.py). It's an explicit opt-in with WATSONX_STANDIN=true,
+    never guessed from the URL, as it turns off the verification of the certificate"""
+    return os.getenv("WATSONX_STANDIN", "false").lower() == "true"
+
+def _freeze(value):
+    """Return a hashable version of a (nested) parameter value, to be part of a registry key"""
+    if isinstance(value, dict):
+        return tuple(sorted((str(key), _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    return value
 
 class WatsonxClient:
+    _initialized = False  # Class-level flag to track initialization
+    _initialization_lock = threading.Lock()
+
+    _upstream_governor = None
+    _upstream_governor_lock = threading.Lock()
+
+    # The registry of the models already built, keyed on (kind, model id, parameters).
+    # A reentrant lock, as building a chunked embedding model requests the underlying one
+    _api_client = None
+    _llm_cache = None
+    _models = {}
+    _models_lock = threading.RLock()
+
+    @classmethod
+    def initialize(cls):
+        if not cls._initialized:
+            with cls._initialization_lock:
+                if cls._initialized:
+                    return
+
+                global Embeddings, GenParams, EmbedTextParamsMetaNames, APIClient, Credentials, GovernedWatsonxLLM
+                global get_embedding_backend, request_local_embedding_model, ChunkedEmbeddings, load_tokenizer, LLMResponseCache
+                global TracingCallbackHandler
+                from ibm_watsonx_ai.foundation_models.embeddings import Embeddings
+                from ibm_watsonx_ai.metanames import GenTextParamsMetaNames as GenParams, EmbedTextParamsMetaNames
+                from ibm_watsonx_ai import APIClient, Credentials
+                from langchain_ibm import WatsonxLLM
+                from langchain_core.language_models.llms import BaseLLM
+                from langchain_core.caches import BaseCache
+                from langchain_core.outputs import Generation, GenerationChunk
+                from local_embeddings import get_embedding_backend, request_local_embedding_model
+                from chunked_embeddings import ChunkedEmbeddings
+                from tokenization import load_tokenizer
+                from llm_cache import LLMResponseCache
+                from tracing_callbacks import TracingCallbackHandler
+
+                class GovernedWatsonxLLM(WatsonxLLM):
+                    """WatsonxLLM whose generation calls go through the shared UpstreamGovernor"""
+                    def _generate(self, *args, **kwargs):
+                        return WatsonxClient.get_upstream_governor().call(super()._generate, *args, **kwargs)
+
+                    def _cache_llm_string(self, stop) -> str:
+                        """The llm_string of the cache entries, made the way BaseLLM.generate makes it"""
+                        params = self.dict()
+                        params["stop"] = stop
+                        return str(sorted(params.items()))
+
+                    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+                        # BaseLLM.stream doesn't look up the cache (only generate does), so a stream is looked up
+                        # and stored here, with the same keys as the generate calls. A hit is replayed as one chunk
+                        llm_string = self._cache_llm_string(stop) if isinstance(self.cache, BaseCache) else None
+                        if llm_string is not None:
+                            generations = self.cache.lookup(prompt, llm_string)
+                            if generations:
+                                chunk = GenerationChunk(text=generations[0].text, generation_info=generations[0].generation_info)
+                                if run_manager:
+                                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                                yield chunk
+                                return
+
+                        generation = None
+                        with WatsonxClient.get_upstream_governor().admitted():
+                            for chunk in super()._stream(prompt, stop=stop, run_manager=run_manager, **kwargs):
+                                generation = chunk if generation is None else generation + chunk
+                                yield chunk
+
+                        # only a stream which went to its end is stored
+                        if llm_string is not None and generation is not None:
+                            self.cache.update(prompt, llm_string, [Generation(text=generation.text,
+                                                                              generation_info=generation.generation_info)])
+
+                    async def _agenerate(self, *args, **kwargs):
+                        if WatsonxLLM._agenerate is BaseLLM._agenerate:
+                            # no native async generation: LangChain runs _generate (governed) on a worker thread
+                            return await super()._agenerate(*args, **kwargs)
+                        return await WatsonxClient.get_upstream_governor().acall(super()._agenerate, *args, **kwargs)
+
+                cls._initialized = True
+
+    @staticmethod
+    def _initialization(method):
+        """A initialization decorator for static methods"""
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            WatsonxClient.initialize()
+            return method(*args, **kwargs)
+        return wrapper
+
     @staticmethod
     def _get_watsonx_url():
         return os.getenv("WATSONX_URL", "https://us-south.ml.cloud.ibm.com")
@@ -25,13 +382,83 @@ class WatsonxClient:
         return os.getenv("WATSONX_PROJECT_ID")
 
     @staticmethod
+    def get_credentials() -> dict:
+        """The arguments of the watsonx Credentials. A local stand-in (WATSONX_STANDIN=true) needs no API key,
+        accepts any token, and has a self-signed certificate"""
+        url = WatsonxClient._get_watsonx_url()
+        if is_standin():
+            return {"url": url, "token": "standin", "verify": False}
+        return {"url": url, "api_key": WatsonxClient._get_cloud_api_key()}
+
+    @staticmethod
+    def get_upstream_governor() -> UpstreamGovernor:
+        """Return the governor shared by all the watsonx calls of this process, configured by environment variables"""
+        if WatsonxClient._upstream_governor is None:
+            with WatsonxClient._upstream_governor_lock:
+                if WatsonxClient._upstream_governor is None:
+                    WatsonxClient._upstream_governor = UpstreamGovernor(
+                        requests_per_second=float(os.getenv("WATSONX_MAX_REQUESTS_PER_SECOND", "0")),
+                        initial_concurrency=int(os.getenv("WATSONX_INITIAL_CONCURRENCY", "4")),
+                        max_concurrency=int(os.getenv("WATSONX_MAX_CONCURRENCY", "16")),
+                        max_retries=int(os.getenv("WATSONX_MAX_RETRIES", "5")))
+        return WatsonxClient._upstream_governor
+
+    @staticmethod
+    @_initialization
+    def get_api_client() -> "APIClient":
+        """Return the watsonx APIClient shared by all the models of this process. Its HTTP session keeps
+        the connections to watsonx alive, and its IAM token is cached until it expires (then refreshed)"""
+        with WatsonxClient._models_lock:
+            if WatsonxClient._api_client is None:
+                WatsonxClient._api_client = APIClient(
+                    credentials=Credentials(**WatsonxClient.get_credentials()),
+                    project_id=WatsonxClient._get_project_id())
+            return WatsonxClient._api_client
+
+    @staticmethod
+    @_initialization
+    def get_llm_cache() -> "LLMResponseCache":
+        """Return the response cache shared by the LLMs with greedy decoding, configured by environment variables"""
+        with WatsonxClient._models_lock:
+            if WatsonxClient._llm_cache is None:
+                ttl_seconds = float(os.getenv("WATSONX_LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+                # by default, the cache is next to this module rather than in the working directory, so that
+                # all the examples share it wherever they are run from. A relative path is resolved from the working directory
+                db_path = os.getenv("WATSONX_LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                           ".cache", "llm_responses.sqlite3"))
+                WatsonxClient._llm_cache = LLMResponseCache(
+                    db_path=os.path.abspath(db_path) if db_path else None,
+                    ttl_seconds=ttl_seconds if ttl_seconds > 0 else None,
+                    max_disk_bytes=int(os.getenv("WATSONX_LLM_CACHE_MAX_DISK_MB", "256")) * 1024 * 1024)
+            return WatsonxClient._llm_cache
+
+    @staticmethod
+    def _memoized(key, build):
+        """Return the model registered under the key, built by build() the first time"""
+        with WatsonxClient._models_lock:
+            if key not in WatsonxClient._models:
+                WatsonxClient._models[key] = build()
+            return WatsonxClient._models[key]
+
+    @staticmethod
+    def clear_models():
+        """Forget the models and the API client, e.g. after the credentials have changed"""
+        with WatsonxClient._models_lock:
+            WatsonxClient._models.clear()
+            WatsonxClient._api_client = None
+
+    @staticmethod
+    @_initialization
     def request_llm(model_id="ibm/granite-3-8b-instruct",
                                 decoding_method = "greedy", 
                                 temperature = 0.7, top_p = 1.0, top_k = 50, 
                                 min_new_tokens = 1, max_new_tokens = 820,
                                 repetition_penalty = 1,
-                                stop_sequences=None):
-        
+                                stop_sequences=None,
+                                cache=None):
+        """With cache set to True (by default, WATSONX_LLM_CACHE_ENABLED), the responses of a model with greedy decoding
+        are cached (see llm_cache.py), as they only depend on the model, its parameters and the prompt"""
+
         parameters = { # model parameters
             GenParams.DECODING_METHOD: decoding_method,
             GenParams.TEMPERATURE: temperature,
@@ -46,34 +473,62 @@ class WatsonxClient:
         if stop_sequences:
              parameters[GenParams.STOP_SEQUENCES]=stop_sequences
 
-        granite_model = WatsonxLLM(
-            model_id = model_id,
-            url = WatsonxClient._get_watsonx_url(),
-            apikey = WatsonxClient._get_cloud_api_key(),
-            project_id = WatsonxClient._get_project_id(),
-            params = parameters
-        )
+        if cache is None:
+            cache = os.getenv("WATSONX_LLM_CACHE_ENABLED", "false").lower() == "true"
+        is_greedy = str(getattr(decoding_method, "value", decoding_method)).lower() == "greedy"
+        llm_cache = WatsonxClient.get_llm_cache() if cache and is_greedy else None
 
-        return granite_model
+        # the models are shared: the same model id and parameters always return the same (thread-safe) instance
+        return WatsonxClient._memoized(
+            ("llm", model_id, _freeze(parameters), llm_cache is not None),
+            lambda: GovernedWatsonxLLM(
+                model_id = model_id,
+                watsonx_client = WatsonxClient.get_api_client(),
+                project_id = WatsonxClient._get_project_id(),
+                params = parameters,
+                cache = llm_cache,
+                callbacks = [TracingCallbackHandler()] # a span per call, when tracing is enabled (see tracing.py)
+            ))
     
     @staticmethod
+    @_initialization
     def request_embedding_model(model_id="ibm/slate-30m-english-rtrvr",
-                                truncate_input_tokens=512):
+                                truncate_input_tokens=512,
+                                pooling=None, chunk_overlap_tokens=64, tokenizer=None):
+            """With pooling set to "mean" or "max", texts longer than truncate_input_tokens are split into
+            overlapping windows which are embedded in one call and pooled, instead of being truncated.
+            The windows are cut with the given tokenizer (see tokenization.py), by default the one named by EMBEDDING_TOKENIZER.
+            Like the LLMs, the models are shared: the same arguments always return the same instance"""
+            tokenizer = tokenizer or os.getenv("EMBEDDING_TOKENIZER")
+            key = ("embeddings", get_embedding_backend(), model_id, truncate_input_tokens,
+                   pooling, chunk_overlap_tokens if pooling else None, tokenizer if pooling else None)
+            return WatsonxClient._memoized(key, lambda: WatsonxClient._build_embedding_model(
+                model_id, truncate_input_tokens, pooling, chunk_overlap_tokens, tokenizer))
+
+    @staticmethod
+    def _build_embedding_model(model_id, truncate_input_tokens, pooling, chunk_overlap_tokens, tokenizer):
+            if pooling:
+                return ChunkedEmbeddings(WatsonxClient.request_embedding_model(model_id, truncate_input_tokens),
+                                         load_tokenizer(tokenizer),
+                                         max_tokens=truncate_input_tokens,
+                                         overlap_tokens=chunk_overlap_tokens,
+                                         pooling=pooling)
+
+            # an offline backend (see local_embeddings.py) can be selected for load tests without watsonx
+            if get_embedding_backend() != "watsonx":
+                return request_local_embedding_model()
+
             embed_params = {
                 EmbedTextParamsMetaNames.TRUNCATE_INPUT_TOKENS: truncate_input_tokens,
                 EmbedTextParamsMetaNames.RETURN_OPTIONS: {
                     'input_text': False
                 }
             }
-            cloud_credentials=Credentials(
-                url= WatsonxClient._get_watsonx_url(),
-                api_key=WatsonxClient._get_cloud_api_key())
-            
             embeddings_model = Embeddings(
                 model_id = model_id,
                 project_id = WatsonxClient._get_project_id(),
-                credentials = cloud_credentials,
+                api_client = WatsonxClient.get_api_client(),
                 params=embed_params
             )
 
-            return embeddings_model
+            return GovernedEmbeddings(embeddings_model)
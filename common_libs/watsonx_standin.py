@@ -0,0 +1,448 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# A local stand-in for the watsonx.ai text generation and embedding APIs, to load-test and profile the agents,
+# the importer and the Q-learning LLM policy without network access (e.g. in CI). It has three modes:
+# - record: proxy the calls to the real watsonx, and append each call (with its latency, and the timing
+#   of each event of a stream) to a recordings file
+# - replay: answer the calls from the recordings file, with the original latencies (scaled by --speed)
+# - synthesize: generate the responses, with latencies drawn from configurable distributions
+#
+#   $ python watsonx_standin.py record --recordings recordings.jsonl
+#   $ python watsonx_standin.py replay --recordings recordings.jsonl --speed 1.0
+#   $ python watsonx_standin.py synthesize --ttft lognormal:-1.0,0.3 --tpot const:0.02 --output-tokens uniform:40,200
+#
+# Then point the examples to it with WATSONX_URL=https://localhost:8787 and WATSONX_STANDIN=true, which tells them that
+# WATSONX_URL is a stand-in (see WatsonxClient.get_credentials): the watsonx SDK sees it as a Cloud Pak for Data deployment,
+# so the stand-in also answers the version and project lookups of the SDK, and any bearer token is accepted.
+# The SDK only accepts https URLs: the stand-in serves a self-signed certificate (made with openssl, unless
+# --certfile and --keyfile are given), which the clients of a stand-in don't verify.
+# In record mode, the stand-in gets its own IAM token for the real watsonx from IBM_CLOUD_API_KEY.
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from datetime import datetime, timezone
+from threading import Lock
+from urllib.parse import urlencode, urlparse
+import argparse
+import hashlib
+import json
+import os
+import random
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+GENERATION_PATH = "/ml/v1/text/generation"
+GENERATION_STREAM_PATH = "/ml/v1/text/generation_stream"
+EMBEDDINGS_PATH = "/ml/v1/text/embeddings"
+MODEL_SPECS_PATH = "/ml/v1/foundation_model_specs"
+
+# the models of the examples, listed by the synthesized model specs (more with --model)
+DEFAULT_MODEL_IDS = ["ibm/granite-3-8b-instruct", "ibm/granite-13b-instruct-v2", "meta-llama/llama-3-1-70b-instruct",
+                     "ibm/slate-30m-english-rtrvr"]
+
+_WORDS = ("the issue is caused by a configuration of server client version update log file error message "
+          "restart service install check product support fix pack network connection database user").split()
+
+class LatencyDistribution:
+    """A latency distribution in seconds, given as "const:0.2", "uniform:0.1,0.3", "normal:0.3,0.05",
+    "lognormal:-1.2,0.4" (the mean and the standard deviation of the log) or "exp:0.2" (the mean)"""
+
+    _SAMPLERS = {
+        "const": lambda rng, value: value,
+        "uniform": lambda rng, low, high: rng.uniform(low, high),
+        "normal": lambda rng, mean, std: rng.gauss(mean, std),
+        "lognormal": lambda rng, mu, sigma: rng.lognormvariate(mu, sigma),
+        "exp": lambda rng, mean: rng.expovariate(1 / mean) if mean > 0 else 0.0,
+    }
+
+    def __init__(self, spec: str):
+        name, _, args = spec.partition(":")
+        if name not in self._SAMPLERS:
+            raise ValueError(f"Unknown distribution '{name}', expected one of: {', '.join(self._SAMPLERS)}")
+        self.spec = spec
+        self._name = name
+        self._args = [float(arg) for arg in args.split(",") if arg.strip()]
+        self._rng = random.Random()
+        self._lock = Lock()
+        self.sample() # fail early on wrong arguments
+
+    def sample(self) -> float:
+        with self._lock:
+            return max(0.0, self._SAMPLERS[self._name](self._rng, *self._args))
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+def request_key(method: str, path: str, body: bytes) -> str:
+    """The key matching a call with its recordings: the method, the path and the JSON body,
+    without the project (or space) id, so that the recordings can be replayed in another project"""
+    try:
+        payload = json.loads(body) if body else None
+    except ValueError:
+        payload = body.decode("utf-8", "replace")
+    if isinstance(payload, dict):
+        payload = {key: value for key, value in payload.items() if key not in ("project_id", "space_id")}
+    canonical = json.dumps([method, path, payload], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class Recordings:
+    """The recorded calls, one JSON object per line. A call recorded several times is replayed
+    with each of its recordings in turn"""
+
+    def __init__(self, filepath: str):
+        self._filepath = filepath
+        self._lock = Lock()
+        self._by_key = {}
+        self._next_index = {}
+        if os.path.exists(filepath):
+            with open(filepath, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        recording = json.loads(line)
+                        self._by_key.setdefault(recording["key"], []).append(recording)
+
+    def __len__(self):
+        return sum(len(recordings) for recordings in self._by_key.values())
+
+    def add(self, recording: dict):
+        with self._lock:
+            self._by_key.setdefault(recording["key"], []).append(recording)
+            file_dir = os.path.dirname(self._filepath)
+            if file_dir:
+                os.makedirs(file_dir, exist_ok=True)
+            with open(self._filepath, "a", encoding="utf-8") as f:
+                f.write(json.dumps(recording, ensure_ascii=False) + "\n")
+
+    def next(self, key: str) -> dict | None:
+        with self._lock:
+            recordings = self._by_key.get(key)
+            if not recordings:
+                return None
+            index = self._next_index.get(key, 0)
+            self._next_index[key] = index + 1
+            return recordings[index % len(recordings)]
+
+class IamToken:
+    """An IAM access token for the real watsonx (record mode), refreshed before it expires"""
+
+    def __init__(self, api_key: str, iam_url: str):
+        self._api_key = api_key
+        self._iam_url = iam_url
+        self._token = None
+        self._expiration = 0
+        self._lock = Lock()
+
+    def get(self) -> str:
+        with self._lock:
+            if self._token is None or time.time() > self._expiration - 300:
+                data = urlencode({"grant_type": "urn:ibm:params:oauth:grant-type:apikey", "apikey": self._api_key}).encode()
+                request = urllib.request.Request(self._iam_url, data=data,
+                                                 headers={"Content-Type": "application/x-www-form-urlencoded",
+                                                          "Accept": "application/json"})
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    token = json.load(response)
+                self._token = token["access_token"]
+                self._expiration = token.get("expiration", time.time() + 3600)
+            return self._token
+
+class Synthesizer:
+    """Generates the responses of the synthesize mode (and of the replay misses, with --on-miss synthesize)"""
+
+    def __init__(self, ttft: LatencyDistribution, tpot: LatencyDistribution, output_tokens: LatencyDistribution,
+                 embedding_latency: LatencyDistribution, dimensions: int, text: str | None = None, model_ids=()):
+        self.ttft = ttft
+        self.tpot = tpot
+        self.output_tokens = output_tokens
+        self.embedding_latency = embedding_latency
+        self.dimensions = dimensions
+        self.text = text
+        self.model_ids = list(dict.fromkeys([*DEFAULT_MODEL_IDS, *model_ids]))
+        self._embedder = None
+
+    def model_specs(self) -> dict:
+        return {"total_count": len(self.model_ids),
+                "resources": [{"model_id": model_id, "label": model_id.split("/")[-1], "provider": model_id.split("/")[0],
+                               "lifecycle": [{"id": "available", "start_date": "2024-01-01"}]}
+                              for model_id in self.model_ids]}
+
+    def generated_tokens(self, payload: dict) -> list[str]:
+        """The tokens of a generation: the --text if any, otherwise words drawn from the prompt
+        (the same prompt always gets the same words), up to max_new_tokens"""
+        max_new_tokens = (payload.get("parameters") or {}).get("max_new_tokens", 200)
+        if self.text is not None:
+            tokens = [word + " " for word in self.text.split(" ")]
+            tokens[-1] = tokens[-1][:-1]
+            return tokens[:max_new_tokens]
+
+        seed = hashlib.sha256(f"{payload.get('model_id')}\x00{payload.get('input')}".encode("utf-8")).digest()
+        rng = random.Random(seed)
+        count = max(1, min(max_new_tokens, round(self.output_tokens.sample())))
+        return [("" if i == 0 else " ") + rng.choice(_WORDS) for i in range(count)]
+
+    @staticmethod
+    def _generation_result(payload: dict, text: str, generated_token_count: int, stop_reason: str) -> dict:
+        return {"model_id": payload.get("model_id"), "created_at": _now_iso(),
+                "results": [{"generated_text": text, "generated_token_count": generated_token_count,
+                             "input_token_count": len(f"{payload.get('input', '')}".split()),
+                             "stop_reason": stop_reason}]}
+
+    def generation(self, payload: dict) -> dict:
+        tokens = self.generated_tokens(payload)
+        time.sleep(self.ttft.sample() + sum(self.tpot.sample() for _ in tokens[1:]))
+        return self._generation_result(payload, "".join(tokens), len(tokens), "eos_token")
+
+    def generation_stream(self, payload: dict):
+        """Yield the events of a generation stream, each after its latency"""
+        tokens = self.generated_tokens(payload)
+        time.sleep(self.ttft.sample())
+        for i, token in enumerate(tokens):
+            if i > 0:
+                time.sleep(self.tpot.sample())
+            yield self._generation_result(payload, token, i + 1, "eos_token" if i == len(tokens) - 1 else "not_finished")
+
+    def embeddings(self, payload: dict) -> dict:
+        if self._embedder is None:
+            # the same vectors as EMBEDDING_BACKEND=hashing, so that a retrieval still finds the texts sharing words
+            from local_embeddings import HashingEmbeddings
+            self._embedder = HashingEmbeddings(dimensions=self.dimensions)
+
+        texts = payload.get("inputs") or []
+        time.sleep(self.embedding_latency.sample())
+        return {"model_id": payload.get("model_id"), "created_at": _now_iso(),
+                "results": [{"embedding": vector} for vector in self._embedder.embed_documents(texts)],
+                "input_token_count": sum(len(text.split()) for text in texts)}
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "watsonx-standin"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        path = urlparse(self.path).path
+
+        # the lookups of the watsonx SDK (a stand-in URL looks like a Cloud Pak for Data deployment to it),
+        # always answered locally
+        if path == "/ml/wml_services/v2/version":
+            return self._send_json(200, {"version": "5.1.0"})
+        if path.startswith("/v2/projects/"):
+            return self._send_json(200, {"metadata": {"guid": path.split("/")[3]}, "entity": {"storage": {"type": "assetfiles"}}})
+        if path in ("/identity/token", "/icp4d-api/v1/authorize"):
+            return self._send_json(200, {"access_token": "standin", "token": "standin", "expires_in": 3600,
+                                         "expiration": int(time.time()) + 3600, "token_type": "Bearer"})
+
+        if self.server.mode == "record":
+            return self._record(path, body)
+
+        if self.server.mode == "replay":
+            recording = self.server.recordings.next(request_key(self.command, path, body))
+            if recording:
+                return self._replay(recording)
+            if self.server.on_miss != "synthesize":
+                return self._send_json(404, {"errors": [{"code": "recording_not_found",
+                                                         "message": f"No recording of {self.command} {path} with this payload"}]})
+
+        self._synthesize(path, body)
+
+    def _send_json(self, status: int, payload: dict):
+        self._send_body(status, "application/json", json.dumps(payload).encode("utf-8"))
+
+    def _send_body(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, status: int):
+        # the events are written as they come, and the end of the stream is the end of the connection
+        self.send_response(status)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _send_event(self, event: str):
+        self.wfile.write(event.encode("utf-8"))
+        self.wfile.flush()
+
+    def _synthesize(self, path: str, body: bytes):
+        synthesizer = self.server.synthesizer
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return self._send_json(400, {"errors": [{"code": "json_validation_error", "message": "Invalid JSON body"}]})
+
+        if path == MODEL_SPECS_PATH:
+            self._send_json(200, synthesizer.model_specs())
+        elif path == GENERATION_PATH:
+            self._send_json(200, synthesizer.generation(payload))
+        elif path == GENERATION_STREAM_PATH:
+            self._start_stream(200)
+            for i, result in enumerate(synthesizer.generation_stream(payload)):
+                self._send_event(f"id: {i + 1}\nevent: message\ndata: {json.dumps(result)}\n\n")
+        elif path == EMBEDDINGS_PATH:
+            self._send_json(200, synthesizer.embeddings(payload))
+        else:
+            self._send_json(404, {"errors": [{"code": "not_found", "message": f"{path} is not served by the stand-in"}]})
+
+    def _record(self, path: str, body: bytes):
+        started_at = time.perf_counter()
+        try:
+            headers = {"Content-Type": self.headers.get("Content-Type", "application/json"), "Accept": self.headers.get("Accept", "*/*"),
+                       "Authorization": f"Bearer {self.server.iam_token.get()}"}
+            request = urllib.request.Request(self.server.upstream + self.path, data=body or None, headers=headers, method=self.command)
+            response = urllib.request.urlopen(request, timeout=self.server.upstream_timeout)
+        except urllib.error.HTTPError as error:
+            response = error # the errors (e.g. 429) are recorded and replayed too
+        except (urllib.error.URLError, TimeoutError) as error:
+            # no answer from watsonx (or from IAM), so nothing to record
+            return self._send_json(502, {"errors": [{"code": "upstream_unreachable", "message": f"watsonx could not be reached: {error}"}]})
+
+        recording = {"key": request_key(self.command, path, body), "method": self.command, "path": path,
+                     "status": response.status, "content_type": response.headers.get("Content-Type", "application/json")}
+        with response:
+            if recording["content_type"].startswith("text/event-stream"):
+                # each event is forwarded as it comes, and recorded with its time since the start of the call
+                self._start_stream(response.status)
+                events, event = [], ""
+                for line in response:
+                    event += line.decode("utf-8")
+                    if line.strip() == b"":
+                        events.append([time.perf_counter() - started_at, event])
+                        self._send_event(event)
+                        event = ""
+                if event:
+                    events.append([time.perf_counter() - started_at, event])
+                    self._send_event(event)
+                recording["events"] = events
+            else:
+                response_body = response.read()
+                recording["latency_seconds"] = time.perf_counter() - started_at
+                recording["body"] = response_body.decode("utf-8")
+                self._send_body(response.status, recording["content_type"], response_body)
+
+        self.server.recordings.add(recording)
+
+    def _replay(self, recording: dict):
+        speed = self.server.speed
+        if "events" in recording:
+            self._start_stream(recording["status"])
+            started_at = time.perf_counter()
+            for offset_seconds, event in recording["events"]:
+                time.sleep(max(0.0, offset_seconds * speed - (time.perf_counter() - started_at)))
+                self._send_event(event)
+        else:
+            time.sleep(recording["latency_seconds"] * speed)
+            self._send_body(recording["status"], recording["content_type"], recording["body"].encode("utf-8"))
+
+def self_signed_certificate(directory: str) -> tuple[str, str]:
+    """Make a self-signed certificate for localhost with openssl. Return the paths of the certificate and its key"""
+    certfile, keyfile = os.path.join(directory, "standin_cert.pem"), os.path.join(directory, "standin_key.pem")
+    try:
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "30", "-subj", "/CN=localhost",
+                        "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1", "-keyout", keyfile, "-out", certfile],
+                       check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as error:
+        raise ValueError(f"Making a self-signed certificate with openssl failed ({error}), give --certfile and --keyfile instead")
+    return certfile, keyfile
+
+def create_server(mode: str, host="127.0.0.1", port=8787, recordings_path="watsonx_recordings.jsonl",
+                  upstream="https://us-south.ml.cloud.ibm.com", iam_url="https://iam.cloud.ibm.com/identity/token",
+                  api_key=None, speed=1.0, on_miss="error", synthesizer: Synthesizer | None = None,
+                  upstream_timeout=120.0, certfile=None, keyfile=None, verbose=False) -> ThreadingHTTPServer:
+    """Create the stand-in server (call serve_forever() on it). Port 0 picks a free port (see server.server_address).
+    The server speaks https with the given certificate, or plain http without one"""
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.daemon_threads = True
+    server.mode = mode
+    server.verbose = verbose
+    server.speed = speed
+    server.on_miss = on_miss
+    server.upstream = upstream.rstrip("/")
+    server.upstream_timeout = upstream_timeout
+    server.recordings = Recordings(recordings_path) if mode in ("record", "replay") else None
+    server.iam_token = None
+    if mode == "record":
+        if not api_key:
+            raise ValueError("The record mode needs an API key for the real watsonx (IBM_CLOUD_API_KEY)")
+        server.iam_token = IamToken(api_key, iam_url)
+    server.synthesizer = synthesizer or Synthesizer(LatencyDistribution("lognormal:-1.0,0.3"), LatencyDistribution("const:0.02"),
+                                                    LatencyDistribution("uniform:40,200"), LatencyDistribution("lognormal:-2.5,0.3"),
+                                                    dimensions=384)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="A local stand-in for the watsonx.ai generation and embedding APIs")
+    parser.add_argument("mode", choices=["record", "replay", "synthesize"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--recordings", default="watsonx_recordings.jsonl", help="the recordings file (record and replay modes)")
+    parser.add_argument("--upstream", default="https://us-south.ml.cloud.ibm.com", help="the real watsonx URL (record mode)")
+    parser.add_argument("--iam-url", default="https://iam.cloud.ibm.com/identity/token", help="the IAM token URL (record mode)")
+    parser.add_argument("--speed", type=float, default=1.0, help="the factor of the recorded latencies (replay mode), 0 for no delay")
+    parser.add_argument("--on-miss", choices=["error", "synthesize"], default="error",
+                        help="the answer to a call which wasn't recorded (replay mode): a 404 error, or a synthesized response")
+    parser.add_argument("--ttft", default="lognormal:-1.0,0.3", help="the distribution of the time to the first token, in seconds")
+    parser.add_argument("--tpot", default="const:0.02", help="the distribution of the time per output token after the first one, in seconds")
+    parser.add_argument("--output-tokens", default="uniform:40,200", help="the distribution of the number of generated tokens")
+    parser.add_argument("--embedding-latency", default="lognormal:-2.5,0.3", help="the distribution of the latency of an embedding call, in seconds")
+    parser.add_argument("--dimensions", type=int, default=384, help="the dimensions of the synthesized embeddings")
+    parser.add_argument("--text", help="a fixed generated text, e.g. a ReAct 'Final Answer: ...' for the agents")
+    parser.add_argument("--model", action="append", default=[], help="a model id to list in the model specs (can be repeated)")
+    parser.add_argument("--certfile", help="the TLS certificate (a self-signed one is made by default)")
+    parser.add_argument("--keyfile", help="the key of the TLS certificate")
+    parser.add_argument("--verbose", action="store_true", help="log each request")
+    args = parser.parse_args()
+
+    try:
+        certfile, keyfile = args.certfile, args.keyfile
+        if not certfile:
+            certfile, keyfile = self_signed_certificate(tempfile.mkdtemp(prefix="watsonx_standin_"))
+        synthesizer = Synthesizer(LatencyDistribution(args.ttft), LatencyDistribution(args.tpot),
+                                  LatencyDistribution(args.output_tokens), LatencyDistribution(args.embedding_latency),
+                                  dimensions=args.dimensions, text=args.text, model_ids=args.model)
+        server = create_server(args.mode, args.host, args.port, args.recordings, args.upstream, args.iam_url,
+                               os.getenv("IBM_CLOUD_API_KEY"), args.speed, args.on_miss, synthesizer,
+                               certfile=certfile, keyfile=keyfile, verbose=args.verbose)
+    except ValueError as error:
+        print(f"Error: {error}")
+        sys.exit(1)
+
+    host, port = server.server_address[:2]
+    details = f"{len(server.recordings)} recordings in {args.recordings}" if args.mode == "replay" else \
+              f"recording to {args.recordings}" if args.mode == "record" else \
+              f"ttft={args.ttft}, tpot={args.tpot}, output tokens={args.output_tokens}"
+    print(f"watsonx stand-in ({args.mode}, {details}) on https://{host}:{port}")
+    print(f"\033[90m(Set WATSONX_URL=https://{host}:{port} and WATSONX_STANDIN=true to use it)\033[0m")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -15,12 +15,10 @@ from grid_world_q_learning import Step, Trajectory, GridWorldEnv, QLearningEngin
 from dotenv import load_dotenv
 load_dotenv()
 
-# Loading watsonx libraries
-print("Loading watsonx client... Please wait...")
+# The watsonx libraries are only loaded when the LLM policy is selected
 import sys
 sys.path.append("../common_libs") # not a good pratice but it's ok in this case
 from watsonx import WatsonxClient # type: ignore
-print(f"Watsonx URL: {WatsonxClient._get_watsonx_url()}")
 
 class GridWorldUI:
     class RadioButton:
@@ -658,6 +656,7 @@ class GridWorldApp:
                     self.ui.update_display()
                     policy_selected_index, _ = policy_selector.get_selected_option()
                     if policy_selected_index > 1 and wx_llm is None: # LLM
+                        print(f"Loading watsonx client ({WatsonxClient._get_watsonx_url()})... Please wait...")
                         wx_llm = WatsonxClient.request_llm(
                                 model_id="ibm/granite-3-8b-instruct", 
                                 decoding_method = "greedy", 
@@ -10,7 +10,6 @@ from typing import List, Dict, Tuple, Union, override, Literal, Optional
 from dataclasses import dataclass
 from gymnasium import Env, spaces
 import json
-from langchain_core.prompts import PromptTemplate
 import traceback
 import random
 import prompts
@@ -205,6 +204,8 @@ class QLearningEngine:
     def review_the_movement_log(self, current_state: Tuple, q_state: List, movement_log: List[str], llm) -> Dict[str, Union[str, float, Tuple[int, int], Tuple[int, str]]]:
         """Using the LLM to review the movement log/history for a loop (repeating pattern) detection"""
         try:
+            from langchain_core.prompts import PromptTemplate # only needed by the LLM policy, loaded on first use
+
             prompt_template = PromptTemplate(input_variables=["current_state", 
                                                             "q_state",
                                                             "movement_history"],
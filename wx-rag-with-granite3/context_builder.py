@@ -0,0 +1,103 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# Assembles the RAG prompt within a token budget: the retrieved technotes and the chat history are fitted into
+# the budget, counting the tokens with the model tokenizer (see common_libs/tokenization.py).
+# When the prompt is over the budget, the lowest-value parts go first:
+#   1. the oldest chat messages, down to the last KEEP_RECENT_MESSAGES ones
+#   2. the technotes with the lowest scores, trimmed (down to MIN_PASSAGE_TOKENS) then dropped, keeping the best one
+#   3. the remaining chat messages, oldest first
+#   4. the text of the best technote, trimmed
+# A shorter prompt is a faster and cheaper generation.
+
+import json
+
+KEEP_RECENT_MESSAGES = 2
+MIN_PASSAGE_TOKENS = 64
+TRIMMED_MARKER = " ..."
+
+class ContextBuilder:
+    def __init__(self, prompt_template, tokenizer, max_prompt_tokens=3072):
+        """prompt_template formats a prompt from its context, chat_history and query (e.g. a LangChain PromptTemplate),
+        tokenizer is a tokenization.TextTokenizer"""
+        self._prompt_template = prompt_template
+        self._tokenizer = tokenizer
+        self.max_prompt_tokens = max_prompt_tokens
+
+    @staticmethod
+    def _passage(technote: dict) -> dict:
+        """The parts of a technote which are useful to the model (the Document repr carries all its metadata)"""
+        document = technote["document"]
+        note_metadata = document.metadata.get("note_metadata") or {}
+        return {"product name": technote.get("product name"),
+                "title": document.metadata.get("title"),
+                "url": note_metadata.get("canonicalUrl"),
+                "text": document.metadata.get("text") or document.page_content, # the page content is the note_id (the key property)
+                "score": document.metadata.get("score", 0)}
+
+    def _format(self, passages: list[dict], history: list[str], query: str) -> str:
+        context = "\n".join(json.dumps({key: value for key, value in passage.items() if key not in ("score", "trimmed") and value},
+                                       ensure_ascii=False)
+                            for passage in passages)
+        return self._prompt_template.format(context=context, chat_history="\n".join(history), query=query)
+
+    def _trim(self, passage: dict, overflow: int) -> bool:
+        """Trim the text of a passage by overflow tokens (and the trimming marker). Return False if nothing would be left"""
+        max_tokens = self._tokenizer.count_tokens(passage["text"]) - overflow - self._tokenizer.count_tokens(TRIMMED_MARKER)
+        if max_tokens <= 0:
+            return False
+        passage["text"] = self._tokenizer.truncate(passage["text"], max_tokens) + TRIMMED_MARKER
+        passage["trimmed"] = True
+        return True
+
+    def build(self, query: str, technotes: list[dict], chat_messages: list[str]) -> tuple[str, dict]:
+        """Return the prompt, and a report of its size and of what was left out to fit it into the budget.
+        technotes are the {"product name", "document"} items of RagAgent, chat_messages the oldest first"""
+        passages = sorted((self._passage(technote) for technote in technotes), key=lambda passage: -passage["score"])
+        history = list(chat_messages)
+        report = {"budget_tokens": self.max_prompt_tokens, "tokenizer": self._tokenizer.name,
+                  "passages_dropped": 0, "messages_dropped": 0}
+
+        prompt = self._format(passages, history, query)
+        overflow = self._tokenizer.count_tokens(prompt) - self.max_prompt_tokens
+        report["initial_prompt_tokens"] = overflow + self.max_prompt_tokens
+
+        def refit():
+            nonlocal prompt, overflow
+            prompt = self._format(passages, history, query)
+            overflow = self._tokenizer.count_tokens(prompt) - self.max_prompt_tokens
+
+        # 1. the oldest chat messages
+        while overflow > 0 and len(history) > KEEP_RECENT_MESSAGES:
+            history.pop(0)
+            report["messages_dropped"] += 1
+            refit()
+
+        # 2. the technotes with the lowest scores
+        while overflow > 0 and len(passages) > 1:
+            if self._tokenizer.count_tokens(passages[-1]["text"]) - overflow < MIN_PASSAGE_TOKENS or not self._trim(passages[-1], overflow):
+                passages.pop()
+                report["passages_dropped"] += 1
+            refit()
+
+        # 3. the remaining chat messages
+        while overflow > 0 and history:
+            history.pop(0)
+            report["messages_dropped"] += 1
+            refit()
+
+        # 4. the best technote. The JSON escaping may cost a few more tokens than counted, hence the loop
+        while overflow > 0 and passages:
+            if not self._trim(passages[0], overflow):
+                passages.pop()
+                report["passages_dropped"] += 1
+            refit()
+
+        report.update({"prompt_tokens": overflow + self.max_prompt_tokens, "over_budget": overflow > 0,
+                       "passages": len(passages), "passages_trimmed": sum(1 for passage in passages if passage.get("trimmed")),
+                       "messages": len(history)})
+        return prompt, report
@@ -0,0 +1,153 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# A streaming pipeline for the importer: a source thread feeds stages of worker threads through bounded queues,
+# so all the stages work at the same time, and the pipeline runs at the speed of its slowest stage
+# (a full queue holds the stages before it back, and keeps the memory bounded).
+# Each stage reports its throughput and how busy its workers were: the bottleneck is the busiest stage.
+
+import queue
+import threading
+import time
+
+_END = object() # the end of the items, sent once to each worker of a stage
+
+class StageStats:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items: int, busy_seconds: float):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += busy_seconds
+
+    def report(self, elapsed_seconds: float) -> str:
+        throughput = self.items / elapsed_seconds if elapsed_seconds > 0 else 0.0
+        busy = self.busy_seconds / (elapsed_seconds * self.workers) if elapsed_seconds > 0 else 0.0
+        return f"{self.name:<10} x{self.workers:<3} {self.items:>8} items  {throughput:8.1f}/s  busy {busy:4.0%}"
+
+class Watermark:
+    """The number of items done in the order of the source, while the stages finish them in any order:
+    all the items before the watermark are done (e.g. a checkpoint from where an import can resume)"""
+    def __init__(self, start=0):
+        self.value = start
+        self._done = set() # the items done after the watermark
+        self._lock = threading.Lock()
+
+    def done(self, index: int):
+        with self._lock:
+            self._done.add(index)
+            while self.value in self._done:
+                self._done.remove(self.value)
+                self.value += 1
+
+class Pipeline:
+    """source() yields the items. Each stage function is called as fn(item, emit) by its workers, and emits
+    (zero or more) items to the next stage. on_end(emit), if any, is called by each worker of a stage when
+    the items are exhausted (e.g. to flush a batch). The functions handle their own errors: an unexpected error
+    is kept in `errors`, and the item is skipped. stop() ends the source early, the items in flight still go through"""
+
+    def __init__(self, source, queue_size=1024):
+        self._source = source
+        self._queue_size = queue_size
+        self._stages = [] # (fn, workers, on_end, stats)
+        self._stopped = threading.Event()
+        self.errors = []
+        self.stats = [StageStats("parse", 1)]
+
+    def stage(self, name: str, fn, workers=1, on_end=None) -> "Pipeline":
+        stats = StageStats(name, workers)
+        self._stages.append((fn, workers, on_end, stats))
+        self.stats.append(stats)
+        return self
+
+    def add_stats(self, name: str, workers=1) -> StageStats:
+        """Stats recorded by the caller, for a part of a stage (e.g. the embedding calls of a writer)"""
+        stats = StageStats(name, workers)
+        self.stats.append(stats)
+        return stats
+
+    def stop(self):
+        self._stopped.set()
+
+    def is_stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def _run_source(self, output: queue.Queue, next_workers: int):
+        stats = self.stats[0]
+        try:
+            items = iter(self._source())
+            while not self._stopped.is_set():
+                started_at = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                stats.record(1, time.perf_counter() - started_at)
+                output.put(item)
+        except Exception as error:
+            self.errors.append(f"parse: {error}")
+        finally:
+            for _ in range(next_workers):
+                output.put(_END)
+
+    def _run_worker(self, fn, on_end, stats: StageStats, input: queue.Queue, output: queue.Queue | None,
+                    remaining_workers: list, remaining_lock: threading.Lock, next_workers: int):
+        emit = output.put if output is not None else (lambda item: None)
+        while (item := input.get()) is not _END:
+            started_at = time.perf_counter()
+            try:
+                fn(item, emit)
+            except Exception as error:
+                self.errors.append(f"{stats.name}: {error}")
+            stats.record(1, time.perf_counter() - started_at)
+
+        if on_end:
+            started_at = time.perf_counter()
+            try:
+                on_end(emit)
+            except Exception as error:
+                self.errors.append(f"{stats.name}: {error}")
+            stats.record(0, time.perf_counter() - started_at)
+
+        # the last worker of the stage ends the next stage
+        with remaining_lock:
+            remaining_workers[0] -= 1
+            is_last = remaining_workers[0] == 0
+        if is_last and output is not None:
+            for _ in range(next_workers):
+                output.put(_END)
+
+    def run(self, progress=None, progress_interval_seconds=2.0) -> float:
+        """Run the pipeline to its end. progress(elapsed_seconds) is called periodically. Return the elapsed seconds"""
+        queues = [queue.Queue(maxsize=self._queue_size) for _ in self._stages]
+        threads = [threading.Thread(target=self._run_source, args=(queues[0], self._stages[0][1]), daemon=True)]
+        for i, (fn, workers, on_end, stats) in enumerate(self._stages):
+            output = queues[i + 1] if i + 1 < len(self._stages) else None
+            next_workers = self._stages[i + 1][1] if output is not None else 0
+            remaining_workers, remaining_lock = [workers], threading.Lock()
+            for _ in range(workers):
+                threads.append(threading.Thread(target=self._run_worker, daemon=True,
+                                                args=(fn, on_end, stats, queues[i], output,
+                                                      remaining_workers, remaining_lock, next_workers)))
+
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(progress_interval_seconds)
+                if progress and thread.is_alive():
+                    progress(time.perf_counter() - started_at)
+        return time.perf_counter() - started_at
+
+    def report(self, elapsed_seconds: float) -> str:
+        return "\n".join(stats.report(elapsed_seconds) for stats in self.stats)
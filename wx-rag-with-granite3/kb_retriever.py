@@ -5,11 +5,12 @@
 # Author: Nguyen, Hung (Howie) Sy
 #
 
-import weaviate
-from langchain_weaviate.vectorstores import WeaviateVectorStore
 from langchain_core.runnables import chain
 from langchain_core.documents import Document
+import asyncio
+import math
 import threading
+import weakref
 import os
 from dotenv import load_dotenv
 
@@ -20,6 +21,19 @@ from watsonx import WatsonxClient
 load_dotenv()
 
 TECH_NOTE_COLLECTION_NAME = "TechNoteDemo"
+TECH_NOTE_PASSAGE_COLLECTION_NAME = "TechNotePassageDemo"
+
+# What the retriever returns:
+# "note" (default): the notes, searched by their own vectors
+# "passage": the passages of the notes (see TECH_NOTE_CHUNKING in weaviate_importer.py), a much smaller context
+# "parent": the notes of the best passages, i.e. the passages collapsed to their notes
+TECH_NOTE_RETRIEVAL_UNIT = os.getenv("TECH_NOTE_RETRIEVAL_UNIT", "note")
+PASSAGE_CANDIDATES_PER_NOTE = 4 # the passages searched per note to return, as several of them may be of the same note
+
+def _relevance_score(score: float) -> float:
+    """The same normalization of the hybrid search scores as langchain_weaviate, to keep the same thresholds"""
+    score = max(-709.0, min(709.0, score)) # math.exp overflows beyond
+    return 1 - 1 / (1 + math.exp(score))
 
 class SingletonKnowledgeBaseRetrieverMeta(type):
     _instances = {} 
@@ -42,7 +56,19 @@ class SingletonKnowledgeBaseRetrieverMeta(type):
                 del cls._instances[cls]
 
 class KnowledgeBaseRetriever(metaclass=SingletonKnowledgeBaseRetrieverMeta):
+    """The sync retriever (technote_retriever) can be used from any thread, with one Weaviate client.
+    The async one (atechnote_retriever) can be used from any event loop: a Weaviate async client is only usable
+    in the event loop it was connected in, so each event loop gets its own client, connected on its first search.
+    The client of an event loop is to be closed in that loop before it ends, with aclose_weaviate_client()
+    (or acleanup() when the retriever isn't used anymore)"""
+
     def __init__(self):
+        # imported here as the Weaviate client takes a while to import
+        global weaviate, WeaviateVectorStore, MetadataQuery, Filter
+        import weaviate
+        from weaviate.classes.query import MetadataQuery, Filter
+        from langchain_weaviate.vectorstores import WeaviateVectorStore
+
         self._weaviate_client = weaviate.connect_to_local(
                 host=os.getenv("WEAVIATE_HOSTNAME", "localhost"), 
                 port=int(os.getenv("WEAVIATE_PORT", "8082")),
@@ -50,10 +76,38 @@ class KnowledgeBaseRetriever(metaclass=SingletonKnowledgeBaseRetrieverMeta):
         
         self._embedding_model = WatsonxClient.request_embedding_model()
 
+        # event loop -> {"lock", "client"}: the async client of each event loop, connected on its first async search.
+        # The entry of a loop goes away with the loop
+        self._async_weaviate_clients = weakref.WeakKeyDictionary()
+        self._async_weaviate_clients_lock = threading.Lock()
+
     def close_weaviate_client(self):
         if self._weaviate_client:
             self._weaviate_client.close()
 
+    async def _get_async_weaviate_client(self):
+        """The async client of the running event loop"""
+        loop = asyncio.get_running_loop()
+        with self._async_weaviate_clients_lock:
+            entry = self._async_weaviate_clients.setdefault(loop, {"lock": asyncio.Lock(), "client": None})
+
+        async with entry["lock"]:
+            if entry["client"] is None:
+                client = weaviate.use_async_with_local(
+                    host=os.getenv("WEAVIATE_HOSTNAME", "localhost"), 
+                    port=int(os.getenv("WEAVIATE_PORT", "8082")),
+                    grpc_port=int(os.getenv("WEAVIATE_GRPC_PORT", "50051")))
+                await client.connect()
+                entry["client"] = client
+            return entry["client"]
+
+    async def aclose_weaviate_client(self):
+        """Close the async client of the running event loop, if it has one"""
+        with self._async_weaviate_clients_lock:
+            entry = self._async_weaviate_clients.pop(asyncio.get_running_loop(), None)
+        if entry and entry["client"]:
+            await entry["client"].close()
+
     def _similarity_search_with_relevance_scores(self, query: str, collection_name, 
                                                 key_property, k=3, 
                                                 score_threshold=0.6):
@@ -71,6 +125,95 @@ class KnowledgeBaseRetriever(metaclass=SingletonKnowledgeBaseRetrieverMeta):
 
         return docs
         
+    async def _asimilarity_search_with_relevance_scores(self, query: str, collection_name, 
+                                                       key_property, k=3, 
+                                                       score_threshold=0.6):
+        """The async version of _similarity_search_with_relevance_scores, with the Weaviate async client.
+        It runs the same search as WeaviateVectorStore (a hybrid search, with the default alpha), which has no async path"""
+        client = await self._get_async_weaviate_client()
+        query_vector = await self._embedding_model.aembed_query(query)
+
+        collection = client.collections.get(collection_name)
+        response = await collection.query.hybrid(query=query, vector=query_vector, limit=k,
+                                                 return_metadata=MetadataQuery(score=True))
+
+        docs = []
+        for result in response.objects:
+            score = _relevance_score(result.metadata.score)
+            if score < score_threshold:
+                continue
+            metadata = dict(result.properties)
+            doc = Document(page_content=metadata.pop(key_property), metadata=metadata)
+            doc.metadata["score"] = score
+            docs.append(doc)
+
+        return docs
+
+    @staticmethod
+    def _best_note_ids(passages: list[Document], k) -> list[tuple[str, float]]:
+        """The note_ids of the k best notes, with the score of their best passage"""
+        best_scores = {}
+        for passage in passages:
+            note_id = passage.page_content
+            best_scores[note_id] = max(best_scores.get(note_id, 0.0), passage.metadata["score"])
+        return sorted(best_scores.items(), key=lambda item: -item[1])[:k]
+
+    @staticmethod
+    def _note_documents(objects, note_scores: list[tuple[str, float]]) -> list[Document]:
+        """The notes fetched by their note_ids, in the order of their scores"""
+        notes = {}
+        for o in objects:
+            metadata = dict(o.properties)
+            notes[metadata["note_id"]] = Document(page_content=metadata.pop("note_id"), metadata=metadata)
+
+        docs = []
+        for note_id, score in note_scores:
+            if note_id in notes:
+                notes[note_id].metadata["score"] = score
+                docs.append(notes[note_id])
+        return docs
+
+    def _retrieve(self, query: str, k: int, unit: str) -> list[Document]:
+        unit = (unit or "note").lower()
+        if unit == "note":
+            return self._similarity_search_with_relevance_scores(query, collection_name=TECH_NOTE_COLLECTION_NAME,
+                                                                 key_property="note_id", k=k)
+        elif unit == "passage":
+            return self._similarity_search_with_relevance_scores(query, collection_name=TECH_NOTE_PASSAGE_COLLECTION_NAME,
+                                                                 key_property="note_id", k=k)
+        elif unit == "parent":
+            passages = self._similarity_search_with_relevance_scores(query, collection_name=TECH_NOTE_PASSAGE_COLLECTION_NAME,
+                                                                     key_property="note_id", k=k * PASSAGE_CANDIDATES_PER_NOTE)
+            note_scores = self._best_note_ids(passages, k)
+            if not note_scores:
+                return []
+            collection = self._weaviate_client.collections.get(TECH_NOTE_COLLECTION_NAME)
+            response = collection.query.fetch_objects(filters=Filter.by_property("note_id").contains_any([note_id for note_id, _ in note_scores]),
+                                                      limit=len(note_scores))
+            return self._note_documents(response.objects, note_scores)
+        raise ValueError(f"Unsupported retrieval unit: {unit}. Supported: note, passage, parent")
+
+    async def _aretrieve(self, query: str, k: int, unit: str) -> list[Document]:
+        unit = (unit or "note").lower()
+        if unit == "note":
+            return await self._asimilarity_search_with_relevance_scores(query, collection_name=TECH_NOTE_COLLECTION_NAME,
+                                                                        key_property="note_id", k=k)
+        elif unit == "passage":
+            return await self._asimilarity_search_with_relevance_scores(query, collection_name=TECH_NOTE_PASSAGE_COLLECTION_NAME,
+                                                                        key_property="note_id", k=k)
+        elif unit == "parent":
+            passages = await self._asimilarity_search_with_relevance_scores(query, collection_name=TECH_NOTE_PASSAGE_COLLECTION_NAME,
+                                                                            key_property="note_id", k=k * PASSAGE_CANDIDATES_PER_NOTE)
+            note_scores = self._best_note_ids(passages, k)
+            if not note_scores:
+                return []
+            client = await self._get_async_weaviate_client()
+            collection = client.collections.get(TECH_NOTE_COLLECTION_NAME)
+            response = await collection.query.fetch_objects(filters=Filter.by_property("note_id").contains_any([note_id for note_id, _ in note_scores]),
+                                                            limit=len(note_scores))
+            return self._note_documents(response.objects, note_scores)
+        raise ValueError(f"Unsupported retrieval unit: {unit}. Supported: note, passage, parent")
+
     @staticmethod
     def cleanup():
         # Close resources before destroying the instance
@@ -80,16 +223,29 @@ class KnowledgeBaseRetriever(metaclass=SingletonKnowledgeBaseRetrieverMeta):
         # Call the metaclass destroy_instance method
         SingletonKnowledgeBaseRetrieverMeta.destroy_instance(KnowledgeBaseRetriever)
 
+    @staticmethod
+    async def acleanup():
+        """Like cleanup, but also closes the async client of the running event loop"""
+        singleton_kb_retriever = KnowledgeBaseRetriever()
+        await singleton_kb_retriever.aclose_weaviate_client()
+        KnowledgeBaseRetriever.cleanup()
+
     @staticmethod
     @chain
     def technote_retriever(query: str, **kwargs) -> list[Document]:
         singleton_kb_retriever = KnowledgeBaseRetriever()
 
         k = kwargs.get('k', 5)
-        results = singleton_kb_retriever._similarity_search_with_relevance_scores(query, 
-                                        collection_name=TECH_NOTE_COLLECTION_NAME, 
-                                        key_property="note_id",
-                                        k=k)
+        results = singleton_kb_retriever._retrieve(query, k=k, unit=kwargs.get('unit', TECH_NOTE_RETRIEVAL_UNIT))
+        return results
+
+    @staticmethod
+    @chain
+    async def atechnote_retriever(query: str, **kwargs) -> list[Document]:
+        singleton_kb_retriever = KnowledgeBaseRetriever()
+
+        k = kwargs.get('k', 5)
+        results = await singleton_kb_retriever._aretrieve(query, k=k, unit=kwargs.get('unit', TECH_NOTE_RETRIEVAL_UNIT))
         return results
 
 ### For dev/test/demo purposes
@@ -97,7 +253,7 @@ if __name__ == "__main__":
     technote_results = KnowledgeBaseRetriever.technote_retriever.invoke("I'm having an issue relating to Websphere MQ", k=1)
     print("\nResults:")
     for result in technote_results:
-        del result.metadata['content'] # don't need content as just a HTML version of 'text'
+        result.metadata.pop('content', None) # don't need content as just a HTML version of 'text' (passages have none)
         print(f"\n{result}\n")
 
     KnowledgeBaseRetriever.cleanup()
\ No newline at end of file
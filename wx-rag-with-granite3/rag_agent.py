@@ -5,26 +5,31 @@
 # Author: Nguyen, Hung (Howie) Sy
 #
 
-print("\033[90m(Loading watsonx client...)\033[0m")
-from langchain_core.prompts import PromptTemplate
-from ibm_watsonx_ai.foundation_models.utils.enums import DecodingMethods
-from kb_retriever import KnowledgeBaseRetriever 
-print("\033[90m(watsonx client loaded)\033[0m")
-
+# LangChain, the watsonx SDK and the Weaviate client take seconds to import,
+# so they are imported when the agent is created rather than at startup
 from rag_prompt_template import RAG_PROMPT_TEMPLATE
-from prompt_toolkit import prompt
-from prompt_toolkit.styles import Style
+from context_builder import ContextBuilder
+import os
 import time
 from collections import deque
+from typing import Iterable, Iterator
 
 import sys
 sys.path.append("../common_libs") # not a good pratice but it's ok in this case
 from watsonx import WatsonxClient
+from tokenization import load_tokenizer
+import tracing
 
 # Load environment variables from the file .env 
 from dotenv import load_dotenv
 load_dotenv()
 
+# The token budget of the prompt: granite-3-8b-instruct's context window of 4096 tokens, less the 1024 new tokens.
+# The tokens are counted with RAG_TOKENIZER (a tokenizer.json file, a directory containing one, or a model name
+# on the Hugging Face Hub, e.g. ibm-granite/granite-3.0-8b-instruct), or approximated without it
+RAG_MAX_PROMPT_TOKENS = int(os.getenv("RAG_MAX_PROMPT_TOKENS", "3072"))
+RAG_TOKENIZER = os.getenv("RAG_TOKENIZER")
+
 def agent_streaming_print(text: str, delay=0.005):
     print("\nAgent:", end=' ', flush=True)
     for char in text:
@@ -33,12 +38,18 @@ def agent_streaming_print(text: str, delay=0.005):
         time.sleep(delay)
     print(f"")  
 
-USER_STYLE = Style.from_dict({'prompt': "#5dade2", '': "#5dade2"})
+def agent_stream_print(chunks: Iterable[str]):
+    """Print the chunks of a response as they arrive from the model"""
+    print("\nAgent:", end=' ', flush=True)
+    for chunk in chunks:
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    print(f"")
 
 class ChatMemory:
     def __init__(self):
-        # We should keep a limit of messages in the chat_memory because of token limits
-        # In this example, simply keep the last 10 messages. But in pratice, consider some better ways
+        # Keep the last 10 messages. They are then fitted into the token budget of the prompt
+        # (the oldest ones are left out first), see context_builder.py
         self._chat_memory: deque[str] = deque(maxlen=10)
 
     def get_chat_messages(self) -> list[str]:
@@ -60,7 +71,15 @@ class ChatMemory:
 
 class RagAgent:
     def __init__(self):
+        print("\033[90m(Loading watsonx client...)\033[0m")
+        from langchain_core.prompts import PromptTemplate
+        from ibm_watsonx_ai.foundation_models.utils.enums import DecodingMethods
+        global KnowledgeBaseRetriever
+        from kb_retriever import KnowledgeBaseRetriever
+        print("\033[90m(watsonx client loaded)\033[0m")
+
         self._chat_memory = ChatMemory()
+        self.last_stream_stats = None # the timings of the last query_stream
         self._llm = WatsonxClient.request_llm(model_id="ibm/granite-3-8b-instruct",
                                 decoding_method = DecodingMethods.GREEDY, 
                                 temperature = 0.7, 
@@ -69,38 +88,108 @@ class RagAgent:
 
         self._prompt_template = PromptTemplate(input_variables=["context", "chat_history", "query"], 
                                         template=RAG_PROMPT_TEMPLATE)
+        self._context_builder = ContextBuilder(self._prompt_template, load_tokenizer(RAG_TOKENIZER), RAG_MAX_PROMPT_TOKENS)
+        self.last_prompt_report = None # the size of the last prompt, and what was left out to fit it into the budget
+
     def greet_user(self, user_name):
         greeting = f"Hello {user_name}! I'm here to assist with any questions related to IBM products."
         self._chat_memory.add_assistant_message(greeting)
         return greeting
     
+    def _build_prompt(self, user_query, technotes=None) -> tuple[str, list]:
+        if technotes is None:
+            with tracing.start_span("retrieval"):
+                technotes = KnowledgeBaseRetriever.technote_retriever.invoke(user_query, k=1)
+
+        with tracing.start_span("prompt_formatting") as span:
+            technote_context = []
+            for technote in technotes:
+                # print(f"Debug: Score: {technote.metadata['score'] }")
+                if technote.metadata['score'] >= 0.7:
+                    technote.metadata.pop('content', None) # don't need content as just a HTML version of 'text' (passages have none)
+                    product_name = technote.metadata["note_metadata"]["productName"]
+                    del technote.metadata["note_metadata"]["productName"]
+                    technote_context.append({"product name": product_name, "document": technote})
+
+            final_prompt, self.last_prompt_report = self._context_builder.build(user_query, technote_context,
+                                                                                self._chat_memory.get_chat_messages())
+            if span:
+                span.set_attributes(technotes=len(technote_context), prompt_chars=len(final_prompt),
+                                    **{f"prompt.{key}": value for key, value in self.last_prompt_report.items()})
+        return final_prompt, technote_context
+
     def query(self, user_query):
         """Return a tuple in which the first item is the response from the model, 
         the 2nd item is a list of relevant text notes"""
-        technotes = KnowledgeBaseRetriever.technote_retriever.invoke(user_query, k=1)
-        technote_context = []
-        for technote in technotes:
-            # print(f"Debug: Score: {technote.metadata['score'] }")
-            if technote.metadata['score'] >= 0.7:
-                del technote.metadata['content'] # don't need content as just a HTML version of 'text'
-                product_name = technote.metadata["note_metadata"]["productName"]
-                del technote.metadata["note_metadata"]["productName"]
-                technote_context.append({"product name": product_name, "document": technote})
-
-        final_prompt = self._prompt_template.format(context=technote_context,
-                                                chat_history=self._chat_memory.to_multiple_lines_string(),
-                                                query=user_query)
-        response = self._llm.invoke(final_prompt)
+        with tracing.start_span("rag_agent.query"):
+            final_prompt, technote_context = self._build_prompt(user_query)
+            response = self._llm.invoke(final_prompt)
 
         self._chat_memory.add_user_message(user_query)
         self._chat_memory.add_assistant_message(response)
         
         return response, technote_context
     
+    async def aquery(self, user_query):
+        """The async version of query, which awaits the retriever and the model instead of blocking a thread"""
+        with tracing.start_span("rag_agent.query"):
+            with tracing.start_span("retrieval"):
+                technotes = await KnowledgeBaseRetriever.atechnote_retriever.ainvoke(user_query, k=1)
+            final_prompt, technote_context = self._build_prompt(user_query, technotes)
+            response = await self._llm.ainvoke(final_prompt)
+
+        self._chat_memory.add_user_message(user_query)
+        self._chat_memory.add_assistant_message(response)
+
+        return response, technote_context
+
+    def query_stream(self, user_query) -> tuple[Iterator[str], list]:
+        """Like query, but the first item is a generator of the chunks of the response, as they are generated by the model.
+        The stream goes through the LLM cache like query does: a cached response comes as a single chunk.
+        The chat memory is updated once the generator is exhausted, and the timings are then in last_stream_stats"""
+        # the span of the turn lasts until the stream is exhausted
+        turn_span = tracing.begin_span("rag_agent.query", streaming=True)
+        try:
+            with tracing.use_span(turn_span):
+                final_prompt, technote_context = self._build_prompt(user_query)
+        except Exception:
+            if turn_span:
+                turn_span.end()
+            raise
+
+        def generate():
+            started_at = time.perf_counter()
+            first_chunk_at = None
+            chunks = []
+            try:
+                with tracing.use_span(turn_span):
+                    for chunk in self._llm.stream(final_prompt):
+                        if first_chunk_at is None:
+                            first_chunk_at = time.perf_counter()
+                        chunks.append(chunk)
+                        yield chunk
+            finally:
+                if turn_span:
+                    turn_span.end()
+
+            self.last_stream_stats = {
+                "time_to_first_token": (first_chunk_at or time.perf_counter()) - started_at,
+                "total_time": time.perf_counter() - started_at,
+                "chunks": len(chunks)
+            }
+            self._chat_memory.add_user_message(user_query)
+            self._chat_memory.add_assistant_message("".join(chunks))
+
+        return generate(), technote_context
+
     def clear_memory(self):
         self._chat_memory = ChatMemory()
 
 if __name__ == "__main__":
+    from prompt_toolkit import prompt
+    from prompt_toolkit.styles import Style
+    USER_STYLE = Style.from_dict({'prompt': "#5dade2", '': "#5dade2"})
+
     ragAgent = RagAgent()
 
     ### The main conversation ### 
@@ -124,8 +213,11 @@ if __name__ == "__main__":
                 print("\nStart the new chat session!\n")
                 continue
                 
-            response, _ = ragAgent.query(user_input)
-            agent_streaming_print(response)
+            response_stream, _ = ragAgent.query_stream(user_input)
+            agent_stream_print(response_stream)
+            print(f"\033[90m(Prompt: {ragAgent.last_prompt_report['prompt_tokens']} tokens, "
+                  f"time to first token: {ragAgent.last_stream_stats['time_to_first_token']:.2f}s, "
+                  f"total: {ragAgent.last_stream_stats['total_time']:.2f}s)\033[0m")
 
         except Exception as error:
             print(f"\nSomething's wrong: {error}")
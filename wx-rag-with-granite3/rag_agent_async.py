@@ -0,0 +1,49 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# Ask the RAG agent questions with its async path (RagAgent.aquery): the retrieval, the embedding of the query
+# and the generation are awaited instead of blocking a thread. Each round runs in a new event loop (asyncio.run),
+# as a new request of an async server might, and closes the Weaviate async client of its loop at the end,
+# as the retriever expects (see KnowledgeBaseRetriever).
+#
+#   $ python rag_agent_async.py "How do I configure the SSL of WebSphere MQ?" --rounds 2
+
+import argparse
+import asyncio
+import time
+from rag_agent import RagAgent, agent_streaming_print
+
+async def ask(rag_agent: RagAgent, questions: list[str]):
+    from kb_retriever import KnowledgeBaseRetriever
+    try:
+        for question in questions:
+            started_at = time.perf_counter()
+            response, technotes = await rag_agent.aquery(question)
+            print(f"\nYou: {question}")
+            agent_streaming_print(response)
+            print(f"\033[90m({len(technotes)} technotes, {time.perf_counter() - started_at:.2f}s)\033[0m")
+    finally:
+        # the async client of this event loop can't be used by another one
+        await KnowledgeBaseRetriever().aclose_weaviate_client()
+
+def main():
+    parser = argparse.ArgumentParser(description="Ask the RAG agent questions with its async path")
+    parser.add_argument("questions", nargs="*", default=["I'm having an issue relating to Websphere MQ"])
+    parser.add_argument("--rounds", type=int, default=1, help="the number of times the questions are asked, each time in a new event loop")
+    args = parser.parse_args()
+
+    rag_agent = RagAgent()
+    from kb_retriever import KnowledgeBaseRetriever
+    try:
+        for _ in range(args.rounds):
+            rag_agent.clear_memory()
+            asyncio.run(ask(rag_agent, args.questions))
+    finally:
+        KnowledgeBaseRetriever.cleanup()
+
+if __name__ == "__main__":
+    main()
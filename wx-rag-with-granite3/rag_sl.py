@@ -19,8 +19,6 @@ if __name__ == "__main__":
     user_name = None
     vector_datastore = None
 
-    ragAgent = RagAgent()
-
     st.set_page_config(page_title = "Wx-RAG", page_icon="🧙‍♂️", menu_items={'About': "### This is an example of RAG-based application using the LLM Granite 3.0"})
     st.markdown("### A question-answering application example based on RAG using Granite 3.0")
     st.caption("(Powered by IBM Granite via watsonx.ai, with a UI built using Streamlit)")
@@ -51,7 +49,10 @@ if __name__ == "__main__":
         response = "Sorry! Could not get the result. Something wrong"
         
         with st.spinner("..."):
-            response, _ = ragAgent.query(user_input)
+            # created once the page is rendered, as it loads the watsonx client
+            ragAgent = RagAgent()
+            response_stream, _ = ragAgent.query_stream(user_input)
 
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        st.chat_message("assistant").write(response)
\ No newline at end of file
+        # the response is shown as it is generated
+        response = st.chat_message("assistant").write_stream(response_stream)
+        st.session_state.messages.append({"role": "assistant", "content": response})
\ No newline at end of file
@@ -0,0 +1,152 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# The technotes as shards: a directory of Parquet files (typed columns: key, id, title, text, content and a metadata
+# struct), or of JSON lines files (one note per line), of SHARD_SIZE notes each.
+# A TechQA dump is one big JSON object which has to be stream-parsed from its start, on one thread, at every import.
+# The shards are exported once from it, then read in parallel by the importer: Parquet is decoded by pyarrow in C++,
+# without holding the GIL, and the JSON lines are parsed a line at a time with orjson.
+# Most of the cost of reading the notes is in building their Python objects, so the filter of the import on the text
+# is applied before: by Arrow on the text column of a Parquet shard, and on the raw bytes of a JSON line. The notes
+# which are filtered out (most of a TechQA dump for the FAQ filter) are never built.
+#
+#   $ python technote_shards.py techqa_technote_faq_samples.json technote_shards --format parquet
+#   $ TECH_NOTE_SOURCE=technote_shards python weaviate_importer.py
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import glob
+import os
+import time
+import ijson
+import orjson
+
+SHARD_SIZE = 10000
+SHARD_FORMATS = ("parquet", "jsonl")
+METADATA_FIELDS = ("sourceDocumentId", "date", "productName", "productId", "canonicalUrl")
+
+def _arrow_schema():
+    import pyarrow as pa
+    return pa.schema([("key", pa.string()), ("id", pa.string()), ("title", pa.string()),
+                      ("text", pa.string()), ("content", pa.string()),
+                      ("metadata", pa.struct([(field, pa.string()) for field in METADATA_FIELDS]))])
+
+def _string(value) -> str | None:
+    return None if value is None else f"{value}"
+
+def _row(key: str, note: dict) -> dict:
+    metadata = note.get("metadata") or {}
+    return {"key": key, "id": _string(note.get("id")), "title": _string(note.get("title")),
+            "text": _string(note.get("text")), "content": _string(note.get("content")),
+            "metadata": {field: _string(metadata.get(field)) for field in METADATA_FIELDS}}
+
+def _write_shard(rows: list[dict], output_dir: str, shard_number: int, format: str) -> str:
+    filepath = os.path.join(output_dir, f"part-{shard_number:05d}.{format}")
+    if format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.Table.from_pylist(rows, schema=_arrow_schema()), filepath, compression="zstd")
+    else:
+        with open(filepath, "wb") as f:
+            for row in rows:
+                f.write(orjson.dumps(row) + b"\n")
+    return filepath
+
+def export_shards(source_filepath, output_dir, format="parquet", shard_size=SHARD_SIZE,
+                  string_filter_in_text_field: str = None) -> list[str]:
+    """Export the notes of a TechQA JSON file to shards of shard_size notes in output_dir. Return the shard paths"""
+    if format not in SHARD_FORMATS:
+        raise ValueError(f"Unsupported shard format: {format}. Supported: {', '.join(SHARD_FORMATS)}")
+    os.makedirs(output_dir, exist_ok=True)
+    for old_shard in shard_paths(output_dir):
+        os.remove(old_shard) # not to mix the shards of two exports
+
+    print(f"Exporting the notes of {source_filepath} to {format} shards of {shard_size} notes in {output_dir}...")
+    started_at = time.perf_counter()
+    paths, rows, number_of_notes = [], [], 0
+    with open(source_filepath, "rb") as f:
+        for key, note in ijson.kvitems(f, ""):
+            if string_filter_in_text_field is not None and string_filter_in_text_field not in (note.get("text") or ""):
+                continue
+            rows.append(_row(key, note))
+            number_of_notes += 1
+            if len(rows) >= shard_size:
+                paths.append(_write_shard(rows, output_dir, len(paths), format))
+                rows = []
+    if rows:
+        paths.append(_write_shard(rows, output_dir, len(paths), format))
+
+    print(f"Exported {number_of_notes} notes to {len(paths)} shards in {time.perf_counter() - started_at:.1f}s")
+    return paths
+
+def shard_paths(source: str) -> list[str]:
+    """The shards of a source: the Parquet or JSON lines files of a directory (in the order of their names),
+    or a single shard file. [] when the source is not sharded (e.g. a TechQA JSON file)"""
+    if os.path.isdir(source):
+        return sorted(path for format in SHARD_FORMATS for path in glob.glob(os.path.join(source, f"*.{format}")))
+    if source.endswith(tuple(f".{format}" for format in SHARD_FORMATS)):
+        return [source]
+    return []
+
+def _table_rows(table) -> list[dict]:
+    """The rows of a table as dicts, built column by column (the metadata struct field by field),
+    which is faster than Table.to_pylist"""
+    names = [name for name in table.column_names if name != "metadata"]
+    columns = [table.column(name).to_pylist() for name in names]
+    metadata = table.column("metadata").combine_chunks()
+    metadata_columns = [metadata.field(field).to_pylist() for field in METADATA_FIELDS]
+
+    rows = []
+    for values, metadata_values in zip(zip(*columns), zip(*metadata_columns)):
+        row = dict(zip(names, values))
+        row["metadata"] = dict(zip(METADATA_FIELDS, metadata_values))
+        rows.append(row)
+    return rows
+
+def read_shard(filepath: str, text_filter: str = None) -> list[tuple[str, dict]]:
+    """The (key, note) items of a shard, the notes in the shape of the TechQA JSON file.
+    text_filter: only the notes whose text contains it"""
+    if filepath.endswith(".parquet"):
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        table = pq.read_table(filepath)
+        if text_filter is not None:
+            table = table.filter(pc.fill_null(pc.match_substring(table.column("text"), text_filter), False))
+        rows = _table_rows(table)
+    else:
+        # a line without the (JSON-escaped) filter can't match: it's not parsed
+        raw_filter = orjson.dumps(text_filter)[1:-1] if text_filter is not None else b""
+        with open(filepath, "rb") as f:
+            rows = [orjson.loads(line) for line in f if line.strip() and raw_filter in line]
+        if text_filter is not None:
+            rows = [row for row in rows if text_filter in (row.get("text") or "")]
+    return [(row.pop("key"), row) for row in rows]
+
+def read_shards(paths: list[str], readers=4, text_filter: str = None):
+    """Yield the (key, note) items of the shards in their order, reading up to `readers` shards at once.
+    text_filter: only the notes whose text contains it"""
+    with ThreadPoolExecutor(max_workers=readers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(read_shard, path, text_filter))
+            if len(pending) >= readers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the notes of a TechQA JSON file to Parquet or JSON lines shards")
+    parser.add_argument("source", help="a TechQA technotes JSON file, e.g. techqa_technote_faq_samples.json")
+    parser.add_argument("output_dir", help="the directory of the shards (its previous shards are removed)")
+    parser.add_argument("--format", choices=SHARD_FORMATS, default="parquet")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="the number of notes per shard")
+    parser.add_argument("--filter", help="only the notes whose text contains this string, e.g. 'TECHNOTE (FAQ)'")
+    args = parser.parse_args()
+
+    export_shards(args.source, args.output_dir, format=args.format, shard_size=args.shard_size,
+                  string_filter_in_text_field=args.filter)
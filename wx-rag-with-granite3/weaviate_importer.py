@@ -13,23 +13,114 @@ from weaviate.classes.config import (
     VectorDistances
 )
 
+from weaviate.classes.query import Filter
 from weaviate.collections import Collection
+from weaviate.util import generate_uuid5
+from contextlib import nullcontext
+import hashlib
 import ijson
 import json
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
+import sys
+sys.path.append("../common_libs") # not a good pratice but it's ok in this case
+from watsonx import WatsonxClient
+from tokenization import load_tokenizer
+from import_pipeline import Pipeline, Watermark
+from technote_shards import SHARD_SIZE, export_shards, read_shards, shard_paths
+
 load_dotenv()
 
 TECH_NOTE_COLLECTION_NAME = "TechNoteDemo"
+TECH_NOTE_PASSAGE_COLLECTION_NAME = "TechNotePassageDemo"
+
+# Compression of the vectors in the HNSW index: none (default), sq (8-bit scalar), pq (product) or bq (binary).
+# Weaviate receives the float vectors and quantizes them itself, with a rescoring of the candidates on the full vectors
+TECH_NOTE_VECTOR_QUANTIZER = os.getenv("TECH_NOTE_VECTOR_QUANTIZER", "none")
+
+# The objects are imported in batches over gRPC, and Weaviate vectorizes each batch with the embedding API.
+# "fixed": batches of TECH_NOTE_BATCH_SIZE objects, TECH_NOTE_BATCH_CONCURRENCY of them in flight at once
+# "dynamic": the batch size and the concurrency are adapted by the Weaviate client to the load of the server
+TECH_NOTE_BATCH_MODE = os.getenv("TECH_NOTE_BATCH_MODE", "fixed")
+TECH_NOTE_BATCH_SIZE = int(os.getenv("TECH_NOTE_BATCH_SIZE", "64"))
+TECH_NOTE_BATCH_CONCURRENCY = int(os.getenv("TECH_NOTE_BATCH_CONCURRENCY", "4"))
+PROGRESS_REPORT_INTERVAL_SECONDS = 2.0
+
+# The import is a pipeline (see import_pipeline.py): parse -> transform (filter, rename) -> write (embed, add to the batch),
+# the stages running at the same time, with up to TECH_NOTE_QUEUE_SIZE notes waiting between two stages.
+# The notes are not imported in the order of the file when there's more than one worker in a stage
+TECH_NOTE_TRANSFORM_WORKERS = int(os.getenv("TECH_NOTE_TRANSFORM_WORKERS", "2"))
+TECH_NOTE_WRITERS = int(os.getenv("TECH_NOTE_WRITERS", "4"))
+TECH_NOTE_QUEUE_SIZE = int(os.getenv("TECH_NOTE_QUEUE_SIZE", "1024"))
+
+# The notes are imported from a TechQA JSON file, or from the Parquet or JSON lines shards exported from it
+# (see technote_shards.py), TECH_NOTE_SHARD_READERS shards being read at once
+TECH_NOTE_SOURCE = os.getenv("TECH_NOTE_SOURCE", "techqa_technote_faq_samples.json")
+TECH_NOTE_SHARD_READERS = int(os.getenv("TECH_NOTE_SHARD_READERS", "4"))
+
+# "recreate" (default): the collection is dropped and all the notes are imported again
+# "incremental": the collection is updated in place. The objects have deterministic UUIDs (from their note_id) and a hash
+#   of their content, so the unchanged notes are skipped (not embedded again), the changed ones are replaced, and the
+#   notes which are no longer in the file are deleted. The progress is checkpointed every CHECKPOINT_INTERVAL_SECONDS,
+#   and an interrupted import of the same file resumes from its checkpoint
+TECH_NOTE_IMPORT_MODE = os.getenv("TECH_NOTE_IMPORT_MODE", "recreate")
+CHECKPOINT_INTERVAL_SECONDS = 30.0
+DELETE_CHUNK_SIZE = 1000
+
+# Where the notes are vectorized:
+# "weaviate" (default): by Weaviate, which calls the embedding API (text2vec-transformers) for each object
+# "client": by the importer, in batches of TECH_NOTE_EMBEDDING_BATCH_SIZE notes with WatsonxClient.request_embedding_model()
+#   (or a local backend, see EMBEDDING_BACKEND), and inserted with their vectors. The embedding API can then be off.
+#   The collection has no vectorizer: the retriever embeds the queries itself anyway (see kb_retriever.py)
+# The setting applies when the collection is created, as the vectors of the two modes must not be mixed
+TECH_NOTE_VECTORIZATION = os.getenv("TECH_NOTE_VECTORIZATION", "weaviate")
+TECH_NOTE_EMBEDDING_BATCH_SIZE = int(os.getenv("TECH_NOTE_EMBEDDING_BATCH_SIZE", "128"))
+
+# "none" (default): the notes are imported as whole objects
+# "passages": the notes are also split into passages of at most TECH_NOTE_PASSAGE_TOKENS tokens, overlapping by
+#   TECH_NOTE_PASSAGE_OVERLAP_TOKENS tokens, which are imported into TECH_NOTE_PASSAGE_COLLECTION_NAME with the note_id
+#   of their note, so that the retriever can search them (see kb_retriever.py). The text of a note is usually far
+#   longer than the window of the embedding model (512 tokens for slate), so only its beginning counts in its vector.
+#   The tokens are counted with TECH_NOTE_TOKENIZER (a tokenizer.json file, a directory containing one, or a model name
+#   on the Hugging Face Hub, e.g. the one of the embedding model), or approximated without it
+TECH_NOTE_CHUNKING = os.getenv("TECH_NOTE_CHUNKING", "none")
+TECH_NOTE_PASSAGE_TOKENS = int(os.getenv("TECH_NOTE_PASSAGE_TOKENS", "256"))
+TECH_NOTE_PASSAGE_OVERLAP_TOKENS = int(os.getenv("TECH_NOTE_PASSAGE_OVERLAP_TOKENS", "32"))
+TECH_NOTE_TOKENIZER = os.getenv("TECH_NOTE_TOKENIZER")
+# A note is added once its passages are flushed to Weaviate, so that its hash isn't stored when they failed:
+# the notes are held back by this many, as each flush waits for the batches in flight
+PASSAGE_FLUSH_NOTES = 1000
 
 weaviate_client = weaviate.connect_to_local(
                 host=os.getenv("WEAVIATE_HOSTNAME", "localhost"), 
                 port=int(os.getenv("WEAVIATE_PORT", "8082")),
                 grpc_port=int(os.getenv("WEAVIATE_GRPC_PORT", "50051")))
 
+def _vector_quantizer(quantizer: str | None):
+    quantizer = (quantizer or "none").lower()
+    if quantizer == "none":
+        return None
+    elif quantizer == "sq":
+        return Configure.VectorIndex.Quantizer.sq()
+    elif quantizer == "pq":
+        return Configure.VectorIndex.Quantizer.pq()
+    elif quantizer == "bq":
+        return Configure.VectorIndex.Quantizer.bq()
+    raise ValueError(f"Unsupported vector quantizer: {quantizer}. Supported: none, sq, pq, bq")
+
+def _vectorizer_config(vectorization: str | None):
+    vectorization = (vectorization or "weaviate").lower()
+    if vectorization == "weaviate":
+        return Configure.Vectorizer.text2vec_transformers()
+    elif vectorization == "client":
+        return Configure.Vectorizer.none()
+    raise ValueError(f"Unsupported vectorization: {vectorization}. Supported: weaviate, client")
+
 def create_collection(
-    collection_name, collection_properties, delete_if_exists=False
+    collection_name, collection_properties, delete_if_exists=False, quantizer=None, vectorization="weaviate"
 ) -> Collection | None:
     collection = weaviate_client.collections.get(collection_name)
 
@@ -40,12 +131,13 @@ def create_collection(
         print(f"The {collection_name} has been existed already")
         return collection
     else:
-        print(f"Creating the collection {collection_name}...")
+        print(f"Creating the collection {collection_name} (vector quantizer: {quantizer or 'none'}, vectorization: {vectorization})...")
         collection = weaviate_client.collections.create(
             collection_name,
-            vectorizer_config=Configure.Vectorizer.text2vec_transformers(),
+            vectorizer_config=_vectorizer_config(vectorization),
             vector_index_config=Configure.VectorIndex.hnsw(
-                distance_metric=VectorDistances.COSINE
+                distance_metric=VectorDistances.COSINE,
+                quantizer=_vector_quantizer(quantizer)
             ),
             properties=collection_properties,
         )
@@ -54,17 +146,88 @@ def create_collection(
 
 
 
+def _batch(collection: Collection, mode: str, batch_size: int, concurrency: int):
+    mode = (mode or "fixed").lower()
+    if mode == "dynamic":
+        return collection.batch.dynamic()
+    elif mode == "fixed":
+        return collection.batch.fixed_size(batch_size=batch_size, concurrent_requests=concurrency)
+    raise ValueError(f"Unsupported batch mode: {mode}. Supported: fixed, dynamic")
+
+def _print_progress(number_of_items_added, number_of_errors, started_at, end="\r"):
+    elapsed_seconds = time.perf_counter() - started_at
+    throughput = number_of_items_added / elapsed_seconds if elapsed_seconds > 0 else 0.0
+    print(f"Added {number_of_items_added} notes, {number_of_errors} errors, "
+          f"{elapsed_seconds:.1f}s, {throughput:.1f} notes/s   ", end=end, flush=True)
+
+def _ijson_backend():
+    """The C backend of ijson (yajl2_c) parses several times faster than the python one"""
+    try:
+        return ijson.get_backend("yajl2_c")
+    except ImportError:
+        print("\033[90m(The C backend of ijson is not available, parsing with the python backend)\033[0m")
+        return ijson
+
+def _note_text(note: dict) -> str:
+    """The text of a note which is embedded in the client vectorization mode"""
+    return f"{note.get('title') or ''}\n{note.get('text') or ''}".strip()
+
+def _content_hash(note: dict) -> str:
+    """A hash of the properties of a note, to tell the notes which changed since the last import"""
+    return hashlib.sha256(json.dumps(note, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _existing_notes(collection: Collection) -> dict:
+    """The content hash and the note_id of the objects of a collection, by UUID (the objects imported before the hashes have none)"""
+    return {str(o.uuid): o.properties for o in collection.iterator(return_properties=["content_hash", "note_id"])}
+
+def _passages(note: dict, tokenizer, max_tokens: int, overlap_tokens: int) -> list[dict]:
+    """The passages of a note: windows of its text of at most max_tokens tokens, overlapping by overlap_tokens tokens.
+    They carry the title and the metadata of their note, and its note_id"""
+    return [{"note_id": note["note_id"], "passage_index": i, "title": note.get("title"), "text": text,
+             "note_metadata": note.get("note_metadata")}
+            for i, text in enumerate(tokenizer.split(note.get("text") or "", max_tokens, overlap_tokens))]
+
+def _source_signature(source_filepath, text_filter) -> dict:
+    """What the items of a source depend on: its files, and the filter (which the shards are read with)"""
+    stats = [os.stat(path) for path in shard_paths(source_filepath) or [source_filepath]]
+    return {"source": os.path.abspath(source_filepath), "source_size": sum(stat.st_size for stat in stats),
+            "source_mtime": max(stat.st_mtime for stat in stats), "text_filter": text_filter}
+
+def _read_checkpoint(checkpoint_filepath, source_filepath, text_filter) -> int:
+    """The number of items of the source file which were done by an interrupted import of the same file, if any"""
+    if not checkpoint_filepath or not os.path.exists(checkpoint_filepath):
+        return 0
+    with open(checkpoint_filepath) as f:
+        checkpoint = json.load(f)
+    if any(checkpoint.get(k) != v for k, v in _source_signature(source_filepath, text_filter).items()):
+        print(f"\033[90m(The checkpoint {checkpoint_filepath} is for another version of the file, ignored)\033[0m")
+        return 0
+    return checkpoint.get("items_done", 0)
+
+def _write_checkpoint(checkpoint_filepath, source_filepath, text_filter, items_done):
+    temp_filepath = checkpoint_filepath + ".tmp"
+    with open(temp_filepath, "w") as f:
+        json.dump({**_source_signature(source_filepath, text_filter), "items_done": items_done}, f)
+    os.replace(temp_filepath, checkpoint_filepath) # never a half-written checkpoint
+
 def export_technotes_to_file(source_filepath, output_filepath, 
                              string_filter_in_text_field:str = None,
+                             format="json",
+                             shard_size=SHARD_SIZE,
                              ):
-    """"An utility"""
+    """"An utility. format: "json" (one indented JSON file), or "parquet" or "jsonl" (shards in the directory output_filepath,
+    which are much faster to import, see technote_shards.py)"""
+    if format != "json":
+        return export_shards(source_filepath, output_filepath, format=format, shard_size=shard_size,
+                             string_filter_in_text_field=string_filter_in_text_field)
+
     print(f"Extracting data items from file {source_filepath}, and write to file {output_filepath}...")
    
     with open(source_filepath, "rb") as input_file, open(output_filepath, "w") as output_file:
         output_file.write("{\n")
 
         first_item = True
-        for i, (key, note) in enumerate(ijson.kvitems(input_file, "")):
+        for i, (key, note) in enumerate(_ijson_backend().kvitems(input_file, "")):
             if (
                 string_filter_in_text_field is None
                 or (
@@ -87,7 +250,31 @@ def export_technotes_to_file(source_filepath, output_filepath,
 def import_tech_note_data(filename, 
                           number_limit = -1,
                           string_filter_in_text_field = "TECHNOTE (FAQ)",
-                          delete_and_recreate_collection=False):
+                          delete_and_recreate_collection=False,
+                          quantizer=TECH_NOTE_VECTOR_QUANTIZER,
+                          batch_mode=TECH_NOTE_BATCH_MODE,
+                          batch_size=TECH_NOTE_BATCH_SIZE,
+                          batch_concurrency=TECH_NOTE_BATCH_CONCURRENCY,
+                          vectorization=TECH_NOTE_VECTORIZATION,
+                          embedding_batch_size=TECH_NOTE_EMBEDDING_BATCH_SIZE,
+                          transform_workers=TECH_NOTE_TRANSFORM_WORKERS,
+                          writers=TECH_NOTE_WRITERS,
+                          queue_size=TECH_NOTE_QUEUE_SIZE,
+                          incremental=False,
+                          checkpoint_filepath=None,
+                          shard_readers=TECH_NOTE_SHARD_READERS,
+                          chunking=TECH_NOTE_CHUNKING,
+                          passage_tokens=TECH_NOTE_PASSAGE_TOKENS,
+                          passage_overlap_tokens=TECH_NOTE_PASSAGE_OVERLAP_TOKENS,
+                          failed_objects_filepath=None):
+    """Import the tech notes in batches, through a pipeline of stages. filename is a TechQA JSON file, or shards (a directory
+    of them, or a single one) read by shard_readers threads. The notes which fail (to be read, embedded or imported)
+    don't stop the import: they are reported at the end, and written to failed_objects_filepath (JSON lines) if given.
+    incremental: update the collection in place (see TECH_NOTE_IMPORT_MODE), checkpointing to checkpoint_filepath if given.
+    chunking: "passages" to import the passages of the notes as well (see TECH_NOTE_CHUNKING)"""
+    if incremental and delete_and_recreate_collection:
+        raise ValueError("An incremental import updates the collection, it can't be recreated")
+
     SCHEMA = [
         Property(name="note_id", data_type=DataType.TEXT),
         Property(name="content", data_type=DataType.TEXT, skip_vectorization=True ),
@@ -100,6 +287,21 @@ def import_tech_note_data(filename,
                     Property(name="productName", data_type=DataType.TEXT),
                     Property(name="productId", data_type=DataType.TEXT),
                     Property(name="canonicalUrl", data_type=DataType.TEXT, skip_vectorization=True)]
+                ),
+        Property(name="content_hash", data_type=DataType.TEXT, skip_vectorization=True)
+        ]
+    PASSAGE_SCHEMA = [
+        Property(name="note_id", data_type=DataType.TEXT, skip_vectorization=True),
+        Property(name="passage_index", data_type=DataType.INT),
+        Property(name="title", data_type=DataType.TEXT),
+        Property(name="text", data_type=DataType.TEXT),
+        Property(name="note_metadata", data_type=DataType.OBJECT,
+                nested_properties=[
+                    Property(name="sourceDocumentId", data_type=DataType.TEXT, skip_vectorization=True),
+                    Property(name="date", data_type=DataType.TEXT, skip_vectorization=True),
+                    Property(name="productName", data_type=DataType.TEXT),
+                    Property(name="productId", data_type=DataType.TEXT, skip_vectorization=True),
+                    Property(name="canonicalUrl", data_type=DataType.TEXT, skip_vectorization=True)]
                 )
         ]
     
@@ -109,36 +311,305 @@ def import_tech_note_data(filename,
         tech_notes = create_collection(collection_name=TECH_NOTE_COLLECTION_NAME,
             collection_properties=SCHEMA,
             delete_if_exists=True,
+            quantizer=quantizer,
+            vectorization=vectorization
         )
 
-    print(f"Importing data from file {filename} into {TECH_NOTE_COLLECTION_NAME} (it may take several minutes)...")
-    with open(filename, "rb") as f:
-        number_of_items_inserted = 0
-        for (key, note) in ijson.kvitems(f, ""):
-            try:
-                lowercased_key_item = {k.lower(): v for k, v in note.items()}
-
-                # rename id to note_id
-                lowercased_key_item['note_id'] = lowercased_key_item.pop('id')
-                lowercased_key_item['note_metadata'] = lowercased_key_item.pop('metadata')
-
-                if (
-                    (number_limit == -1 or number_of_items_inserted < number_limit) and
-                    (string_filter_in_text_field is None
-                    or (
-                        string_filter_in_text_field is not None
-                        and string_filter_in_text_field in note['text']
-                    ))
-                ):
-                    tech_notes.data.insert(lowercased_key_item)
-                    number_of_items_inserted += 1
-                    print(f"{number_of_items_inserted}: {lowercased_key_item['note_id']}",  end=", ", flush=True)
-
-            except Exception as e:
-                print(f"\nError inserting item: {e}")
-                break
-
-        print()
+    chunking = (chunking or "none").lower()
+    if chunking not in ("none", "passages"):
+        raise ValueError(f"Unsupported chunking: {chunking}. Supported: none, passages")
+    passages_collection = None
+    if chunking == "passages":
+        passages_collection = weaviate_client.collections.get(TECH_NOTE_PASSAGE_COLLECTION_NAME)
+        if delete_and_recreate_collection or not passages_collection.exists():
+            passages_collection = create_collection(collection_name=TECH_NOTE_PASSAGE_COLLECTION_NAME,
+                collection_properties=PASSAGE_SCHEMA,
+                delete_if_exists=True,
+                quantizer=quantizer,
+                vectorization=vectorization
+            )
+        tokenizer = load_tokenizer(TECH_NOTE_TOKENIZER)
+        # in the hashes, so that the notes are cut again when the passages settings change
+        passage_settings = f"{passage_tokens}/{passage_overlap_tokens}/{tokenizer.name}"
+
+    content_hash_property = next(p for p in SCHEMA if p.name == "content_hash")
+    if incremental and not any(p.name == "content_hash" for p in tech_notes.config.get().properties):
+        tech_notes.config.add_property(content_hash_property) # a collection created before the hashes
+
+    client_vectorization = (vectorization or "weaviate").lower() == "client"
+    embedding_model = WatsonxClient.request_embedding_model() if client_vectorization else None
+
+    existing_notes = _existing_notes(tech_notes) if incremental else {}
+    resume_from = _read_checkpoint(checkpoint_filepath, filename, string_filter_in_text_field) if incremental else 0
+    if resume_from:
+        print(f"Resuming the import of {filename} after its first {resume_from} items (see {checkpoint_filepath})")
+
+    shards = shard_paths(filename)
+    print(f"Importing data from {f'{len(shards)} shards in ' if shards else 'file '}"
+          f"{filename} into {TECH_NOTE_COLLECTION_NAME} "
+          f"({'incremental, ' if incremental else ''}"
+          f"{batch_mode} batches, size {batch_size}, concurrency {batch_concurrency}, vectorization {vectorization}, "
+          f"{transform_workers} transform workers, {writers} writers"
+          + (f", passages of {passage_tokens} tokens)..." if passages_collection else ")..."))
+    failed_items = [] # (note key, error message)
+    retry_from = None # the index of the first failed note: a checkpoint doesn't go past it, so a resumed import retries it
+    flushed_items, flushed_errors = resume_from, 0 # the notes done, and the number of batch errors, at the last flush
+    started_at = time.perf_counter()
+    checkpointed_at = started_at
+    number_of_items_reserved = 0 # the notes taken by the writers, up to number_limit
+    number_of_items_added = 0
+    number_of_items_updated = 0
+    number_of_items_unchanged = 0
+    number_of_passages_added = 0
+    counter_lock = threading.Lock()
+    batch_lock = threading.Lock()
+    writer_state = threading.local() # the notes waiting to be embedded by a writer, in the client vectorization mode
+    seen_uuids = set() # the notes of the file, the other objects of the collection are deleted by an incremental import
+    watermark = Watermark(start=resume_from)
+    held_notes = [] # (index, uuid, note, vector) of the notes whose passages are in the passage batch, see add_held_notes
+    passage_errors_seen = 0
+
+    def retry_later(index):
+        nonlocal retry_from
+        with counter_lock:
+            retry_from = index if retry_from is None else min(retry_from, index)
+
+    def is_selected(note):
+        return string_filter_in_text_field is None or string_filter_in_text_field in note['text']
+
+    def read_notes():
+        with nullcontext() if shards else open(filename, "rb") as f:
+            # the shards are read with the filter: the notes filtered out are not even built
+            items = (read_shards(shards, readers=shard_readers, text_filter=string_filter_in_text_field) if shards
+                     else _ijson_backend().kvitems(f, ""))
+            for index, (key, note) in enumerate(items):
+                if index < resume_from:
+                    # done by the interrupted import, only their ids are needed (not to delete them)
+                    try:
+                        if is_selected(note):
+                            seen_uuids.add(generate_uuid5(note['id']))
+                    except Exception:
+                        pass
+                    continue
+                yield index, key, note
+
+    def transform(item, emit):
+        nonlocal number_of_items_unchanged
+        index, key, note = item
+        try:
+            if not is_selected(note):
+                watermark.done(index)
+                return
+
+            lowercased_key_item = {k.lower(): v for k, v in note.items()}
+
+            # rename id to note_id
+            lowercased_key_item['note_id'] = lowercased_key_item.pop('id')
+            lowercased_key_item['note_metadata'] = lowercased_key_item.pop('metadata')
+            lowercased_key_item['content_hash'] = _content_hash(lowercased_key_item if passages_collection is None
+                                                                else {**lowercased_key_item, "passage_settings": passage_settings})
+            uuid = generate_uuid5(lowercased_key_item['note_id'])
+        except Exception as e:
+            failed_items.append((key, f"{e}"))
+            retry_later(index)
+            watermark.done(index)
+            return
+
+        seen_uuids.add(uuid)
+        if existing_notes.get(uuid, {}).get("content_hash") == lowercased_key_item['content_hash']:
+            with counter_lock:
+                number_of_items_unchanged += 1
+            watermark.done(index)
+            return
+        emit((index, uuid, lowercased_key_item, None))
+
+    def chunk(item, emit):
+        index, uuid, note, _ = item
+        emit((index, uuid, note, _passages(note, tokenizer, passage_tokens, passage_overlap_tokens)))
+
+    def add_notes(items, vectors=None):
+        """items are (index, uuid, note, passages). vectors, in the client vectorization mode, are the vectors
+        of each item: the vector of its note, then the vectors of its passages"""
+        nonlocal number_of_items_added, number_of_items_updated, number_of_passages_added
+        updated_note_ids = [note['note_id'] for _, uuid, note, _ in items if uuid in existing_notes]
+        if passages_collection and updated_note_ids:
+            # the passages of the previous versions of the notes, which may have been cut differently
+            passages_collection.data.delete_many(where=Filter.by_property("note_id").contains_any(updated_note_ids))
+
+        with batch_lock:
+            for i, (index, uuid, note, passages) in enumerate(items):
+                item_vectors = vectors[i] if vectors else None
+                note_vector = item_vectors[0] if item_vectors else None
+                if passages_collection is None:
+                    batch.add_object(properties=note, uuid=uuid, vector=note_vector)
+                    continue
+                for j, passage in enumerate(passages or []):
+                    passage_batch.add_object(properties=passage, uuid=generate_uuid5(f"{note['note_id']}/{j}"),
+                                             vector=item_vectors[j + 1] if item_vectors else None)
+                held_notes.append((index, uuid, note, note_vector))
+            if len(held_notes) >= PASSAGE_FLUSH_NOTES:
+                add_held_notes()
+        if passages_collection is None:
+            for index, _, _, _ in items:
+                watermark.done(index)
+        with counter_lock:
+            number_of_items_added += len(items) - len(updated_note_ids)
+            number_of_items_updated += len(updated_note_ids)
+            number_of_passages_added += sum(len(passages or []) for _, _, _, passages in items)
+
+    def add_held_notes():
+        """Add the held notes to the batch, once their passages are flushed. Which passages failed is only known
+        at the end of the import: when any failed since the previous flush, the notes are added without their hash,
+        so the next incremental import imports them and their passages again. The caller holds batch_lock"""
+        nonlocal passage_errors_seen
+        passage_batch.flush()
+        passages_failed = passage_batch.number_errors > passage_errors_seen
+        passage_errors_seen = passage_batch.number_errors
+        for index, uuid, note, note_vector in held_notes:
+            batch.add_object(properties={**note, "content_hash": ""} if passages_failed else note, uuid=uuid, vector=note_vector)
+            watermark.done(index)
+        held_notes.clear()
+
+    def embed_and_add_pending_notes():
+        items = writer_state.pending_items
+        writer_state.pending_items = []
+        texts = [[_note_text(note)] + [_note_text(passage) for passage in passages or []] for _, _, note, passages in items]
+        embedding_started_at = time.perf_counter()
+        try:
+            flat_vectors = embedding_model.embed_documents([text for item_texts in texts for text in item_texts])
+        except Exception as e:
+            # not in Weaviate: a resumed import starts from them (see retry_from), and the next incremental import
+            # of the whole file embeds them again anyway, as their new hashes are not stored
+            failed_items.extend((note['note_id'], f"Embedding failed: {e}") for _, _, note, _ in items)
+            for index, _, _, _ in items:
+                retry_later(index)
+                watermark.done(index)
+            return
+        finally:
+            embed_stats.record(sum(len(item_texts) for item_texts in texts), time.perf_counter() - embedding_started_at)
+
+        vectors, offset = [], 0
+        for item_texts in texts:
+            vectors.append(flat_vectors[offset:offset + len(item_texts)])
+            offset += len(item_texts)
+        add_notes(items, vectors)
+
+    def write(item, emit):
+        nonlocal number_of_items_reserved
+        with counter_lock:
+            if number_limit != -1 and number_of_items_reserved >= number_limit:
+                pipeline.stop()
+                return
+            number_of_items_reserved += 1
+
+        if client_vectorization:
+            writer_state.__dict__.setdefault("pending_items", []).append(item)
+            if len(writer_state.pending_items) >= embedding_batch_size:
+                embed_and_add_pending_notes()
+        else:
+            add_notes([item])
+
+    def flush_writer(emit):
+        if client_vectorization and getattr(writer_state, "pending_items", None):
+            embed_and_add_pending_notes()
+
+    def checkpoint_items(items_done, number_of_errors) -> int:
+        """Where a resumed import starts, after a flush of the batches: the notes before items_done are in Weaviate,
+        or among the batch errors. Which objects failed is only known at the end of the import, so when there are
+        new errors, all the notes since the previous flush are retried"""
+        nonlocal flushed_items, flushed_errors
+        if number_of_errors > flushed_errors:
+            retry_later(flushed_items)
+        flushed_items, flushed_errors = items_done, number_of_errors
+        return items_done if retry_from is None else min(items_done, retry_from)
+
+    def report_progress(elapsed_seconds):
+        nonlocal checkpointed_at
+        _print_progress(number_of_items_added + number_of_items_updated,
+                        len(failed_items) + batch.number_errors + (passage_batch.number_errors if passage_batch else 0), started_at)
+        if incremental and checkpoint_filepath and time.perf_counter() - checkpointed_at >= CHECKPOINT_INTERVAL_SECONDS:
+            # the notes before the watermark were added to the batch (after their passages were flushed):
+            # once flushed, they are in Weaviate or failed
+            with batch_lock:
+                if passages_collection:
+                    add_held_notes()
+                items_done = watermark.value
+                batch.flush()
+                number_of_errors = batch.number_errors + (passage_batch.number_errors if passage_batch else 0)
+            _write_checkpoint(checkpoint_filepath, filename, string_filter_in_text_field,
+                              checkpoint_items(items_done, number_of_errors))
+            checkpointed_at = time.perf_counter()
+
+    pipeline = Pipeline(read_notes, queue_size=queue_size).stage("transform", transform, workers=transform_workers)
+    if passages_collection:
+        pipeline.stage("chunk", chunk, workers=transform_workers)
+    pipeline.stage("write", write, workers=writers, on_end=flush_writer)
+    embed_stats = pipeline.add_stats("embed", workers=writers)
+
+    with (_batch(tech_notes, batch_mode, batch_size, batch_concurrency) as batch,
+          _batch(passages_collection, batch_mode, batch_size, batch_concurrency) if passages_collection else nullcontext() as passage_batch):
+        pipeline_seconds = pipeline.run(progress=report_progress, progress_interval_seconds=PROGRESS_REPORT_INTERVAL_SECONDS)
+        flush_started_at = time.perf_counter()
+        if passages_collection:
+            with batch_lock:
+                add_held_notes()
+    flush_seconds = time.perf_counter() - flush_started_at # the batches still in flight at the end of the pipeline
+    failed_items.extend((None, error) for error in pipeline.errors)
+    number_of_items_written = number_of_items_added + number_of_items_updated
+
+    # the objects rejected by Weaviate (e.g. the embedding API failed for them), once all the batches are flushed
+    for failed_object in tech_notes.batch.failed_objects:
+        failed_items.append((failed_object.object_.properties.get("note_id"), failed_object.message))
+    if passages_collection:
+        for failed_object in passages_collection.batch.failed_objects:
+            failed_items.append((failed_object.object_.properties.get("note_id"), f"Passage: {failed_object.message}"))
+
+    # the notes which are no longer in the file, only known once the whole file is read
+    number_of_items_deleted = 0
+    is_read = not pipeline.is_stopped() and not pipeline.errors
+    if incremental and is_read:
+        removed_uuids = [uuid for uuid in existing_notes if uuid not in seen_uuids]
+        for i in range(0, len(removed_uuids), DELETE_CHUNK_SIZE):
+            removed_chunk = removed_uuids[i:i + DELETE_CHUNK_SIZE]
+            result = tech_notes.data.delete_many(where=Filter.by_id().contains_any(removed_chunk))
+            number_of_items_deleted += result.successful
+            removed_note_ids = [existing_notes[uuid].get("note_id") for uuid in removed_chunk if existing_notes[uuid].get("note_id")]
+            if passages_collection and removed_note_ids:
+                passages_collection.data.delete_many(where=Filter.by_property("note_id").contains_any(removed_note_ids))
+    elif incremental:
+        print("\033[90m(The file was not read to its end: the removed notes are not deleted)\033[0m")
+
+    # the checkpoint is only removed when all the notes are in Weaviate. Otherwise it is kept, at the first failed note
+    # at the latest, so that the next import of the file resumes from there and retries the failed notes
+    if incremental and checkpoint_filepath:
+        if is_read and not failed_items:
+            if os.path.exists(checkpoint_filepath):
+                os.remove(checkpoint_filepath)
+        else:
+            number_of_errors = len(tech_notes.batch.failed_objects) + (len(passages_collection.batch.failed_objects)
+                                                                       if passages_collection else 0)
+            items_done = checkpoint_items(watermark.value, number_of_errors)
+            _write_checkpoint(checkpoint_filepath, filename, string_filter_in_text_field, items_done)
+            print(f"\033[90m(The checkpoint is kept: the next import of {filename} resumes from its item {items_done})\033[0m")
+
+    _print_progress(number_of_items_written, len(failed_items), started_at, end="\n")
+    print(f"Imported {number_of_items_written - len(tech_notes.batch.failed_objects)} notes into {TECH_NOTE_COLLECTION_NAME}")
+    if passages_collection:
+        print(f"Imported {number_of_passages_added - len(passages_collection.batch.failed_objects)} passages "
+              f"into {TECH_NOTE_PASSAGE_COLLECTION_NAME}")
+    if incremental:
+        print(f"{number_of_items_added} new, {number_of_items_updated} updated, {number_of_items_unchanged} unchanged, "
+              f"{number_of_items_deleted} deleted notes")
+    print(f"\033[90m{pipeline.report(pipeline_seconds)}\n(and {flush_seconds:.1f}s to flush the last batches)\033[0m")
+    if failed_items:
+        print(f"{len(failed_items)} notes failed, e.g.:")
+        for key, message in failed_items[:5]:
+            print(f"\033[90m  {key}: {message}\033[0m")
+        if failed_objects_filepath:
+            with open(failed_objects_filepath, "w") as output_file:
+                for key, message in failed_items:
+                    output_file.write(json.dumps({"note_id": key, "error": message}) + "\n")
+            print(f"The failed notes are listed in {failed_objects_filepath}")
 
     return tech_notes
 
@@ -149,10 +620,20 @@ if __name__ == "__main__":
         if not weaviate_client.is_ready():
             raise Exception("Weaviate is not ready")
 
-        print(f"Create the collection {TECH_NOTE_COLLECTION_NAME} (dropped if exists)")
-        tech_notes = import_tech_note_data("techqa_technote_faq_samples.json",
-                                           number_limit=300,
-                                           delete_and_recreate_collection=True)
+        incremental = TECH_NOTE_IMPORT_MODE.lower() == "incremental"
+        if incremental:
+            # the whole file, so that the notes which were removed from it can be deleted
+            print(f"Update the collection {TECH_NOTE_COLLECTION_NAME}")
+            tech_notes = import_tech_note_data(TECH_NOTE_SOURCE,
+                                               incremental=True,
+                                               checkpoint_filepath="technotes_import_checkpoint.json",
+                                               failed_objects_filepath="failed_technotes.jsonl")
+        else:
+            print(f"Create the collection {TECH_NOTE_COLLECTION_NAME} (dropped if exists)")
+            tech_notes = import_tech_note_data(TECH_NOTE_SOURCE,
+                                               number_limit=300,
+                                               delete_and_recreate_collection=True,
+                                               failed_objects_filepath="failed_technotes.jsonl")
 
         tech_notes = weaviate_client.collections.get(TECH_NOTE_COLLECTION_NAME)
 
@@ -171,7 +652,12 @@ if __name__ == "__main__":
             if len(response.objects) > 0:
                 query = response.objects[0].properties['title']
                 print(f"\n\n*** Try querying the Weaviate database with the query: {query}")
-                result = tech_notes.query.near_text(query=query, limit=1)
+                if TECH_NOTE_VECTORIZATION.lower() == "client":
+                    # the collection has no vectorizer for near_text: the query is embedded like the notes were
+                    query_vector = WatsonxClient.request_embedding_model().embed_query(query)
+                    result = tech_notes.query.near_vector(near_vector=query_vector, limit=1)
+                else:
+                    result = tech_notes.query.near_text(query=query, limit=1)
                 print(f"*** Result:\n\n{result.objects[0].properties['text']}")
             else:
                 print("\nNo result")
@@ -0,0 +1,60 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# A check of the LLM response cache (see common_libs/llm_cache.py) on the agent: the same turn is run twice
+# from a new session, streamed as in the chat, and the second one must be answered from the cache only,
+# without any call to watsonx. The cache is a new one in memory, so that the first turn is a miss.
+# The script exits with code 1 when the second turn misses the cache, so it can gate a CI job, e.g. with the stand-in:
+#
+#   $ python ../common_libs/watsonx_standin.py synthesize --text "Final Answer: Please restart the server." &
+#   $ WATSONX_URL=https://localhost:8787 WATSONX_STANDIN=true python llm_cache_check.py
+
+import argparse
+import os
+import sys
+
+# set before the agent is created, as the cache is configured when its models are requested
+os.environ["WATSONX_LLM_CACHE_ENABLED"] = "true"
+os.environ["WATSONX_LLM_CACHE_PATH"] = "" # in memory only
+
+from tech_support_agent import TechSupportAgent, WatsonxClient
+
+def run_turn(support_agent: TechSupportAgent, user_input: str) -> str:
+    support_agent.clear_memory() # the chat history is part of the prompts
+    return "".join(support_agent.query_stream(user_input))
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that a repeated turn of the agent is answered from the LLM cache")
+    parser.add_argument("--input", default="My server doesn't start after the last fix pack", help="the user input of the turn")
+    args = parser.parse_args()
+
+    support_agent = TechSupportAgent.get_instance()
+    llm_cache = WatsonxClient.get_llm_cache()
+
+    first_response = run_turn(support_agent, args.input)
+    first_stats = llm_cache.stats()
+    second_response = run_turn(support_agent, args.input)
+    second_stats = llm_cache.stats()
+
+    hits = second_stats["hits"] - first_stats["hits"]
+    misses = second_stats["misses"] - first_stats["misses"]
+    print(f"\nFirst turn: {first_stats['misses']} misses, {first_stats['hits']} hits")
+    print(f"Second turn: {misses} misses, {hits} hits, in {support_agent.last_stream_stats['total_time']:.2f}s")
+
+    failures = []
+    if misses or not hits:
+        failures.append("the second turn wasn't answered from the cache only")
+    if second_response != first_response:
+        failures.append("the second turn got another response")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("OK: the repeated turn was answered from the cache")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
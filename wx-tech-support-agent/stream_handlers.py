@@ -0,0 +1,49 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+from langchain_core.callbacks import BaseCallbackHandler
+from typing import Any, Callable
+
+class FinalAnswerStreamHandler(BaseCallbackHandler):
+    """Forwards to a sink the tokens that the ReAct reasoning LLM generates after "Final Answer:",
+    i.e. the answer to the user, while the thoughts and actions before it are held back.
+    All the tokens of the LLM runs tagged with ANSWER_TAG are forwarded (e.g. a tool answering the user directly).
+    A handler is made for each query, so the sink goes with the callbacks of the run"""
+
+    FINAL_ANSWER_MARKER = "Final Answer:"
+    ANSWER_TAG = "answer_to_user"
+
+    def __init__(self, sink: Callable[[str], Any]):
+        self._sink = sink
+        self._buffer = ""
+        self._is_final_answer = False
+        self._has_sent = False
+
+    def on_llm_start(self, *args, tags=None, **kwargs):
+        # each step of the agent is a new generation
+        self._buffer = ""
+        self._is_final_answer = self.ANSWER_TAG in (tags or [])
+        self._has_sent = False
+
+    def _send(self, text: str):
+        if not self._has_sent:
+            text = text.lstrip() # the spaces between the marker and the answer
+            if not text:
+                return
+            self._has_sent = True
+        self._sink(text)
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if self._is_final_answer:
+            self._send(token)
+            return
+
+        self._buffer += token
+        index = self._buffer.find(self.FINAL_ANSWER_MARKER)
+        if index >= 0:
+            self._is_final_answer = True
+            self._send(self._buffer[index + len(self.FINAL_ANSWER_MARKER):])
@@ -5,17 +5,15 @@
 # Author: Nguyen, Hung (Howie) Sy
 #
 
-print("\033[90m(Please wait. Loading...)\033[0m")
-
-from langchain.agents import AgentExecutor, tool, create_react_agent
-from langchain_core.prompts import PromptTemplate
+# LangChain and the watsonx SDK take seconds to import, so they are imported when the agent is created
+# (see TechSupportAgent._init) rather than at startup
 import traceback 
 import prompts
 import sys
 import time
-from prompt_toolkit import prompt
-from prompt_toolkit.styles import Style
 from collections import deque
+from typing import Iterable, Iterator
+import queue
 import threading
 
 # Load environment variables from the file .env 
@@ -24,6 +22,7 @@ load_dotenv()
 
 sys.path.append("../common_libs") # not a good pratice but it's ok in this case
 from watsonx import WatsonxClient
+import tracing
 
 MAX_ITERATIONS = 8
 NUMBER_OF_RETRIES = 0
@@ -82,6 +81,14 @@ class TechSupportAgent():
         return cls._instance
 
     def _init(self):
+        print("\033[90m(Please wait. Loading...)\033[0m")
+        global AgentExecutor, PromptTemplate, FinalAnswerStreamHandler, TracingCallbackHandler
+        from langchain.agents import AgentExecutor, create_react_agent
+        from langchain_core.tools import StructuredTool
+        from langchain_core.prompts import PromptTemplate
+        from stream_handlers import FinalAnswerStreamHandler
+        from tracing_callbacks import TracingCallbackHandler
+
         print("\nRequest the models from WatsonX...")
         self.llama_llm = WatsonxClient.request_llm(
                                     model_id="meta-llama/llama-3-1-70b-instruct",
@@ -96,10 +103,15 @@ class TechSupportAgent():
                                     stop_sequences=["<|end_of_text|>"])
 
         # Set up LangChain's ReAct framework
-        self._tools = [self.default_action, 
-             self.generate_a_clarifying_question, 
-             self.diagnosis_and_solution, 
-             self.escalate_to_human_support]
+        # each tool has a sync and an async version, used by query and aquery respectively
+        self._tools = [StructuredTool.from_function(func=self.default_action, coroutine=self.adefault_action,
+                                                    name="default_action", return_direct=False), 
+             StructuredTool.from_function(func=self.generate_a_clarifying_question, coroutine=self.agenerate_a_clarifying_question,
+                                          name="generate_a_clarifying_question", return_direct=False), 
+             StructuredTool.from_function(func=self.diagnosis_and_solution, coroutine=self.adiagnosis_and_solution,
+                                          name="diagnosis_and_solution", return_direct=True), 
+             StructuredTool.from_function(func=self.escalate_to_human_support, coroutine=self.aescalate_to_human_support,
+                                          name="escalate_to_human_support", return_direct=True)]
         
         self._prompt_template_react = PromptTemplate.from_template(prompts.PROMPT_TEMPLATE__REACT)
 
@@ -116,9 +128,24 @@ class TechSupportAgent():
                                     )
 
         self.chat_memory = ChatMemory()
+        self.last_stream_stats = None # the timings of the last query_stream
+
+    @staticmethod
+    def _is_streamed(callbacks) -> bool:
+        """Whether the callbacks of a run (a list of handlers, or the callback manager given to a tool)
+        stream the answer to the user"""
+        handlers = callbacks.handlers if hasattr(callbacks, "handlers") else (callbacks or [])
+        return any(isinstance(handler, FinalAnswerStreamHandler) for handler in handlers)
+
+    def _generate_answer(self, prompt: str, callbacks=None) -> str:
+        """Generate a response to the user with the granite model. When the run is streamed, the tokens go to
+        the stream handler among the callbacks as they are generated (a cached response comes as one chunk)"""
+        config = {"callbacks": callbacks, "tags": [FinalAnswerStreamHandler.ANSWER_TAG]}
+        if not self._is_streamed(callbacks):
+            return self.granite_llm.invoke(prompt, config=config)
+        return "".join(self.granite_llm.stream(prompt, config=config))
 
     @staticmethod
-    @tool("default_action", return_direct=False)
     def default_action(input: str):
         """This is the default action that the agent can take when three is no other action"""
         
@@ -130,16 +157,20 @@ class TechSupportAgent():
                 "Do not take the next action or use another tool, instead provide the final answer/response.\n")
 
     @staticmethod
-    @tool("generate_a_clarifying_question", return_direct=False)
-    def generate_a_clarifying_question(input: str):
-        """Generating a clarifying question to gather relevant information about the issue.
-        This will allow the issue to be identified more clearly"""
+    async def adefault_action(input: str):
+        """This is the default action that the agent can take when three is no other action"""
+        return TechSupportAgent.default_action(input)
+
+    @staticmethod
+    def _clarifying_questions_prompt() -> str:
         support_agent = TechSupportAgent.get_instance()
 
         prompt_template= PromptTemplate(input_variables=["chat_history"],
                                         template=prompts.PROMPT_TEMPLATE__CLARIFYING_QUESTIONS)
-        prompt = prompt_template.format(chat_history=support_agent.chat_memory.to_string())
-        questions = support_agent.granite_llm.invoke(prompt)
+        return prompt_template.format(chat_history=support_agent.chat_memory.to_string())
+
+    @staticmethod
+    def _clarifying_questions_instruction(questions: str) -> str:
         questions = questions.strip().removesuffix("```").removeprefix("```")
 
         response = ("[The instruction for the agent]: Refer to the JSON array below for clarifying questions that you can use to ask the user:"
@@ -152,25 +183,53 @@ class TechSupportAgent():
         return response
 
     @staticmethod
-    @tool("diagnosis_and_solution", return_direct=True)
-    def diagnosis_and_solution(input: str):
+    def generate_a_clarifying_question(input: str):
+        """Generating a clarifying question to gather relevant information about the issue.
+        This will allow the issue to be identified more clearly"""
+        support_agent = TechSupportAgent.get_instance()
+        questions = support_agent.granite_llm.invoke(TechSupportAgent._clarifying_questions_prompt())
+        return TechSupportAgent._clarifying_questions_instruction(questions)
+
+    @staticmethod
+    async def agenerate_a_clarifying_question(input: str):
+        """Generating a clarifying question to gather relevant information about the issue.
+        This will allow the issue to be identified more clearly"""
+        support_agent = TechSupportAgent.get_instance()
+        questions = await support_agent.granite_llm.ainvoke(TechSupportAgent._clarifying_questions_prompt())
+        return TechSupportAgent._clarifying_questions_instruction(questions)
+
+    @staticmethod
+    def _diagnosis_and_solution_prompt() -> str:
+        support_agent = TechSupportAgent.get_instance()
+
+        prompt_template= PromptTemplate(input_variables=["chat_history"],
+                                        template=prompts.PROMPT_TEMPLATE__DIAGNOSIS_SOLUTION)
+        return prompt_template.format(chat_history=support_agent.chat_memory.to_string())
+
+    @staticmethod
+    def diagnosis_and_solution(input: str, callbacks=None):
         """This is to perform the step Diagnosis and Solution Suggestion. 
         Analyze gathered information to hypothesize the root cause of the issue. 
         And then suggest a solution based on the diagnosis information. Provide step-by-step instructions for resolving the issue. 
         Additionally, ask the user to confirm if the issue is resolved."""
+        # callbacks: the callbacks of the agent run, given by the tool (they aren't an argument of the agent)
         support_agent = TechSupportAgent.get_instance()
-
-        prompt_template= PromptTemplate(input_variables=["chat_history"],
-                                        template=prompts.PROMPT_TEMPLATE__DIAGNOSIS_SOLUTION)
-        prompt = prompt_template.format(chat_history=support_agent.chat_memory.to_string())
-        response = support_agent.granite_llm.invoke(prompt)
+        response = support_agent._generate_answer(TechSupportAgent._diagnosis_and_solution_prompt(), callbacks)
 
         # print("\033[90m(Debug: The diagnosis_and_solution tool was invoked)\033[0m")
 
         return response
 
     @staticmethod
-    @tool("escalate_to_human_support", return_direct=True)
+    async def adiagnosis_and_solution(input: str):
+        """This is to perform the step Diagnosis and Solution Suggestion. 
+        Analyze gathered information to hypothesize the root cause of the issue. 
+        And then suggest a solution based on the diagnosis information. Provide step-by-step instructions for resolving the issue. 
+        Additionally, ask the user to confirm if the issue is resolved."""
+        support_agent = TechSupportAgent.get_instance()
+        return await support_agent.granite_llm.ainvoke(TechSupportAgent._diagnosis_and_solution_prompt())
+
+    @staticmethod
     def escalate_to_human_support(input: str):
         """
         Escalate the issue to the human support as the issue could not resolved by the AI agent/assistant.
@@ -194,6 +253,14 @@ class TechSupportAgent():
                  f"and they will contact you shortly. Below is the email:\n\n~~~\n{email_body}\n~~~\n\n"
                  "If anything else, please open a new support session. Thank you!")
         return result
+
+    @staticmethod
+    async def aescalate_to_human_support(input: str):
+        """
+        Escalate the issue to the human support as the issue could not resolved by the AI agent/assistant.
+        If the input is too long, make a summary as the input instead.
+        """
+        return TechSupportAgent.escalate_to_human_support(input)
         
     def greet_user(self, username):
         try:
@@ -206,50 +273,114 @@ class TechSupportAgent():
         self.chat_memory.add_agent_message(greeting)
         return greeting
 
-    def query(self, user_input):
+    @staticmethod
+    def _agent_response(result: dict) -> str | None:
+        """Return the response of a run of the agent executor, None if it failed (then result['error'] tells why)"""
+        agent_response = result.get('output')
+        if agent_response is not None and "Agent stopped due to iteration limit" in agent_response:
+            del result['output']
+            agent_response = None
+            result['error'] = "Agent stopped due to iteration limit or time limit"
+        return agent_response
+
+    @staticmethod
+    def _fallback_prompt(result: dict) -> str | None:
+        """When the agent failed, the prompt to make a response out of its last step, if any"""
+        intermediate_steps = result.get('intermediate_steps')
+        if not intermediate_steps:
+            return None
+
+        last_step_response = intermediate_steps[-1][-1] 
+        # print(f"DEBUG last_step_response:\n{last_step_response}\n")
+        return ("<|start_of_role|>system<|end_of_role|>You are a helpful agent (assistant) assisting the user with troubleshooting technical issues. "
+                f"Your task is now to generate a response using the following context or instructions:\n{last_step_response}"
+                "<|end_of_text|>\n<|start_of_role|>assistant<|end_of_role|>")
+
+    @staticmethod
+    def _callbacks(token_sink=None) -> list:
+        """The callbacks of a run of the agent executor: the ReAct iterations and the tool calls are traced,
+        and when streaming, the tokens of the answer are forwarded to token_sink as they come"""
+        callbacks = [TracingCallbackHandler()]
+        if token_sink:
+            callbacks.append(FinalAnswerStreamHandler(token_sink))
+        return callbacks
+
+    def _final_response(self, agent_response: str | None, result: dict) -> str:
+        # after all retries, if still no result:
+        if agent_response:
+            self.chat_memory.add_agent_message(agent_response)
+            return agent_response
+        return f"Sorry, something was wrong due to an error ({result.get('error')}). Please try entering the input again..."
+
+    def query(self, user_input, token_sink=None):
+        """Return the response of the agent to the user input. With a token_sink (e.g. set by query_stream),
+        the tokens of the response are also given to it as they are generated"""
         try:
             self.chat_memory.add_user_message(user_input)
+            callbacks = self._callbacks(token_sink)
+
+            with tracing.start_span("tech_support_agent.query", streaming=token_sink is not None):
+                for i in range(NUMBER_OF_RETRIES + 1):
+                    if not token_sink: # the progress dots would be mixed with the streamed response
+                        print(f"\033[90m...\033[0m", end=' ', flush=True)
+                    
+                    result = {}
+                    try:
+                        result = self._agent_executor.invoke({"user_input": user_input, 
+                                                        "chat_history": self.chat_memory.to_string()},
+                                                        config={"callbacks": callbacks})
+                    except Exception as e:
+                        result['error'] = f"{e}"
+                        traceback.print_exc()
+                    agent_response = self._agent_response(result)
+
+                    # if no good result returned from the model, let it retry
+                    if result.get('error'):
+                        fallback_prompt = self._fallback_prompt(result) if i >= NUMBER_OF_RETRIES else None
+                        if fallback_prompt:
+                            if not token_sink:
+                                print(f"\033[90m...\033[0m", end=' ', flush=True)
+                            agent_response = self._generate_answer(fallback_prompt, callbacks)
+                            break
+                    else:
+                        break # it's very good if it can reach here, so no need for a retry
+                # End of the Retry loop    
 
-            for i in range(NUMBER_OF_RETRIES + 1):
-                print(f"\033[90m...\033[0m", end=' ', flush=True)
-                agent_response = None
-                
-                result = {}
-                try:
-                    result = self._agent_executor.invoke({"user_input": user_input, 
-                                                    "chat_history": self.chat_memory.to_string()})
-                    agent_response = result.get('output')
-                except Exception as e:
-                    result['error'] = f"{e}"
-                    traceback.print_exc()
-
-                if agent_response is not None and "Agent stopped due to iteration limit" in agent_response:
-                    del result['output']
-                    agent_response = None
-                    result['error'] = "Agent stopped due to iteration limit or time limit"
-
-                # if no good result returned from the model, let it retry
-                if result.get('error'):
-                    if i >= NUMBER_OF_RETRIES:
-                        intermediate_steps = result.get('intermediate_steps')
-                        if intermediate_steps:
-                            print(f"\033[90m...\033[0m", end=' ', flush=True)
-                            last_step_response = intermediate_steps[-1][-1] 
-                            agent_response = last_step_response 
-                            # print(f"DEBUG last_step_response:\n{last_step_response}\n")
-                            agent_response = self.granite_llm.invoke("<|start_of_role|>system<|end_of_role|>You are a helpful agent (assistant) assisting the user with troubleshooting technical issues. "
-                                     f"Your task is now to generate a response using the following context or instructions:\n{last_step_response}"
-                                     "<|end_of_text|>\n<|start_of_role|>assistant<|end_of_role|>")
+            agent_response = self._final_response(agent_response, result)
+
+        except Exception as error:
+            agent_response = f"Program error: Something's wrong: {error}"
+            print(f"\n{agent_response}")
+        finally:
+            return agent_response
+
+    async def aquery(self, user_input):
+        """The async version of query: the agent, its tools and the models are awaited instead of blocking a thread"""
+        try:
+            self.chat_memory.add_user_message(user_input)
+
+            with tracing.start_span("tech_support_agent.query"):
+                for i in range(NUMBER_OF_RETRIES + 1):
+                    result = {}
+                    try:
+                        result = await self._agent_executor.ainvoke({"user_input": user_input, 
+                                                        "chat_history": self.chat_memory.to_string()},
+                                                        config={"callbacks": [TracingCallbackHandler()]})
+                    except Exception as e:
+                        result['error'] = f"{e}"
+                        traceback.print_exc()
+                    agent_response = self._agent_response(result)
+
+                    # if no good result returned from the model, let it retry
+                    if result.get('error'):
+                        fallback_prompt = self._fallback_prompt(result) if i >= NUMBER_OF_RETRIES else None
+                        if fallback_prompt:
+                            agent_response = await self.granite_llm.ainvoke(fallback_prompt)
                             break
-                else:
-                    break # it's very good if it can reach here, so no need for a retry
-            # End of the Retry loop    
+                    else:
+                        break
 
-            # after all retries, if still no result:
-            if agent_response:
-                self.chat_memory.add_agent_message(agent_response)
-            else:
-                agent_response = f"Sorry, something was wrong due to an error ({result.get('error')}). Please try entering the input again..."
+            agent_response = self._final_response(agent_response, result)
 
         except Exception as error:
             agent_response = f"Program error: Something's wrong: {error}"
@@ -257,6 +388,45 @@ class TechSupportAgent():
         finally:
             return agent_response
 
+    def query_stream(self, user_input) -> Iterator[str]:
+        """Like query, but yield the chunks of the response as they are generated: the final answer of the ReAct agent,
+        or the response of the diagnosis tool (a cached response comes as one chunk). A response which isn't generated
+        (e.g. an escalation or an error message), or which differs from what was streamed, is yielded at the end.
+        The timings are then in last_stream_stats"""
+        tokens = queue.Queue()
+        result = {}
+
+        def run_query():
+            try:
+                result["response"] = self.query(user_input, token_sink=tokens.put)
+            finally:
+                tokens.put(None) # the end of the stream
+
+        started_at = time.perf_counter()
+        first_chunk_at = None
+        streamed_chunks = []
+        threading.Thread(target=run_query, daemon=True).start()
+        while (token := tokens.get()) is not None:
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+            streamed_chunks.append(token)
+            yield token
+
+        # e.g. the agent streamed a final answer, then failed and answered with its fallback instead
+        streamed = "".join(streamed_chunks).strip()
+        response = (result.get("response") or "").strip()
+        if response != streamed:
+            first_chunk_at = first_chunk_at or time.perf_counter()
+            if streamed and response.startswith(streamed):
+                yield response[len(streamed):]
+            else:
+                yield f"\n\n{response}" if streamed else response
+
+        self.last_stream_stats = {
+            "time_to_first_token": (first_chunk_at or time.perf_counter()) - started_at,
+            "total_time": time.perf_counter() - started_at
+        }
+
     def clear_memory(self):
         self.chat_memory = ChatMemory()
 
@@ -269,7 +439,22 @@ def agent_streaming_print(text: str, delay=0.005):
         time.sleep(delay)
     print(f"")  
 
+def agent_stream_print(chunks: Iterable[str]):
+    """Print the chunks of a response as they arrive from the model"""
+    is_first_chunk = True
+    for chunk in chunks:
+        if is_first_chunk:
+            print(" " * 100, end='\r') # clear the "Please wait" line
+            print("Agent:", end=' ', flush=True)
+            is_first_chunk = False
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    print(f"")
+
 if __name__ == "__main__":
+    from prompt_toolkit import prompt
+    from prompt_toolkit.styles import Style
+
     support_agent = TechSupportAgent.get_instance()
 
     is_requested_to_stop = False
@@ -303,9 +488,9 @@ if __name__ == "__main__":
                 continue
 
             print(f"\nAgent: \033[90mPlease wait\033[0m", end=' ', flush=True)
-            agent_response = support_agent.query(user_input)
-            print(" " * 100, end='\r')
-            agent_streaming_print(agent_response)
+            agent_stream_print(support_agent.query_stream(user_input))
+            print(f"\033[90m(Time to first token: {support_agent.last_stream_stats['time_to_first_token']:.2f}s, "
+                  f"total: {support_agent.last_stream_stats['total_time']:.2f}s)\033[0m")
 
         except Exception as error: # any error else, stop the program
             print(f"Something's wrong: {error}")
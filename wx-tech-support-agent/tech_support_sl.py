@@ -57,11 +57,10 @@ if __name__ == "__main__":
         st.chat_message("user", avatar=user_avatar).write(user_input)
         print(f"\nUser: {user_input}")
         
-        with st.spinner("..."): 
-            print(f"\nAgent: \033[90mPlease wait\033[0m", end=' ', flush=True)
-            response = support_agent.query(user_input)
-            print(" " * 100, end='\r')
-            print(f"Agent: {response}")
+        print(f"\nAgent: \033[90mPlease wait\033[0m", end=' ', flush=True)
+        # the response is shown as it is generated
+        response = st.chat_message("assistant", avatar=agent_avatar).write_stream(support_agent.query_stream(user_input))
+        print(" " * 100, end='\r')
+        print(f"Agent: {response}")
 
-        st.session_state.messages.append({"role": "assistant", "content": response})
-        st.chat_message("assistant", avatar=agent_avatar).write(response)
\ No newline at end of file
+        st.session_state.messages.append({"role": "assistant", "content": response})
\ No newline at end of file
@@ -0,0 +1,223 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# A load and latency benchmark for the embedding API.
+#
+# It sweeps concurrency levels and text-length distributions taken from the TechQA notes, against
+# the single-text path (/vectors) and the batch path (/vectors/batch), and reports the throughput,
+# the p50/p95/p99 latencies and the error rate. Results are written to a JSON file, which can be
+# compared with the results of a previous run to catch regressions.
+#
+# To measure our own overhead without watsonx, start the API with an offline backend, e.g.:
+#   $ EMBEDDING_BACKEND=hashing LOCAL_EMBEDDING_LATENCY_MS=50 EMBEDDING_CACHE_ENABLED=false python weavite_text2vec_watsonx_api.py
+#   $ python benchmark.py --notes techqa_technote_faq_samples.json --output results.json
+#   $ python benchmark.py --notes techqa_technote_faq_samples.json --output results_new.json --baseline results.json
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+import requests
+
+DEFAULT_API_URL = "http://localhost:5000"
+
+def load_texts(notes_filepath: str | None, limit=2000) -> dict[str, list[str]]:
+    """Return the texts of each length distribution: 'title' (short), 'text' (a whole note) and 'mixed'"""
+    titles, texts = [], []
+    if notes_filepath:
+        import ijson
+        with open(notes_filepath, "rb") as f:
+            for _, note in itertools.islice(ijson.kvitems(f, ""), limit):
+                if note.get("title"):
+                    titles.append(note["title"])
+                if note.get("text"):
+                    texts.append(note["text"])
+    else:
+        # no notes at hand: synthesize texts with about the same lengths as TechQA titles and technotes
+        rng = random.Random(42)
+        words = ["websphere", "mq", "channel", "db2", "error", "install", "server", "queue", "manager", "fix",
+                 "pack", "upgrade", "license", "java", "memory", "log", "cluster", "node", "timeout", "security"]
+        titles = [" ".join(rng.choices(words, k=rng.randint(5, 15))) for _ in range(limit)]
+        texts = [" ".join(rng.choices(words, k=int(rng.lognormvariate(5.5, 0.8)))) for _ in range(limit)]
+
+    return {"title": titles, "text": texts, "mixed": titles + texts}
+
+def percentile(sorted_values: list[float], percent: float) -> float | None:
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(percent / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class BenchmarkRunner:
+    def __init__(self, api_url: str, batch_size: int, bust_cache: bool, timeout: float):
+        self._api_url = api_url.rstrip("/")
+        self._batch_size = batch_size
+        self._bust_cache = bust_cache
+        self._timeout = timeout
+        self._thread_local = threading.local()
+
+    def _session(self) -> requests.Session:
+        # one keep-alive session per worker thread
+        if not hasattr(self._thread_local, "session"):
+            self._thread_local.session = requests.Session()
+        return self._thread_local.session
+
+    def _prepare(self, text: str) -> str:
+        # a unique suffix defeats the embedding cache of the API, so that each request goes upstream
+        return f"{text} {uuid.uuid4().hex}" if self._bust_cache else text
+
+    def wait_until_ready(self, attempts=15, interval=2.0) -> bool:
+        for _ in range(attempts):
+            try:
+                if requests.get(f"{self._api_url}/.well-known/ready", timeout=self._timeout).status_code == 204:
+                    return True
+            except requests.RequestException:
+                pass
+            time.sleep(interval)
+        return False
+
+    def _single_request(self, text: str) -> tuple[float, bool, int]:
+        start = time.perf_counter()
+        try:
+            response = self._session().post(f"{self._api_url}/vectors", json={"text": self._prepare(text)},
+                                            timeout=self._timeout)
+            ok = response.status_code == 200 and len(response.json()["vector"]) > 0
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok, 1
+
+    def _batch_request(self, texts: list[str]) -> tuple[float, bool, int]:
+        start = time.perf_counter()
+        try:
+            response = self._session().post(f"{self._api_url}/vectors/batch",
+                                            json={"texts": [self._prepare(text) for text in texts]},
+                                            timeout=self._timeout)
+            ok = response.status_code == 200 and response.json()["count"] == len(texts)
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok, len(texts)
+
+    def run_level(self, mode: str, texts: list[str], concurrency: int, num_requests: int) -> dict:
+        rng = random.Random(concurrency)
+        if mode == "single":
+            jobs = [(self._single_request, rng.choice(texts)) for _ in range(num_requests)]
+        else:
+            jobs = [(self._batch_request, rng.choices(texts, k=self._batch_size)) for _ in range(num_requests)]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda job: job[0](job[1]), jobs))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for latency, ok, _ in results if ok)
+        errors = sum(1 for _, ok, _ in results if not ok)
+        texts_embedded = sum(count for _, ok, count in results if ok)
+        return {
+            "requests": num_requests,
+            "errors": errors,
+            "error_rate": errors / num_requests if num_requests else 0.0,
+            "elapsed_seconds": elapsed,
+            "requests_per_second": (num_requests - errors) / elapsed if elapsed else 0.0,
+            "texts_per_second": texts_embedded / elapsed if elapsed else 0.0,
+            "latency_ms": {
+                "p50": _to_ms(percentile(latencies, 50)),
+                "p95": _to_ms(percentile(latencies, 95)),
+                "p99": _to_ms(percentile(latencies, 99)),
+                "mean": _to_ms(sum(latencies) / len(latencies)) if latencies else None
+            }
+        }
+
+def _to_ms(seconds: float | None) -> float | None:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+def compare_with_baseline(results: list[dict], baseline_results: list[dict], max_regression: float) -> list[str]:
+    """Return a description of each scenario whose throughput dropped, or whose p95 latency grew, by more than max_regression"""
+    def scenario_key(result):
+        return (result["mode"], result["distribution"], result["concurrency"])
+
+    baseline_by_key = {scenario_key(result): result for result in baseline_results}
+    regressions = []
+    for result in results:
+        baseline = baseline_by_key.get(scenario_key(result))
+        if not baseline:
+            continue
+
+        old_throughput, new_throughput = baseline["texts_per_second"], result["texts_per_second"]
+        if old_throughput and new_throughput < old_throughput * (1 - max_regression):
+            regressions.append(f"{scenario_key(result)}: throughput {old_throughput:.1f} -> {new_throughput:.1f} texts/s")
+
+        old_p95, new_p95 = baseline["latency_ms"]["p95"], result["latency_ms"]["p95"]
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + max_regression):
+            regressions.append(f"{scenario_key(result)}: p95 latency {old_p95:.1f} -> {new_p95:.1f} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the embedding API")
+    parser.add_argument("--url", default=DEFAULT_API_URL)
+    parser.add_argument("--notes", help="a TechQA technote JSON file to take the texts from (synthetic texts if omitted)")
+    parser.add_argument("--modes", default="single,batch", help="single and/or batch")
+    parser.add_argument("--distributions", default="title,text,mixed")
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--requests", type=int, default=200, help="the number of requests per scenario")
+    parser.add_argument("--batch-size", type=int, default=32, help="the number of texts per batch request")
+    parser.add_argument("--bust-cache", action="store_true", help="make every text unique so that the API cache never hits")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="the results of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="the tolerated regression ratio when comparing")
+    args = parser.parse_args()
+
+    runner = BenchmarkRunner(args.url, args.batch_size, args.bust_cache, args.timeout)
+    print(f"Waiting for the API {args.url} to be ready...")
+    if not runner.wait_until_ready():
+        print("The API is not ready")
+        sys.exit(1)
+
+    texts_by_distribution = load_texts(args.notes)
+    results = []
+    for mode in args.modes.split(","):
+        for distribution in args.distributions.split(","):
+            texts = texts_by_distribution[distribution]
+            for concurrency in [int(level) for level in args.concurrency.split(",")]:
+                result = {"mode": mode, "distribution": distribution, "concurrency": concurrency,
+                          **runner.run_level(mode, texts, concurrency, args.requests)}
+                results.append(result)
+                print(f"{mode:>6} {distribution:>6} c={concurrency:<4} "
+                      f"{result['texts_per_second']:9.1f} texts/s  "
+                      f"p50={result['latency_ms']['p50']}ms p95={result['latency_ms']['p95']}ms p99={result['latency_ms']['p99']}ms  "
+                      f"errors={result['error_rate']:.1%}")
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "url": args.url,
+        "settings": {"requests": args.requests, "batch_size": args.batch_size, "bust_cache": args.bust_cache,
+                     "notes": args.notes},
+        "results": results
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file)["results"], args.max_regression)
+        if regressions:
+            print(f"\nRegressions compared with {args.baseline}:")
+            for regression in regressions:
+                print(f"- {regression}")
+            sys.exit(2)
+        print(f"\nNo regression compared with {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Semaphore, Thread
+import queue
+import time
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text embedding requests into batched upstream calls.
+
+    Each caller of embed() is parked on a Future. A single collector thread takes the first queued text,
+    keeps collecting texts until either max_batch_size texts are queued or max_wait_ms has passed,
+    and hands the batch to a pool of num_workers threads which send it to the embedding model
+    as one embed_documents() call. Each vector is routed back to the Future of the caller who asked for it."""
+
+    _STOP = object() # a sentinel to stop the collector thread
+
+    def __init__(self, embedding_model, max_batch_size=32, max_wait_ms=10, num_workers=4):
+        self._embedding_model = embedding_model
+        self._max_batch_size = max(1, max_batch_size)
+        self._max_wait = max(0, max_wait_ms) / 1000
+        self._queue: queue.Queue = queue.Queue()
+
+        # While batches are waiting for watsonx, the next one is being collected. When all the workers are busy,
+        # the collector waits for one of them before collecting, so the texts queued meanwhile make a fuller batch
+        num_workers = max(1, num_workers)
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="embedding-batcher")
+        self._free_workers = Semaphore(num_workers)
+        self._collector = Thread(target=self._run, name="embedding-batcher-collector", daemon=True)
+        self._collector.start()
+
+    def embed(self, text: str, timeout=None) -> list[float]:
+        """Queue a text and block until its vector is available"""
+        future = Future()
+        self._queue.put((text, future))
+        return future.result(timeout=timeout)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self):
+        self._queue.put(self._STOP)
+        self._collector.join()
+        self._executor.shutdown(wait=False)
+
+    def _collect_batch(self, first_item) -> tuple[list, bool]:
+        """Return the batch, and whether the collector is to stop after it"""
+        batch = [first_item]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is self._STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            self._free_workers.acquire()
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+
+            batch, stopping = self._collect_batch(item)
+            self._executor.submit(self._embed_batch, batch)
+            if stopping:
+                break
+
+    def _embed_batch(self, batch: list):
+        try:
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self._embedding_model.embed_documents(texts)
+                if len(embeddings) != len(texts):
+                    raise Exception(f"Expected {len(texts)} embeddings from the model, got {len(embeddings)}")
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                return
+
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+        finally:
+            self._free_workers.release()
@@ -0,0 +1,212 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+from collections import OrderedDict
+from threading import Lock
+from array import array
+import hashlib
+import sqlite3
+import sys
+import time
+import os
+
+class EmbeddingCache:
+    """A two-tier, content-addressed cache for embeddings.
+
+    Entries are keyed by (model_id, truncate_input_tokens, sha256(text)), so the same text embedded
+    with another model or another truncation setting is a different entry.
+    - Tier 1 is an in-process LRU dictionary.
+    - Tier 2 is a SQLite file that survives restarts. Vectors are stored as float32 blobs,
+      and the least recently used rows are evicted when the file grows over max_disk_bytes.
+      The access times of the disk hits are written in batches, not on every hit.
+    Set db_path to None to only use the in-memory tier."""
+
+    ACCESS_FLUSH_SIZE = 256 # the access times of the disk hits are written once this many are pending
+
+    def __init__(self, db_path=None, max_memory_entries=10000, max_disk_bytes=512 * 1024 * 1024):
+        self._lock = Lock()
+        self._memory: OrderedDict[tuple, list[float]] = OrderedDict()
+        self._max_memory_entries = max_memory_entries
+        self._max_disk_bytes = max_disk_bytes
+        self._disk_bytes = 0
+        self._pending_accesses: dict[tuple, float] = {} # key -> last access time, not written yet
+
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        self._db = None
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+
+            # the connection is shared by the API threads, guarded by self._lock
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                                    model_id TEXT NOT NULL,
+                                    truncate_input_tokens INTEGER NOT NULL,
+                                    text_sha256 TEXT NOT NULL,
+                                    vector BLOB NOT NULL,
+                                    last_access REAL NOT NULL,
+                                    PRIMARY KEY (model_id, truncate_input_tokens, text_sha256))""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+            self._db.commit()
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def _key(model_id: str, truncate_input_tokens: int, text: str) -> tuple:
+        return (model_id, truncate_input_tokens, hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def _to_blob(vector: list[float]) -> bytes:
+        values = array("f", vector)
+        if sys.byteorder != "little": # always store little-endian float32
+            values.byteswap()
+        return values.tobytes()
+
+    @staticmethod
+    def _from_blob(blob: bytes) -> list[float]:
+        values = array("f")
+        values.frombytes(blob)
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values.tolist()
+
+    def _remember(self, key: tuple, vector: list[float]):
+        """Add to the in-memory tier. The caller must hold the lock"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_from_memory(self, model_id: str, truncate_input_tokens: int, text: str) -> list[float] | None:
+        """Look up the in-memory tier only, which never touches the disk (e.g. on an event loop).
+        A miss isn't counted, as the caller goes on with get()"""
+        key = self._key(model_id, truncate_input_tokens, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+            return vector
+
+    def get(self, model_id: str, truncate_input_tokens: int, text: str) -> list[float] | None:
+        key = self._key(model_id, truncate_input_tokens, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+                return vector
+
+            if self._db:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE model_id=? AND truncate_input_tokens=? AND text_sha256=?",
+                                       key).fetchone()
+                if row:
+                    self._pending_accesses[key] = time.time()
+                    if len(self._pending_accesses) >= self.ACCESS_FLUSH_SIZE:
+                        self._flush_accesses()
+                        self._db.commit()
+                    vector = self._from_blob(row[0])
+                    self._remember(key, vector)
+                    self._disk_hits += 1
+                    return vector
+
+            self._misses += 1
+            return None
+
+    def _flush_accesses(self):
+        """Write the pending access times of the disk hits. The caller must hold the lock, and commit"""
+        if self._pending_accesses:
+            self._db.executemany("UPDATE embeddings SET last_access=? WHERE model_id=? AND truncate_input_tokens=? AND text_sha256=?",
+                                 [(access_time,) + key for key, access_time in self._pending_accesses.items()])
+            self._pending_accesses.clear()
+
+    def put(self, model_id: str, truncate_input_tokens: int, text: str, vector: list[float]):
+        if not vector:
+            return
+
+        key = self._key(model_id, truncate_input_tokens, text)
+        with self._lock:
+            self._remember(key, vector)
+
+            if self._db:
+                blob = self._to_blob(vector)
+                previous = self._db.execute("SELECT LENGTH(vector) FROM embeddings WHERE model_id=? AND truncate_input_tokens=? AND text_sha256=?",
+                                            key).fetchone()
+                self._db.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", key + (blob, time.time()))
+                self._disk_bytes += len(blob) - (previous[0] if previous else 0)
+                self._flush_accesses() # before evicting, not to evict rows which were just read
+                self._evict_from_disk()
+                self._db.commit()
+
+    def _evict_from_disk(self):
+        """Drop the least recently used rows until the store is back under 90% of its size limit.
+        The caller must hold the lock"""
+        if self._disk_bytes <= self._max_disk_bytes:
+            return
+
+        target_bytes = int(self._max_disk_bytes * 0.9)
+        while self._disk_bytes > target_bytes:
+            rows = self._db.execute("SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_access LIMIT 500").fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+
+            evicted_rows = []
+            for rowid, size in rows:
+                evicted_rows.append((rowid,))
+                self._disk_bytes -= size
+                if self._disk_bytes <= target_bytes:
+                    break
+            self._db.executemany("DELETE FROM embeddings WHERE rowid=?", evicted_rows)
+            self._evictions += len(evicted_rows)
+
+    def invalidate(self, model_id: str | None = None) -> int:
+        """Remove all entries of a model (or everything if model_id is None). Return the number of rows removed from disk"""
+        with self._lock:
+            if model_id is None:
+                self._memory.clear()
+            else:
+                for key in [key for key in self._memory if key[0] == model_id]:
+                    del self._memory[key]
+
+            removed = 0
+            if self._db:
+                self._pending_accesses.clear()
+                if model_id is None:
+                    removed = self._db.execute("DELETE FROM embeddings").rowcount
+                else:
+                    removed = self._db.execute("DELETE FROM embeddings WHERE model_id=?", (model_id,)).rowcount
+                self._db.commit()
+                self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+            return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._memory_hits + self._disk_hits + self._misses
+            return {
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_ratio": (self._memory_hits + self._disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+                "evictions": self._evictions
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db:
+                self._flush_accesses()
+                self._db.commit()
+                self._db.close()
+                self._db = None
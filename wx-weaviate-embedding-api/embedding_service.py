@@ -0,0 +1,195 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+from watsonx_client import WatsonxClient
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from single_flight import SingleFlight, normalize_text
+import service_metrics as Metrics
+from functools import cached_property
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_MODEL_ID = os.getenv("EMBEDDING_MODEL_ID", "ibm/slate-30m-english-rtrvr")
+EMBEDDING_TRUNCATE_INPUT_TOKENS = int(os.getenv("EMBEDDING_TRUNCATE_INPUT_TOKENS", "512"))
+
+# Concurrent /vectors calls are held for up to EMBEDDING_BATCH_MAX_WAIT_MS (or until EMBEDDING_BATCH_MAX_SIZE texts
+# are queued) and sent to watsonx as one batch. Set EMBEDDING_BATCH_MAX_SIZE=1 to send each text on its own
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+EMBEDDING_BATCH_MAX_WAIT_MS = int(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "10"))
+EMBEDDING_BATCH_WORKERS = int(os.getenv("EMBEDDING_BATCH_WORKERS", "4"))
+
+# Embeddings are cached in memory, and also in a SQLite file when EMBEDDING_CACHE_PATH is set (an absolute path,
+# e.g. /var/cache/wx-embeddings/embeddings.sqlite3), so re-importing the same texts after a restart doesn't re-embed them.
+# Set EMBEDDING_CACHE_ENABLED=false to disable the cache
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "10000"))
+EMBEDDING_CACHE_MAX_DISK_MB = int(os.getenv("EMBEDDING_CACHE_MAX_DISK_MB", "512"))
+
+# With EMBEDDING_POOLING set to "mean" or "max", texts longer than EMBEDDING_TRUNCATE_INPUT_TOKENS are split
+# into overlapping windows (cut with the tokenizer named by EMBEDDING_TOKENIZER), embedded in one call and pooled,
+# instead of being truncated by watsonx
+EMBEDDING_POOLING = os.getenv("EMBEDDING_POOLING", "")
+EMBEDDING_CHUNK_OVERLAP_TOKENS = int(os.getenv("EMBEDDING_CHUNK_OVERLAP_TOKENS", "64"))
+EMBEDDING_TOKENIZER = os.getenv("EMBEDDING_TOKENIZER")
+
+# The precision of the vectors in JSON/msgpack responses when a request doesn't ask for one: float32, float16 or int8.
+# Keep float32 when Weaviate consumes the API, as its text2vec-transformers module expects float vectors
+EMBEDDING_OUTPUT_PRECISION = os.getenv("EMBEDDING_OUTPUT_PRECISION", "float32")
+
+class EmbeddingService:
+    """The embedding path shared by the Flask and the ASGI flavors of the API:
+    cache lookup -> (batched) upstream call -> cache update"""
+
+    def __init__(self, model_id=EMBEDDING_MODEL_ID, truncate_input_tokens=EMBEDDING_TRUNCATE_INPUT_TOKENS,
+                 cache: EmbeddingCache | None = None):
+        self.model_id = model_id
+        self.truncate_input_tokens = truncate_input_tokens
+        self.cache = cache
+        self.embedding_model = None
+        self.batcher: EmbeddingBatcher | None = None
+
+        # identical texts arriving at the same time share one upstream call
+        self._single_flight = SingleFlight()
+        Metrics.SINGLE_FLIGHT_IN_FLIGHT.set_function(self._single_flight.in_flight)
+
+    @cached_property
+    def cache_model_id(self) -> str:
+        # local_embeddings (and so LangChain) is only imported on first use, to keep the startup of the API quick
+        from local_embeddings import get_embedding_backend
+
+        # vectors of an offline backend must never be mixed up with the ones from watsonx in the cache
+        backend = get_embedding_backend()
+        cache_model_id = self.model_id if backend == "watsonx" else f"{backend}:{self.model_id}"
+        if EMBEDDING_POOLING:
+            # pooled vectors of long texts differ from truncated ones
+            cache_model_id += f"+{EMBEDDING_POOLING}-pooling"
+        return cache_model_id
+
+    @staticmethod
+    def from_env():
+        cache = None
+        if EMBEDDING_CACHE_ENABLED:
+            # a relative path would depend on the directory the server is started from
+            db_path = os.path.abspath(EMBEDDING_CACHE_PATH) if EMBEDDING_CACHE_PATH else None
+            print("The embedding cache is in memory" + (f" and in {db_path}" if db_path else " only"))
+            cache = EmbeddingCache(db_path=db_path,
+                                   max_memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES,
+                                   max_disk_bytes=EMBEDDING_CACHE_MAX_DISK_MB * 1024 * 1024)
+        return EmbeddingService(cache=cache)
+
+    def connect(self):
+        """Connect the embedding model. It's meant to be run on a background thread as it may take a while"""
+        print("Connecting the embedding model from WatsonX...")
+        model = WatsonxClient.request_embedding_model(model_id=self.model_id,
+                                                      truncate_input_tokens=self.truncate_input_tokens)
+        if model:
+            model = Metrics.InstrumentedEmbeddings(model)
+            if EMBEDDING_POOLING:
+                from chunked_embeddings import ChunkedEmbeddings
+                from tokenization import load_tokenizer
+                model = ChunkedEmbeddings(model, load_tokenizer(EMBEDDING_TOKENIZER),
+                                          max_tokens=self.truncate_input_tokens,
+                                          overlap_tokens=EMBEDDING_CHUNK_OVERLAP_TOKENS,
+                                          pooling=EMBEDDING_POOLING)
+
+        if model and EMBEDDING_BATCH_MAX_SIZE > 1:
+            self.batcher = EmbeddingBatcher(model,
+                                            max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+                                            max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS,
+                                            num_workers=EMBEDDING_BATCH_WORKERS)
+            Metrics.BATCH_QUEUE_DEPTH.set_function(self.batcher.queue_depth)
+        # set last, so the service doesn't report ready before the batcher is in place
+        self.embedding_model = model
+
+        if self.embedding_model:
+            print("\nConnected the embedding model...")
+        else:
+            print("\nFailed to connect the embedding model...")
+
+    def is_ready(self) -> bool:
+        return self.embedding_model is not None
+
+    def get_cached(self, text: str) -> list[float] | None:
+        if self.cache:
+            embedding = self.cache.get(self.cache_model_id, self.truncate_input_tokens, text)
+            if embedding is None:
+                Metrics.CACHE_MISSES.inc()
+            else:
+                Metrics.CACHE_HITS.inc()
+            return embedding
+        return None
+
+    def get_cached_in_memory(self, text: str) -> list[float] | None:
+        """The in-memory tier of the cache only: a miss is not counted, get_cached() is expected next"""
+        if self.cache:
+            embedding = self.cache.get_from_memory(self.cache_model_id, self.truncate_input_tokens, text)
+            if embedding is not None:
+                Metrics.CACHE_HITS.inc()
+            return embedding
+        return None
+
+    def _single_flight_key(self, text: str) -> tuple:
+        return (self.cache_model_id, self.truncate_input_tokens, normalize_text(text))
+
+    def embed_uncached(self, text: str) -> list[float]:
+        """Query the model (skipping the cache lookup) and store the result in the cache.
+        If the same text is already being embedded, wait for that call instead"""
+        if not self.embedding_model:
+            raise Exception("Sorry, the embedding model is not ready")
+
+        embedding, is_shared = self._single_flight.do(self._single_flight_key(text), self._embed_from_model, text)
+        if is_shared:
+            Metrics.SINGLE_FLIGHT_SHARED.inc()
+        return embedding
+
+    def _embed_from_model(self, text: str) -> list[float]:
+        if self.batcher:
+            embedding = self.batcher.embed(text)
+        else:
+            embedding = self.embedding_model.embed_query(text)
+
+        if self.cache:
+            self.cache.put(self.cache_model_id, self.truncate_input_tokens, text, embedding)
+        return embedding
+
+    def embed(self, text: str) -> list[float]:
+        Metrics.INPUT_TEXT_LENGTH.observe(len(text))
+        embedding = self.get_cached(text)
+        if embedding is None:
+            embedding = self.embed_uncached(text)
+        return embedding
+
+    def embed_many(self, texts: list[str]) -> list[list[float]]:
+        """Embed a batch of texts. Cache misses are sent to the model in a single call"""
+        for text in texts:
+            Metrics.INPUT_TEXT_LENGTH.observe(len(text))
+
+        embeddings = [self.get_cached(text) for text in texts]
+        missing_indexes = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not missing_indexes:
+            return embeddings
+
+        if not self.embedding_model:
+            raise Exception("Sorry, the embedding model is not ready")
+
+        # texts repeated in the batch are only sent once
+        indexes_by_key: dict[tuple, list[int]] = {}
+        for i in missing_indexes:
+            indexes_by_key.setdefault(self._single_flight_key(texts[i]), []).append(i)
+        unique_indexes = [indexes[0] for indexes in indexes_by_key.values()]
+
+        unique_embeddings = self.embedding_model.embed_documents([texts[i] for i in unique_indexes])
+        for indexes, embedding in zip(indexes_by_key.values(), unique_embeddings):
+            for i in indexes:
+                embeddings[i] = embedding
+            if self.cache:
+                self.cache.put(self.cache_model_id, self.truncate_input_tokens, texts[indexes[0]], embedding)
+        return embeddings
@@ -0,0 +1,122 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# Measures what the reduced-precision output modes cost in retrieval quality.
+#
+# The TechQA titles are used as queries and the technote texts as documents. Both are embedded once
+# through the API in float32, then the float16 and the int8 (dequantized) versions are derived with
+# the same code the API uses. For each precision, the top-k documents of each query (cosine similarity)
+# are compared with the float32 top-k, and the recall@k, the mean absolute error of the vector values
+# and the size of a /vectors/batch response are reported.
+#
+#   $ python weavite_text2vec_watsonx_api.py
+#   $ python quantization_recall.py --notes techqa_technote_faq_samples.json --k 10
+
+import argparse
+import itertools
+import json
+import sys
+import numpy as np
+import requests
+import vector_encoding
+
+DEFAULT_API_URL = "http://localhost:5000"
+
+def load_queries_and_documents(notes_filepath: str, limit: int) -> tuple[list[str], list[str]]:
+    import ijson
+
+    queries, documents = [], []
+    with open(notes_filepath, "rb") as f:
+        for _, note in itertools.islice(ijson.kvitems(f, ""), limit):
+            if note.get("title") and note.get("text"):
+                queries.append(note["title"])
+                documents.append(note["text"])
+    return queries, documents
+
+def embed(api_url: str, texts: list[str], batch_size: int, timeout: float) -> np.ndarray:
+    vectors = []
+    with requests.Session() as session:
+        for start in range(0, len(texts), batch_size):
+            response = session.post(f"{api_url}/vectors/batch",
+                                    json={"texts": texts[start:start + batch_size], "precision": "float32"},
+                                    timeout=timeout)
+            response.raise_for_status()
+            vectors.extend(response.json()["vectors"])
+    return np.asarray(vectors, dtype=np.float32)
+
+def with_precision(vectors: np.ndarray, precision: str) -> np.ndarray:
+    """Return the vectors as a client of the API would restore them from a response of the given precision"""
+    if precision == "float16":
+        return vectors.astype(np.float16).astype(np.float32)
+    elif precision == "int8":
+        return vector_encoding.dequantize_int8(*vector_encoding.quantize_int8(vectors))
+    return vectors
+
+def top_k(queries: np.ndarray, documents: np.ndarray, k: int) -> np.ndarray:
+    queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    documents = documents / np.maximum(np.linalg.norm(documents, axis=1, keepdims=True), 1e-12)
+    return np.argsort(-(queries @ documents.T), axis=1)[:, :k]
+
+def recall_at_k(reference: np.ndarray, candidate: np.ndarray) -> float:
+    k = reference.shape[1]
+    return float(np.mean([len(set(ref) & set(cand)) / k for ref, cand in zip(reference, candidate)]))
+
+def response_size(vectors: np.ndarray, precision: str, media_type: str) -> int:
+    texts = [""] * len(vectors)
+    body, _ = vector_encoding.encode_vectors(texts, vectors.tolist(), media_type, precision)
+    return len(body)
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall of the reduced-precision output modes of the embedding API")
+    parser.add_argument("--url", default=DEFAULT_API_URL, help="the base URL of the API")
+    parser.add_argument("--notes", required=True, help="a TechQA technotes JSON file, e.g. techqa_technote_faq_samples.json")
+    parser.add_argument("--limit", type=int, default=1000, help="the maximum number of notes to use")
+    parser.add_argument("--k", type=int, default=10, help="the number of nearest documents to compare")
+    parser.add_argument("--batch-size", type=int, default=32, help="the number of texts per /vectors/batch request")
+    parser.add_argument("--timeout", type=float, default=120.0, help="the timeout of a request, in seconds")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    queries, documents = load_queries_and_documents(args.notes, args.limit)
+    if len(documents) <= args.k:
+        print(f"Not enough notes ({len(documents)}) for k={args.k}")
+        sys.exit(1)
+
+    print(f"Embedding {len(queries)} queries and {len(documents)} documents...")
+    query_vectors = embed(args.url, queries, args.batch_size, args.timeout)
+    document_vectors = embed(args.url, documents, args.batch_size, args.timeout)
+    reference = top_k(query_vectors, document_vectors, args.k)
+
+    results = []
+    for precision in vector_encoding.PRECISIONS:
+        restored_queries = with_precision(query_vectors, precision)
+        restored_documents = with_precision(document_vectors, precision)
+        results.append({
+            "precision": precision,
+            f"recall_at_{args.k}": recall_at_k(reference, top_k(restored_queries, restored_documents, args.k)),
+            "mean_absolute_error": float(np.mean(np.abs(restored_documents - document_vectors))),
+            "json_bytes": response_size(document_vectors, precision, vector_encoding.JSON),
+            "msgpack_bytes": response_size(document_vectors, precision, vector_encoding.MSGPACK)
+        })
+
+    raw_sizes = {media_type: response_size(document_vectors, "float32", media_type)
+                 for media_type in (vector_encoding.FLOAT32, vector_encoding.FLOAT16, vector_encoding.INT8)}
+
+    print(f"\n{'precision':<10} {'recall@' + str(args.k):>10} {'MAE':>10} {'JSON bytes':>12} {'msgpack bytes':>14}")
+    for result in results:
+        print(f"{result['precision']:<10} {result[f'recall_at_{args.k}']:>10.4f} {result['mean_absolute_error']:>10.2e} "
+              f"{result['json_bytes']:>12} {result['msgpack_bytes']:>14}")
+    print("\nRaw encodings: " + ", ".join(f"{media_type}: {size} bytes" for media_type, size in raw_sizes.items()))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"k": args.k, "queries": len(queries), "documents": len(documents),
+                       "results": results, "raw_bytes": raw_sizes}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
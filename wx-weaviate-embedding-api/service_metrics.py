@@ -0,0 +1,68 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# Prometheus metrics of the embedding API, exposed on /metrics.
+# With them, a slow vectorization can be attributed to watsonx (upstream latency, in-flight calls),
+# to this process (queue depths, request latency minus upstream latency) or to the import client (request rate).
+
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+import time
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+UPSTREAM_EMBED_LATENCY = Histogram("embedding_upstream_latency_seconds",
+                                   "Latency of the calls to the embedding model", ["call"],
+                                   buckets=_LATENCY_BUCKETS)
+UPSTREAM_BATCH_SIZE = Histogram("embedding_upstream_batch_size",
+                                "Number of texts per call to the embedding model",
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1000))
+UPSTREAM_IN_FLIGHT = Gauge("embedding_upstream_in_flight", "Calls to the embedding model in progress")
+
+REQUEST_LATENCY = Histogram("embedding_request_latency_seconds",
+                            "End-to-end latency of the API requests", ["endpoint"],
+                            buckets=_LATENCY_BUCKETS)
+REQUESTS = Counter("embedding_requests_total", "API requests", ["endpoint", "status"])
+ERRORS = Counter("embedding_errors_total", "API requests failed with an error", ["endpoint"])
+INPUT_TEXT_LENGTH = Histogram("embedding_input_text_length_chars", "Length of the texts to embed, in characters",
+                              buckets=(16, 64, 256, 1024, 2048, 4096, 8192, 16384, 65536))
+
+CACHE_HITS = Counter("embedding_cache_hits_total", "Embedding cache hits")
+CACHE_MISSES = Counter("embedding_cache_misses_total", "Embedding cache misses")
+
+SINGLE_FLIGHT_SHARED = Counter("embedding_single_flight_shared_total",
+                               "Requests served by an identical upstream call already in flight")
+SINGLE_FLIGHT_IN_FLIGHT = Gauge("embedding_single_flight_in_flight", "Distinct texts being embedded")
+
+BATCH_QUEUE_DEPTH = Gauge("embedding_batch_queue_depth", "Texts waiting to be batched")
+ADMISSION_QUEUE_DEPTH = Gauge("embedding_admission_queue_depth", "Requests waiting for an embedding slot (ASGI mode)")
+
+class InstrumentedEmbeddings:
+    """Wraps an embedding model to record the latency, the batch size and the number of in-flight upstream calls"""
+    def __init__(self, embedding_model):
+        self._embedding_model = embedding_model
+
+    def __getattr__(self, name):
+        return getattr(self._embedding_model, name)
+
+    def embed_query(self, text: str) -> list[float]:
+        UPSTREAM_BATCH_SIZE.observe(1)
+        with UPSTREAM_IN_FLIGHT.track_inprogress(), UPSTREAM_EMBED_LATENCY.labels("embed_query").time():
+            return self._embedding_model.embed_query(text)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        UPSTREAM_BATCH_SIZE.observe(len(texts))
+        with UPSTREAM_IN_FLIGHT.track_inprogress(), UPSTREAM_EMBED_LATENCY.labels("embed_documents").time():
+            return self._embedding_model.embed_documents(texts)
+
+def observe_request(endpoint: str, status: int, started_at: float):
+    """Record a finished request. started_at is a time.perf_counter() value"""
+    REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - started_at)
+    REQUESTS.labels(endpoint, str(status)).inc()
+
+def latest_metrics() -> tuple[bytes, str]:
+    """Return the metrics in the Prometheus text format, and its content type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
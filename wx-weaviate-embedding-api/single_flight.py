@@ -0,0 +1,55 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+from concurrent.futures import Future
+from threading import Lock
+from typing import Callable, Hashable
+import re
+import unicodedata
+
+_WHITESPACES = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """Normalize a text for de-duplication purposes: Unicode NFC and collapsed whitespaces.
+    The embedding models tokenize on whitespaces, so both forms of a text get the same vector"""
+    return _WHITESPACES.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+class SingleFlight:
+    """Runs at most one call per key at a time. Callers asking for a key which is already in flight
+    wait for the result of that call instead of starting their own"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable, *args) -> tuple[object, bool]:
+        """Return the result of fn(*args), and whether it was shared with a call already in flight"""
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not is_leader:
+            return future.result(), True
+
+        try:
+            result = fn(*args)
+            future.set_result(result)
+            return result, False
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            # later callers start a new call (by then, the result is usually in the cache)
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -10,9 +10,16 @@ import requests
 import time
 import signal
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 class TestText2VecWatsonx(unittest.TestCase):
     EMBEDDING_API_URL = "http://localhost:5000"
+    # the admission limits of the API when it is served by weavite_text2vec_watsonx_asgi.py
+    ASGI_MAX_IN_FLIGHT = int(os.getenv("ASGI_MAX_IN_FLIGHT", "64"))
+    ASGI_MAX_QUEUED = int(os.getenv("ASGI_MAX_QUEUED", "256"))
+    # the burst test sends no more requests than this, to stay gentle with watsonx
+    MAX_BURST_SIZE = 32
+    is_ready = False
     
     @classmethod
     def setUpClass(cls):
@@ -22,19 +29,40 @@ class TestText2VecWatsonx(unittest.TestCase):
         print('Exited as Ctrl+C pressed')
         os._exit(0)
 
-    def test_weavite_text2vec_watsonx(self):
+    @classmethod
+    def wait_until_ready(cls):
+        if cls.is_ready:
+            return
         print("\nWaiting for the API ready (Ctrl+C to quit if needed)..", end='', flush=True)
         for i in range(15):
             try:
                 print(".", end='', flush=True)
-                response = requests.get(f"{self.EMBEDDING_API_URL}/.well-known/ready")
+                response = requests.get(f"{cls.EMBEDDING_API_URL}/.well-known/ready")
                 if response.status_code == 204:
                     print("\nIt's ready!")
+                    cls.is_ready = True
                     break
                 else:
                     time.sleep(5)
             except:
                 time.sleep(5)
+
+    def test_burst_within_admission_limits(self):
+        # a burst that fits in the in-flight slots and the queue must not be rejected as "too many requests queued"
+        self.wait_until_ready()
+        burst_size = min(self.ASGI_MAX_IN_FLIGHT + self.ASGI_MAX_QUEUED, self.MAX_BURST_SIZE)
+        # new texts, so that the requests aren't served by the embedding cache without taking a slot
+        texts = [f"Burst test {time.time()} #{i}" for i in range(burst_size)]
+
+        VECTOR_API_URL = f"{self.EMBEDDING_API_URL}/vectors"
+        print(f"\nRun Test: sending a burst of {burst_size} requests to {VECTOR_API_URL} ...")
+        with ThreadPoolExecutor(max_workers=burst_size) as executor:
+            status_codes = list(executor.map(lambda text: requests.post(VECTOR_API_URL, json={"text": text}).status_code, texts))
+
+        self.assertNotIn(429, status_codes, f"Status codes of the burst: {status_codes}")
+
+    def test_weavite_text2vec_watsonx(self):
+        self.wait_until_ready()
         
         try:
             input = {"text": "Hello!"}
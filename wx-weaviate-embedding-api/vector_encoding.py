@@ -0,0 +1,170 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# Encodings of /vectors responses, chosen through the Accept header:
+# - application/json (default): {"text": ..., "vector": [...], "dim": ...}, serialized with orjson
+# - application/x-float32 (or application/octet-stream): the raw little-endian float32 values
+# - application/x-float16: the raw little-endian float16 values
+# - application/x-int8: int8 scalar-quantized vectors, each row being a little-endian float32 scale,
+#   a little-endian float32 offset, then the dim int8 values
+# - application/msgpack (or application/x-msgpack): the same fields as JSON, with single-precision floats
+# For the raw formats, the shape is given by the headers X-Vector-Count and X-Vector-Dim,
+# and a batch is laid out row by row.
+#
+# JSON and msgpack responses can also carry reduced-precision vectors (see PRECISIONS):
+# - float16: the values are rounded to float16. With msgpack, each vector is a bin of its raw little-endian float16
+#   values (half the size of the float32 ones), as msgpack has no half-precision floats
+# - int8: the values are quantized to integers q in [-128, 127], and the response has the fields "scale" and "offset"
+#   (lists of them for a batch) to restore them: value ~= (q + 128) * scale + offset
+
+import gzip
+import numpy as np
+import orjson
+import msgpack
+
+JSON = "application/json"
+FLOAT32 = "application/x-float32"
+FLOAT16 = "application/x-float16"
+INT8 = "application/x-int8"
+MSGPACK = "application/msgpack"
+
+_MEDIA_TYPES = {
+    "application/json": JSON,
+    "application/x-float32": FLOAT32,
+    "application/octet-stream": FLOAT32,
+    "application/x-float16": FLOAT16,
+    "application/x-int8": INT8,
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "*/*": JSON,
+    "application/*": JSON
+}
+
+PRECISIONS = ("float32", "float16", "int8")
+
+# Responses smaller than this are not worth compressing
+GZIP_MIN_BYTES = 8 * 1024
+
+def negotiate_media_type(accept_header: str | None) -> str:
+    """Return the supported media type with the highest q-value in the Accept header, JSON if none matches"""
+    if not accept_header:
+        return JSON
+
+    candidates = []
+    for index, item in enumerate(accept_header.split(",")):
+        media_range, *params = [part.strip() for part in item.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0 and media_range.lower() in _MEDIA_TYPES:
+            # on a tie, the type listed first wins
+            candidates.append((-q, index, _MEDIA_TYPES[media_range.lower()]))
+
+    return min(candidates)[2] if candidates else JSON
+
+def resolve_precision(requested: str | None, default: str) -> str:
+    """Return the precision asked for by a request, or the default one. Raise ValueError if it's not supported"""
+    precision = (requested or default or "float32").lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unsupported precision: {precision}. Supported: {', '.join(PRECISIONS)}")
+    return precision
+
+def quantize_int8(vectors) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Scalar-quantize each vector (row) to int8 using its own min/max range.
+    Return the int8 values, and the float32 scale and offset of each row"""
+    values = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    offsets = values.min(axis=1)
+    scales = (values.max(axis=1) - offsets) / 255
+    scales[scales == 0] = 1.0 # a constant vector
+    quantized = np.clip(np.rint((values - offsets[:, None]) / scales[:, None]) - 128, -128, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32), offsets.astype(np.float32)
+
+def dequantize_int8(quantized, scales, offsets) -> np.ndarray:
+    quantized = np.atleast_2d(np.asarray(quantized, dtype=np.float32))
+    return (quantized + 128) * np.asarray(scales, dtype=np.float32)[:, None] + np.asarray(offsets, dtype=np.float32)[:, None]
+
+def _vector_headers(count: int, dim: int) -> dict:
+    return {"X-Vector-Count": str(count), "X-Vector-Dim": str(dim)}
+
+def _raw_body(vectors: list[list[float]], media_type: str) -> bytes:
+    if media_type == INT8:
+        quantized, scales, offsets = quantize_int8(vectors)
+        rows = np.concatenate([scales.astype("<f4")[:, None].view(np.int8),
+                               offsets.astype("<f4")[:, None].view(np.int8),
+                               quantized], axis=1)
+        return rows.tobytes()
+
+    dtype = "<f4" if media_type == FLOAT32 else "<f2"
+    return np.asarray(vectors, dtype=dtype).tobytes()
+
+def _reduced_precision_fields(vectors: list[list[float]], precision: str, media_type: str) -> dict:
+    """Return the "vectors" field (and the quantization parameters if any) of the given precision"""
+    if precision == "float16":
+        halves = np.asarray(vectors, dtype="<f2")
+        if media_type == MSGPACK:
+            # packed as floats, they would take as much room as float32 ones
+            return {"vectors": [row.tobytes() for row in halves], "precision": precision}
+        return {"vectors": halves.astype(np.float32).tolist(), "precision": precision}
+    elif precision == "int8":
+        quantized, scales, offsets = quantize_int8(vectors)
+        return {"vectors": quantized.tolist(), "precision": precision,
+                "scale": scales.tolist(), "offset": offsets.tolist()}
+    return {"vectors": vectors}
+
+def _serialize(response: dict, media_type: str) -> tuple[bytes, dict]:
+    if media_type == MSGPACK:
+        return msgpack.packb(response, use_single_float=True), {"Content-Type": MSGPACK}
+    return orjson.dumps(response), {"Content-Type": JSON}
+
+def encode_vector(text: str, vector: list[float], media_type: str, precision="float32") -> tuple[bytes, dict]:
+    """Encode the response of a single text. Return the body and the response headers.
+    The precision only applies to JSON and msgpack, for the raw formats it's given by the media type"""
+    dim = len(vector) if vector else -1
+
+    if media_type in (FLOAT32, FLOAT16, INT8):
+        return _raw_body([vector], media_type), {"Content-Type": media_type, **_vector_headers(1, dim)}
+
+    fields = _reduced_precision_fields([vector], precision, media_type) if vector else {"vectors": [vector]}
+    response = {
+        "text": text,
+        "vector": fields.pop("vectors")[0],
+        "dim": dim
+    }
+    # a single vector has a single scale and offset
+    response.update({key: value[0] if isinstance(value, list) else value for key, value in fields.items()})
+    return _serialize(response, media_type)
+
+def encode_vectors(texts: list[str], vectors: list[list[float]], media_type: str, precision="float32") -> tuple[bytes, dict]:
+    """Encode the response of a batch of texts. Return the body and the response headers.
+    The precision only applies to JSON and msgpack, for the raw formats it's given by the media type"""
+    dim = len(vectors[0]) if vectors else -1
+
+    if media_type in (FLOAT32, FLOAT16, INT8):
+        body = _raw_body(vectors, media_type) if vectors else b""
+        return body, {"Content-Type": media_type, **_vector_headers(len(vectors), dim)}
+
+    fields = _reduced_precision_fields(vectors, precision, media_type) if vectors else {"vectors": []}
+    response = {
+        "texts": texts,
+        "vectors": fields.pop("vectors"),
+        "dim": dim,
+        "count": len(vectors),
+        **fields
+    }
+    return _serialize(response, media_type)
+
+def maybe_gzip(body: bytes, headers: dict, accept_encoding: str | None) -> tuple[bytes, dict]:
+    """Compress large bodies when the client accepts gzip"""
+    if len(body) < GZIP_MIN_BYTES or not accept_encoding or "gzip" not in accept_encoding.lower():
+        return body, headers
+
+    # level 1 as the vectors don't compress much more at higher levels, while it costs a lot more CPU
+    return gzip.compress(body, compresslevel=1), {**headers, "Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
@@ -6,9 +6,12 @@
 #
 
 import os
+import sys
 from dotenv import load_dotenv
 load_dotenv()
 
+sys.path.append("../common_libs") # not a good pratice but it's ok in this case
+
 class WatsonxClient():
 
     _initialized = False  # Class-level flag to track initialization
@@ -17,11 +20,15 @@ class WatsonxClient():
     def initialize(cls):
         if not cls._initialized:
             # print("Load watsonx Python modules...")
-            global EmbedTextParamsMetaNames, EmbeddingTypes, Embeddings, WatsonxLLM, ModelTypes, GenParams, DecodingMethods
+            global EmbedTextParamsMetaNames, EmbeddingTypes, Embeddings, WatsonxLLM, ModelTypes, GenParams, DecodingMethods, GovernedEmbeddings
+            global get_embedding_backend, request_local_embedding_model, is_standin
             from ibm_watsonx_ai.foundation_models.utils.enums import EmbeddingTypes, ModelTypes, DecodingMethods
             from ibm_watsonx_ai.metanames import EmbedTextParamsMetaNames, GenTextParamsMetaNames as GenParams
             from ibm_watsonx_ai.foundation_models.embeddings import Embeddings
             from langchain_ibm import WatsonxLLM
+            from watsonx import GovernedEmbeddings # the rate/concurrency governor shared with the other watsonx calls
+            from watsonx import is_standin
+            from local_embeddings import get_embedding_backend, request_local_embedding_model
             cls._initialized = True
 
     @staticmethod
@@ -43,29 +50,38 @@ class WatsonxClient():
     @staticmethod
     def _get_project_id():
         return os.getenv("WATSONX_PROJECT_ID")
+
+    @staticmethod
+    @_initialization
+    def _get_credentials():
+        # a local stand-in of watsonx (WATSONX_STANDIN=true, see common_libs/watsonx_standin.py) needs no API key,
+        # accepts any token, and has a self-signed certificate
+        if is_standin():
+            return {"url": WatsonxClient._get_watsonx_url(), "token": "standin", "verify": False}
+        return {"url": WatsonxClient._get_watsonx_url(), "apikey": WatsonxClient._get_cloud_api_key()}
     
     @staticmethod
     @_initialization
     def request_embedding_model(model_id="ibm/slate-30m-english-rtrvr",
                                 truncate_input_tokens=512):
+            # an offline backend (see local_embeddings.py) can be selected for load tests without watsonx
+            if get_embedding_backend() != "watsonx":
+                return request_local_embedding_model()
+
             embed_params = {
                 EmbedTextParamsMetaNames.TRUNCATE_INPUT_TOKENS: truncate_input_tokens,
                 EmbedTextParamsMetaNames.RETURN_OPTIONS: {
                     'input_text': False
                 }
             }
-            cloud_credentials = {
-                "url":  WatsonxClient._get_watsonx_url(),
-                "apikey": WatsonxClient._get_cloud_api_key()
-            }
             embeddings_model = Embeddings(
                 model_id = model_id,
                 project_id = WatsonxClient._get_project_id(),
-                credentials = cloud_credentials,
+                credentials = WatsonxClient._get_credentials(),
                 params=embed_params
             )
 
-            return embeddings_model
+            return GovernedEmbeddings(embeddings_model)
 
     @staticmethod
     @_initialization
@@ -91,9 +107,8 @@ class WatsonxClient():
 
         granite_model = WatsonxLLM(
             model_id = model_id,
-            url = WatsonxClient._get_watsonx_url(),
-            apikey = WatsonxClient._get_cloud_api_key(),
             project_id = WatsonxClient._get_project_id(),
-            params = parameters
+            params = parameters,
+            **WatsonxClient._get_credentials() # url, and apikey or token
         )
         return granite_model    
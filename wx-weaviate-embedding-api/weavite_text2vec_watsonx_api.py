@@ -5,8 +5,12 @@
 # Author: Nguyen, Hung (Howie) Sy
 #
 
-from flask import Flask, request, jsonify
-from watsonx_client import WatsonxClient
+from flask import Flask, Response, request, jsonify, g
+from embedding_service import EmbeddingService, EMBEDDING_OUTPUT_PRECISION
+from watsonx import UpstreamThrottledError
+import service_metrics as Metrics
+import vector_encoding
+import time
 from threading import Thread
 import os
 from dotenv import load_dotenv
@@ -14,13 +18,37 @@ import json
 
 load_dotenv()
 
-embedding_model = None
+embedding_service = EmbeddingService.from_env()
 
 app = Flask(__name__)
 
 # it's to help keep order of sorted dictionary passed to jsonify() function
 app.json.sort_keys = False
 
+@app.before_request
+def start_timer():
+    g.started_at = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # use the route rather than the path to keep the number of label values small
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    Metrics.observe_request(endpoint, response.status_code, g.started_at)
+    if response.status_code >= 500:
+        Metrics.ERRORS.labels(endpoint).inc()
+    return response
+
+def _throttled_response(error: UpstreamThrottledError):
+    """Pass watsonx throttling on to the client (e.g. Weaviate) as a 429 rather than a 500"""
+    print(f"Error: {error}")
+    retry_after = int(error.retry_after) + 1 if error.retry_after else 1
+    return jsonify(error=f"{error}"), 429, {"Retry-After": str(retry_after)}
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = Metrics.latest_metrics()
+    return Response(body, content_type=content_type)
+
 @app.route('/meta', methods=['GET'])
 def hello_world():
     return jsonify(meta="This API is to query an embedding model from watsonx")
@@ -32,7 +60,7 @@ def live():
 
 @app.route('/.well-known/ready', methods=['GET'])
 def ready():
-    if embedding_model:
+    if embedding_service.is_ready():
         return '', 204
     else:
         return jsonify(status="not ready"), 503
@@ -40,7 +68,7 @@ def ready():
 @app.route('/vectors', methods=['POST'])
 def vectors():
     try:
-        if not embedding_model:
+        if not embedding_service.is_ready():
             raise Exception("Sorry, the embedding model is not ready")
 
         data = request.get_data().decode('utf-8')
@@ -50,37 +78,75 @@ def vectors():
             return jsonify({"error": "Invalid JSON"}), 400
 
         text = json_data['text']
+        try:
+            precision = vector_encoding.resolve_precision(json_data.get('precision') or request.args.get('precision'),
+                                                          EMBEDDING_OUTPUT_PRECISION)
+        except ValueError as error:
+            return jsonify({"error": f"{error}"}), 400
 
-        embedding = embedding_model.embed_query(text)
+        embedding = embedding_service.embed(text)
 
-        dim = -1
-        if embedding:
-           dim = len(embedding)
-            
-        response = {
-            "text": text,
-            "vector": embedding,
-            "dim": dim
-        }
+        # JSON unless the client asks for a binary encoding in the Accept header
+        media_type = vector_encoding.negotiate_media_type(request.headers.get("Accept"))
+        body, headers = vector_encoding.encode_vector(text, embedding, media_type, precision)
+        body, headers = vector_encoding.maybe_gzip(body, headers, request.headers.get("Accept-Encoding"))
 
-        return jsonify(response)
+        return Response(body, headers=headers)
     
+    except UpstreamThrottledError as error:
+        return _throttled_response(error)
     except Exception as error:
         print(f"Error: {error}")
         return f"Error: {error}", 500
 
-if __name__ == '__main__':
-    def embedding_model_connection_thread():
-        print("Connecting the embedding model from WatsonX...")
-        global embedding_model
-        embedding_model = WatsonxClient.request_embedding_model()
+@app.route('/vectors/batch', methods=['POST'])
+def vectors_batch():
+    """Embed a list of texts given as {"texts": [...]} in one call"""
+    try:
+        if not embedding_service.is_ready():
+            raise Exception("Sorry, the embedding model is not ready")
 
-        if embedding_model:
-            print("\nConnected the embedding model...")
-        else:
-            print("\nFailed to connect the embedding model...")
+        try:
+            json_data = json.loads(request.get_data().decode('utf-8'))
+        except json.JSONDecodeError:
+            return jsonify({"error": "Invalid JSON"}), 400
+
+        texts = json_data['texts']
+        try:
+            precision = vector_encoding.resolve_precision(json_data.get('precision') or request.args.get('precision'),
+                                                          EMBEDDING_OUTPUT_PRECISION)
+        except ValueError as error:
+            return jsonify({"error": f"{error}"}), 400
+        embeddings = embedding_service.embed_many(texts)
 
-    wx_thread = Thread(target=embedding_model_connection_thread)
+        media_type = vector_encoding.negotiate_media_type(request.headers.get("Accept"))
+        body, headers = vector_encoding.encode_vectors(texts, embeddings, media_type, precision)
+        body, headers = vector_encoding.maybe_gzip(body, headers, request.headers.get("Accept-Encoding"))
+
+        return Response(body, headers=headers)
+
+    except UpstreamThrottledError as error:
+        return _throttled_response(error)
+    except Exception as error:
+        print(f"Error: {error}")
+        return f"Error: {error}", 500
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    if not embedding_service.cache:
+        return jsonify(status="the embedding cache is disabled"), 404
+    return jsonify(embedding_service.cache.stats())
+
+@app.route('/cache', methods=['DELETE'])
+def cache_invalidate():
+    """Invalidate the cached embeddings of the model given by the query parameter model_id, or all of them if not given"""
+    if not embedding_service.cache:
+        return jsonify(status="the embedding cache is disabled"), 404
+    removed = embedding_service.cache.invalidate(request.args.get("model_id"))
+    return jsonify(removed=removed)
+
+if __name__ == '__main__':
+    wx_thread = Thread(target=embedding_service.connect)
     wx_thread.start()
 
     print("\nStart the server...")
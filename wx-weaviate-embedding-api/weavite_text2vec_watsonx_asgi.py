@@ -0,0 +1,241 @@
+#
+# Copyright IBM Corp. 2024-2025
+# SPDX-License-Identifier: Apache-2.0
+#
+# Author: Nguyen, Hung (Howie) Sy
+#
+
+# The ASGI flavor of weavite_text2vec_watsonx_api.py, served by uvicorn, with the same routes.
+# Requests that cannot be served soon are rejected right away (429/503 + Retry-After) instead of
+# piling up, so a burst of Weaviate imports fails fast rather than timing out.
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from embedding_service import EmbeddingService, EMBEDDING_OUTPUT_PRECISION
+from watsonx import UpstreamThrottledError
+import service_metrics as Metrics
+import vector_encoding
+from threading import Thread
+import asyncio
+import json
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# The max number of requests being embedded at the same time (cache hits don't count),
+# the max number of requests waiting for a slot, and how long a request may wait for it
+ASGI_MAX_IN_FLIGHT = int(os.getenv("ASGI_MAX_IN_FLIGHT", "64"))
+ASGI_MAX_QUEUED = int(os.getenv("ASGI_MAX_QUEUED", "256"))
+ASGI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ASGI_QUEUE_TIMEOUT_SECONDS", "10"))
+ASGI_RETRY_AFTER_SECONDS = int(os.getenv("ASGI_RETRY_AFTER_SECONDS", "1"))
+
+class RejectedError(Exception):
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+class AdmissionController:
+    """Caps the in-flight embedding calls and keeps a bounded queue in front of them"""
+    def __init__(self, max_in_flight: int, max_queued: int, queue_timeout: float):
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._max_queued = max_queued
+        self._queue_timeout = queue_timeout
+        self.queued = 0
+        self.in_flight = 0
+
+    @asynccontextmanager
+    async def admit(self):
+        if not self._slots.locked():
+            # a free slot (and nobody waiting for it): taken right away, without queueing
+            await self._slots.acquire()
+        else:
+            await self._wait_for_slot()
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def _wait_for_slot(self):
+        if self.queued >= self._max_queued:
+            raise RejectedError(429, "Too many requests queued")
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self._queue_timeout)
+        except asyncio.TimeoutError:
+            raise RejectedError(503, "Timed out waiting for an embedding slot")
+        finally:
+            self.queued -= 1
+
+embedding_service = EmbeddingService.from_env()
+admission_controller: AdmissionController | None = None
+
+# One worker thread per in-flight slot, so that concurrent texts can reach the batcher together
+embedding_executor = ThreadPoolExecutor(max_workers=ASGI_MAX_IN_FLIGHT, thread_name_prefix="embedding")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global admission_controller
+    # created here so that it is bound to the server's event loop
+    admission_controller = AdmissionController(ASGI_MAX_IN_FLIGHT, ASGI_MAX_QUEUED, ASGI_QUEUE_TIMEOUT_SECONDS)
+    Metrics.ADMISSION_QUEUE_DEPTH.set_function(lambda: admission_controller.queued)
+
+    Thread(target=embedding_service.connect, daemon=True).start()
+    yield
+    embedding_executor.shutdown(wait=False)
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started_at = time.perf_counter()
+    response = await call_next(request)
+
+    # use the route rather than the path to keep the number of label values small
+    route = request.scope.get("route")
+    endpoint = route.path if route else "unmatched"
+    Metrics.observe_request(endpoint, response.status_code, started_at)
+    if response.status_code >= 500:
+        Metrics.ERRORS.labels(endpoint).inc()
+    return response
+
+def _rejected_response(status_code: int, reason: str) -> JSONResponse:
+    return JSONResponse({"error": reason}, status_code=status_code,
+                        headers={"Retry-After": str(ASGI_RETRY_AFTER_SECONDS)})
+
+def _media_type(request: Request) -> str:
+    return vector_encoding.negotiate_media_type(request.headers.get("accept"))
+
+def _precision(request: Request, json_data: dict) -> str:
+    return vector_encoding.resolve_precision(json_data.get('precision') or request.query_params.get('precision'),
+                                             EMBEDDING_OUTPUT_PRECISION)
+
+def _encoded_response(request: Request, body: bytes, headers: dict) -> Response:
+    body, headers = vector_encoding.maybe_gzip(body, headers, request.headers.get("accept-encoding"))
+    return Response(body, headers=headers)
+
+@app.get('/metrics')
+async def metrics():
+    body, content_type = Metrics.latest_metrics()
+    return Response(body, headers={"Content-Type": content_type})
+
+@app.get('/meta')
+async def hello_world():
+    return {"meta": "This API is to query an embedding model from watsonx"}
+
+@app.get('/.well-known/live')
+async def live():
+    return Response(status_code=204)
+
+@app.get('/.well-known/ready')
+async def ready():
+    if embedding_service.is_ready():
+        return Response(status_code=204)
+    else:
+        return JSONResponse({"status": "not ready"}, status_code=503)
+
+@app.post('/vectors')
+async def vectors(request: Request):
+    try:
+        if not embedding_service.is_ready():
+            return _rejected_response(503, "Sorry, the embedding model is not ready")
+
+        data = (await request.body()).decode('utf-8')
+        try:
+            json_data = json.loads(data)
+        except json.JSONDecodeError:
+            return JSONResponse({"error": "Invalid JSON"}, status_code=400)
+
+        text = json_data['text']
+        try:
+            precision = _precision(request, json_data)
+        except ValueError as error:
+            return JSONResponse({"error": f"{error}"}, status_code=400)
+
+        # cache hits are served without taking an embedding slot. Only the in-memory tier is looked up
+        # on the event loop, the SQLite one is looked up on a worker thread
+        embedding = embedding_service.get_cached_in_memory(text)
+        if embedding is None:
+            loop = asyncio.get_running_loop()
+            embedding = await loop.run_in_executor(embedding_executor, embedding_service.get_cached, text)
+        if embedding is None:
+            async with admission_controller.admit():
+                # the upstream call is blocking, so it is run on a worker thread
+                embedding = await loop.run_in_executor(embedding_executor, embedding_service.embed_uncached, text)
+
+        return _encoded_response(request, *vector_encoding.encode_vector(text, embedding, _media_type(request), precision))
+
+    except RejectedError as error:
+        return _rejected_response(error.status_code, error.reason)
+    except UpstreamThrottledError as error:
+        # pass watsonx throttling on to the client (e.g. Weaviate) as a 429 rather than a 500
+        print(f"Error: {error}")
+        return JSONResponse({"error": f"{error}"}, status_code=429,
+                            headers={"Retry-After": str(int(error.retry_after) + 1 if error.retry_after else ASGI_RETRY_AFTER_SECONDS)})
+    except Exception as error:
+        print(f"Error: {error}")
+        return Response(f"Error: {error}", status_code=500)
+
+@app.post('/vectors/batch')
+async def vectors_batch(request: Request):
+    """Embed a list of texts given as {"texts": [...]} in one call"""
+    try:
+        if not embedding_service.is_ready():
+            return _rejected_response(503, "Sorry, the embedding model is not ready")
+
+        try:
+            json_data = json.loads((await request.body()).decode('utf-8'))
+        except json.JSONDecodeError:
+            return JSONResponse({"error": "Invalid JSON"}, status_code=400)
+
+        texts = json_data['texts']
+        try:
+            precision = _precision(request, json_data)
+        except ValueError as error:
+            return JSONResponse({"error": f"{error}"}, status_code=400)
+        async with admission_controller.admit():
+            embeddings = await asyncio.get_running_loop().run_in_executor(embedding_executor,
+                                                                          embedding_service.embed_many, texts)
+
+        return _encoded_response(request, *vector_encoding.encode_vectors(texts, embeddings, _media_type(request), precision))
+
+    except RejectedError as error:
+        return _rejected_response(error.status_code, error.reason)
+    except UpstreamThrottledError as error:
+        # pass watsonx throttling on to the client (e.g. Weaviate) as a 429 rather than a 500
+        print(f"Error: {error}")
+        return JSONResponse({"error": f"{error}"}, status_code=429,
+                            headers={"Retry-After": str(int(error.retry_after) + 1 if error.retry_after else ASGI_RETRY_AFTER_SECONDS)})
+    except Exception as error:
+        print(f"Error: {error}")
+        return Response(f"Error: {error}", status_code=500)
+
+@app.get('/cache')
+async def cache_stats():
+    if not embedding_service.cache:
+        return JSONResponse({"status": "the embedding cache is disabled"}, status_code=404)
+    return embedding_service.cache.stats()
+
+@app.delete('/cache')
+async def cache_invalidate(model_id: str | None = None):
+    """Invalidate the cached embeddings of the model given by the query parameter model_id, or all of them if not given"""
+    if not embedding_service.cache:
+        return JSONResponse({"status": "the embedding cache is disabled"}, status_code=404)
+    removed = embedding_service.cache.invalidate(model_id)
+    return {"removed": removed}
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("\nStart the server...")
+
+    # 0.0.0.0 is recommended when running on WSL and/or container enviroments for development purposes
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("API_PORT", 5000)))